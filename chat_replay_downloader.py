@@ -12,6 +12,200 @@ from http.cookiejar import MozillaCookieJar, LoadError
 import sys
 import codecs
 from urllib import parse
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+import multiprocessing
+import queue
+import pickle
+import asyncio
+import threading
+import hashlib
+import zlib
+import sqlite3
+import random
+import collections
+import heapq
+import itertools
+import bisect
+from email.utils import parsedate_to_datetime
+
+try:
+    import aiohttp
+    import yarl
+except ImportError:  # only needed for AsyncChatReplayDownloader
+    aiohttp = None
+
+try:
+    import orjson
+except ImportError:  # optional, only used to decode JSON faster
+    orjson = None
+
+try:
+    import httpx
+except ImportError:  # only needed for HTTP/2
+    httpx = None
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:  # only needed for Parquet and Arrow output
+    pyarrow = None
+
+
+def orjson_loads(data):
+    """Decode JSON using orjson, falling back to the json module for the (rare) documents orjson rejects."""
+    try:
+        return orjson.loads(data)
+    except orjson.JSONDecodeError:
+        # e.g. lone surrogates or integers which do not fit in 64 bits
+        return json.loads(data)
+
+
+# functions which can be used to decode JSON, by name
+JSON_BACKENDS = {
+    'json': json.loads
+}
+if(orjson is not None):
+    JSON_BACKENDS['orjson'] = orjson_loads
+
+DEFAULT_JSON_BACKEND = 'orjson' if orjson is not None else 'json'
+
+
+# Conversions of times and timestamps, which are made for every message.
+# Many messages share the same second (or hour), so results are memoised.
+_MAX_MEMOISED = 100000
+_HOUR_TIMESTAMPS = {}
+_SECONDS_BY_TIME_TEXT = {}
+_TIME_TEXTS_BY_SECONDS = {}
+
+
+def _memoise(cache, key, value):
+    if(len(cache) >= _MAX_MEMOISED):
+        cache.clear()
+    cache[key] = value
+    return value
+
+
+def _parse_rfc3339_timestamp(timestamp):
+    """
+    Convert RFC3339 timestamp to microseconds (the original, slower conversion).
+    This is needed as datetime.datetime.strptime() does not support nanosecond precision.
+    """
+    info = list(filter(None, re.split('[\.|Z]{1}', timestamp))) + [0]
+    return round((datetime.datetime.strptime('{}Z'.format(info[0]), '%Y-%m-%dT%H:%M:%SZ').timestamp() + float('0.{}'.format(info[1])))*1e6)
+
+
+def timestamp_to_microseconds(timestamp):
+    """
+    Convert RFC3339 timestamp (e.g. '2020-01-01T12:34:56.789Z') to microseconds.
+    Timestamps are parsed by hand (only the start of each hour is converted by datetime),
+    giving the same results as _parse_rfc3339_timestamp.
+    """
+    if(len(timestamp) < 20 or timestamp[19] not in '.Z' or timestamp[-1] != 'Z'
+       or timestamp[13] != ':' or timestamp[16] != ':'):
+        return _parse_rfc3339_timestamp(timestamp)
+
+    hour = timestamp[:13]
+    hour_timestamp = _HOUR_TIMESTAMPS.get(hour)
+    if(hour_timestamp is None):
+        try:
+            start = datetime.datetime.strptime(hour, '%Y-%m-%dT%H')
+        except ValueError:
+            return _parse_rfc3339_timestamp(timestamp)
+
+        # datetime uses local time, so hours in which the UTC offset changes are not memoised
+        hour_timestamp = start.timestamp()
+        if(start.replace(minute=59, second=59).timestamp() - hour_timestamp != 3599):
+            hour_timestamp = False
+        _memoise(_HOUR_TIMESTAMPS, hour, hour_timestamp)
+
+    if(hour_timestamp is False):
+        return _parse_rfc3339_timestamp(timestamp)
+
+    fraction = timestamp[20:-1]
+    try:
+        seconds = hour_timestamp + int(timestamp[14:16]) * 60 + int(timestamp[17:19])
+        return round((seconds + (float('0.' + fraction) if fraction else 0.0)) * 1e6)
+    except ValueError:
+        return _parse_rfc3339_timestamp(timestamp)
+
+
+def timestamps_to_microseconds(timestamps):
+    """Convert a list of RFC3339 timestamps (e.g. those of a page of messages) to microseconds."""
+    return [timestamp_to_microseconds(timestamp) for timestamp in timestamps]
+
+
+def time_to_seconds(time_text):
+    """Convert timestamp string of the form 'hh:mm:ss' to seconds."""
+    seconds = _SECONDS_BY_TIME_TEXT.get(time_text)
+    if(seconds is None):
+        seconds = _memoise(_SECONDS_BY_TIME_TEXT, time_text, sum(abs(int(x)) * 60 ** i for i, x in enumerate(
+            reversed(time_text.replace(',', '').split(':')))) * (-1 if time_text[0] == '-' else 1))
+    return seconds
+
+
+def seconds_to_time(seconds):
+    """Convert seconds to timestamp (e.g. 75 to '1:15')."""
+    time_text = _TIME_TEXTS_BY_SECONDS.get(seconds)
+    if(time_text is None):
+        if(type(seconds) is int and 0 <= seconds < 86400):
+            minutes, second = divmod(seconds, 60)
+            hours, minute = divmod(minutes, 60)
+            if(hours):
+                time_text = '{}:{:02d}:{:02d}'.format(hours, minute, second)
+            else:
+                time_text = '{}:{:02d}'.format(minute, second)
+        else:  # e.g. '1 day, 0:00:00'
+            time_text = re.sub(
+                r'^0:0?', '', str(datetime.timedelta(0, seconds)))
+        _memoise(_TIME_TEXTS_BY_SECONDS, seconds, time_text)
+    return time_text
+
+
+def seconds_to_times(seconds_list):
+    """Convert a list of seconds (e.g. those of a page of messages) to timestamps."""
+    return [seconds_to_time(seconds) for seconds in seconds_list]
+
+
+_DEMOJIZED_WORDS = {}
+
+
+def demojize_text(text):
+    """
+    Replace emojis with their names (e.g. :thumbs_up:), so that text can be printed safely.
+    Only words with non-ASCII characters are translated (emojis never contain spaces),
+    and their translations are memoised, since the same emotes and messages are often repeated.
+    """
+    if(text.isascii()):
+        return text
+
+    words = text.split(' ')
+    for index, word in enumerate(words):
+        if(not word.isascii()):
+            translation = _DEMOJIZED_WORDS.get(word)
+            if(translation is None):
+                translation = _memoise(
+                    _DEMOJIZED_WORDS, word, emoji.demojize(word))
+            words[index] = translation
+    return ' '.join(words)
+
+
+def unpack_colour(argb_int):
+    """Given an ARGB integer, return both RGBA and hex values (as given in messages)."""
+    rgba_colour = [(argb_int >> 16) & 255, (argb_int >> 8) & 255,
+                   argb_int & 255, (argb_int >> 24) & 255]
+    return {
+        'rgba': rgba_colour,
+        'hex': '#{:02x}{:02x}{:02x}{:02x}'.format(*rgba_colour)
+    }
+
+
+def pack_colour(colour):
+    """Pack a colour (as given in messages, i.e. RGBA and hex values or an ARGB integer) into an ARGB integer."""
+    if(type(colour) is dict):
+        red, green, blue, alpha = colour['rgba']
+        return (alpha << 24) | (red << 16) | (green << 8) | blue
+    return colour
 
 
 class CallbackFunction(Exception):
@@ -59,6 +253,558 @@ class CookieError(Exception):
     pass
 
 
+class CheckpointError(Exception):
+    """Raised when a checkpoint cannot be used to resume a download."""
+    pass
+
+
+class NotLive(Exception):
+    """Raised when a video being monitored is not a YouTube live stream."""
+    pass
+
+
+class ResponseCache:
+    """
+    Persistent cache of HTTP responses, stored on disk (one file per url, compressed by default).
+    Entries expire after ttl seconds (if given). When the total size of the cache exceeds
+    max_size bytes (if given), the least recently used entries are removed.
+    """
+
+    def __init__(self, directory, ttl=None, max_size=None, compress=True):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_size = max_size
+        self.compress = compress
+
+        os.makedirs(directory, exist_ok=True)
+        self.__lock = threading.Lock()
+        self.__size = sum(stat.st_size for _, stat in self.__iter_entries())
+
+    def __iter_entries(self):
+        """Get the path and stat of each file in the cache, skipping those which are removed meanwhile."""
+        for subdirectory in os.scandir(self.directory):
+            if(subdirectory.is_dir()):
+                for entry in os.scandir(subdirectory.path):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue  # e.g. evicted or expired by another thread
+                    if(entry.is_file()):
+                        yield entry.path, stat
+
+    def __get_path(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, key[:2], key)
+
+    def __remove(self, path, size):
+        try:
+            os.remove(path)
+        except OSError:
+            return
+        with self.__lock:
+            self.__size -= size
+
+    def get(self, url):
+        """Get the cached response content of a url (None if it is not cached or has expired)."""
+        path = self.__get_path(url)
+        try:
+            stat = os.stat(path)
+            if(self.ttl is not None and time.time() - stat.st_mtime > self.ttl):
+                self.__remove(path, stat.st_size)
+                return None
+
+            with open(path, 'rb') as f:
+                content = f.read()
+
+            # mark as recently used (the modification time is when it was cached)
+            os.utime(path, (time.time(), stat.st_mtime))
+        except OSError:
+            return None
+
+        # the first byte records whether the content is compressed
+        return zlib.decompress(content[1:]) if content[:1] == b'z' else content[1:]
+
+    def set(self, url, content):
+        """Cache the response content of a url."""
+        path = self.__get_path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        data = b'z' + zlib.compress(content) if self.compress else b'r' + content
+
+        # write to a temporary file first, so that other threads never read a partial entry
+        temporary_path = '{}.{}.tmp'.format(path, threading.get_ident())
+        with open(temporary_path, 'wb') as f:
+            f.write(data)
+        try:
+            old_size = os.path.getsize(path)
+        except OSError:
+            old_size = 0
+        os.replace(temporary_path, path)
+
+        with self.__lock:
+            self.__size += len(data) - old_size
+            over_limit = self.max_size is not None and self.__size > self.max_size
+
+        if(over_limit):
+            self.__evict()
+
+    def __evict(self):
+        """Remove the least recently used entries, until the cache is below 90% of its maximum size."""
+        entries = sorted((stat.st_atime, path, stat.st_size)
+                         for path, stat in self.__iter_entries() if not path.endswith('.tmp'))
+        for _, path, size in entries:
+            with self.__lock:
+                if(self.__size <= self.max_size * 0.9):
+                    return
+            self.__remove(path, size)
+
+    def clear(self):
+        """Remove every entry from the cache (other than those still being written)."""
+        for path, stat in list(self.__iter_entries()):
+            if(not path.endswith('.tmp')):
+                self.__remove(path, stat.st_size)
+
+
+class TimeIndex:
+    """
+    Persistent, sparse index of YouTube chat replays, stored on disk (one JSON file per video).
+    For each video, it records the continuations of its chats (so that its watch page is not needed again)
+    and, about every interval seconds of the video, the continuation of the page of chat starting there.
+    Later downloads of the same video start from the closest page before their start time.
+    While a video is being indexed, its file is saved at most every save_interval seconds.
+    """
+
+    def __init__(self, directory, interval=60, save_interval=10):
+        self.directory = directory
+        self.interval = interval
+        self.save_interval = save_interval
+
+        os.makedirs(directory, exist_ok=True)
+        self.__videos = {}
+        self.__changed = set()
+        self.__saved = {}  # when each video was last saved
+        self.__lock = threading.Lock()
+
+    def __get_path(self, video_id):
+        return os.path.join(self.directory, video_id + '.json')
+
+    def __get_video(self, video_id):
+        """Get the index of a video, loading it if needed (the lock must be held)."""
+        if(video_id not in self.__videos):
+            try:
+                with open(self.__get_path(video_id), encoding='utf-8') as f:
+                    self.__videos[video_id] = json.load(f)
+            except (OSError, ValueError):
+                self.__videos[video_id] = {
+                    'continuations': None,
+                    'duration': None,
+                    'checkpoints': {}  # [offset in milliseconds, continuation] pairs, by first continuation
+                }
+        return self.__videos[video_id]
+
+    def get_info(self, video_id):
+        """Get the continuations (by title) and the length of a video, or None if they are not known."""
+        with self.__lock:
+            video = self.__get_video(video_id)
+            if(video['continuations'] is None):
+                return None
+            return dict(video['continuations']), video['duration']
+
+    def set_info(self, video_id, continuations, duration):
+        """Record the continuations (by title) and the length of a video."""
+        with self.__lock:
+            video = self.__get_video(video_id)
+            video['continuations'] = dict(continuations)
+            video['duration'] = duration
+            self.__changed.add(video_id)
+        self.save(video_id)
+
+    def find(self, video_id, first_continuation, offset_milliseconds):
+        """
+        Get the continuation of the last recorded page (of the chat starting at first_continuation) which
+        starts at or before offset_milliseconds, or None if there is none.
+        """
+        with self.__lock:
+            checkpoints = self.__get_video(video_id)['checkpoints'].get(
+                first_continuation, [])
+            position = bisect.bisect_right(
+                [offset for offset, continuation in checkpoints], offset_milliseconds)
+            return checkpoints[position - 1][1] if position > 0 else None
+
+    def add(self, video_id, first_continuation, offset_milliseconds, continuation):
+        """
+        Record the continuation of a page (of the chat starting at first_continuation) starting at
+        offset_milliseconds, unless a recorded page starts less than interval seconds before it.
+        """
+        with self.__lock:
+            checkpoints = self.__get_video(video_id)['checkpoints'].setdefault(
+                first_continuation, [])
+            offsets = [offset for offset, _ in checkpoints]
+            position = bisect.bisect_right(offsets, offset_milliseconds)
+            if(position > 0 and offset_milliseconds - offsets[position - 1] < self.interval * 1000):
+                return
+            checkpoints.insert(position, [offset_milliseconds, continuation])
+            self.__changed.add(video_id)
+            save = time.monotonic() - \
+                self.__saved.get(video_id, 0) >= self.save_interval
+        if(save):
+            self.save(video_id)
+
+    def remove(self, video_id):
+        """Forget everything about a video (e.g. if its continuations no longer work)."""
+        with self.__lock:
+            self.__videos.pop(video_id, None)
+            self.__changed.discard(video_id)
+            try:
+                os.remove(self.__get_path(video_id))
+            except OSError:
+                pass
+
+    def save(self, video_id):
+        """Save the index of a video, if it has changed."""
+        with self.__lock:
+            if(video_id not in self.__changed):
+                return
+            self.__changed.discard(video_id)
+            self.__saved[video_id] = time.monotonic()
+            text = json.dumps(self.__videos[video_id])
+
+            # replace the file at once, so that it is never read while partially written
+            path = self.__get_path(video_id)
+            temporary_path = '{}.{}.tmp'.format(path, threading.get_ident())
+            with open(temporary_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(temporary_path, path)
+
+
+class DownloadStats:
+    """
+    Statistics of downloads, which ChatReplayDownloader adds to as it works (from any number of threads):
+    the latency and size of each request, the time spent decoding responses, parsing pages, running
+    callbacks, writing output, sleeping (between pages of live chat) and waiting before requests (because of
+    rate limits and retries), the number of retried requests, and the number of messages per page.
+    """
+
+    PHASES = ('decode', 'parse', 'callback', 'write', 'sleep', 'throttle')
+
+    # upper bounds of the buckets of the request latency histogram, in seconds
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__start = time.monotonic()
+        self.requests = 0
+        self.failed_requests = 0  # i.e. with an error status (or a connection error)
+        self.retries = 0
+        self.request_seconds = 0
+        self.max_request_seconds = 0
+        self.latency_buckets = [0] * len(self.LATENCY_BUCKETS)
+        self.bytes = 0
+        self.cache_hits = 0
+        self.cached_bytes = 0
+        self.pages = 0
+        self.messages = 0
+        self.max_page_messages = 0
+        self.phase_seconds = {phase: 0 for phase in self.PHASES}
+
+    def add_request(self, seconds, num_of_bytes, status_code=200):
+        """Add a request (status_code is None if it failed with a connection error)."""
+        with self.__lock:
+            self.requests += 1
+            if(status_code is None or status_code >= 400):
+                self.failed_requests += 1
+            self.request_seconds += seconds
+            self.max_request_seconds = max(self.max_request_seconds, seconds)
+            for index, bound in enumerate(self.LATENCY_BUCKETS):
+                if(seconds <= bound):
+                    self.latency_buckets[index] += 1
+                    break
+            self.bytes += num_of_bytes
+
+    def add_retry(self):
+        with self.__lock:
+            self.retries += 1
+
+    def add_cache_hit(self, num_of_bytes):
+        with self.__lock:
+            self.cache_hits += 1
+            self.cached_bytes += num_of_bytes
+
+    def add_time(self, phase, seconds):
+        with self.__lock:
+            self.phase_seconds[phase] += seconds
+
+    def add_page(self, num_of_messages):
+        with self.__lock:
+            self.pages += 1
+            self.messages += num_of_messages
+            self.max_page_messages = max(
+                self.max_page_messages, num_of_messages)
+
+    def to_dict(self):
+        """Get a snapshot of the statistics (which can be saved as JSON)."""
+        with self.__lock:
+            return {
+                'elapsed_seconds': time.monotonic() - self.__start,
+                'requests': self.requests,
+                'failed_requests': self.failed_requests,
+                'retries': self.retries,
+                'request_seconds': self.request_seconds,
+                'max_request_seconds': self.max_request_seconds,
+                'latency_buckets': dict(zip(map(str, self.LATENCY_BUCKETS), self.latency_buckets)),
+                'bytes': self.bytes,
+                'cache_hits': self.cache_hits,
+                'cached_bytes': self.cached_bytes,
+                'pages': self.pages,
+                'messages': self.messages,
+                'max_page_messages': self.max_page_messages,
+                'phase_seconds': dict(self.phase_seconds)
+            }
+
+    def to_prometheus(self, prefix='chat_replay_downloader'):
+        """Get the statistics in the Prometheus text format."""
+        stats = self.to_dict()
+        lines = []
+
+        def add(name, metric_type, description, samples):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, description))
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, metric_type))
+            for suffix, value in samples:
+                lines.append('{}_{}{} {}'.format(prefix, name, suffix, value))
+
+        cumulative = 0
+        buckets = []
+        for bound, count in stats['latency_buckets'].items():
+            cumulative += count
+            buckets.append(('_bucket{{le="{}"}}'.format(bound), cumulative))
+        buckets += [('_bucket{le="+Inf"}', stats['requests']),
+                    ('_sum', stats['request_seconds']), ('_count', stats['requests'])]
+
+        add('request_duration_seconds', 'histogram',
+            'Latency of requests.', buckets)
+        add('failed_requests_total', 'counter', 'Number of requests with an error status.',
+            [('', stats['failed_requests'])])
+        add('retries_total', 'counter', 'Number of failed requests which were retried.',
+            [('', stats['retries'])])
+        add('response_bytes_total', 'counter', 'Size of responses.',
+            [('', stats['bytes'])])
+        add('cache_hits_total', 'counter', 'Number of responses taken from the cache.',
+            [('', stats['cache_hits'])])
+        add('pages_total', 'counter', 'Number of pages of messages parsed.',
+            [('', stats['pages'])])
+        add('messages_total', 'counter', 'Number of messages parsed.',
+            [('', stats['messages'])])
+        add('phase_seconds_total', 'counter', 'Time spent in each phase of downloads.',
+            [('{{phase="{}"}}'.format(phase), seconds) for phase, seconds in stats['phase_seconds'].items()])
+        add('elapsed_seconds', 'gauge', 'Time since the statistics were created.',
+            [('', stats['elapsed_seconds'])])
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Get a summary of the statistics (as printed by --profile)."""
+        stats = self.to_dict()
+        requests = stats['requests']
+        lines = [
+            '{:<10} {:>10.3f}s'.format('elapsed', stats['elapsed_seconds']),
+            '{:<10} {:>10.3f}s  {} requests ({} failed, {} retried), {:.3f}s on average, {:.3f}s at most, {:.1f} MB'.format(
+                'requests', stats['request_seconds'], requests, stats['failed_requests'], stats['retries'],
+                stats['request_seconds'] / requests if requests else 0, stats['max_request_seconds'], stats['bytes'] / 1e6)
+        ]
+        if(stats['cache_hits']):
+            lines[-1] += ' (and {} from the cache, {:.1f} MB)'.format(
+                stats['cache_hits'], stats['cached_bytes'] / 1e6)
+        for phase, seconds in stats['phase_seconds'].items():
+            lines.append('{:<10} {:>10.3f}s'.format(phase, seconds))
+        lines.append('{:<10} {:>10}   {} messages, {:.1f} per page on average, {} at most'.format(
+            'pages', stats['pages'], stats['messages'],
+            stats['messages'] / stats['pages'] if stats['pages'] else 0, stats['max_page_messages']))
+        return '\n'.join(lines)
+
+
+class StatsExporter:
+    """
+    Save download statistics to a file every interval seconds (and when closed), so that they can be
+    monitored. The file is written in JSON if its name ends in .json, otherwise in the Prometheus text format.
+    """
+
+    def __init__(self, stats, file_name, interval=10):
+        self.stats = stats
+        self.file_name = file_name
+        self.interval = interval
+        self.__closed = threading.Event()
+        self.save()
+        threading.Thread(target=self.__save_periodically,
+                         daemon=True).start()
+
+    def __save_periodically(self):
+        while not self.__closed.wait(self.interval):
+            self.save()
+
+    def save(self):
+        if(self.file_name.lower().endswith('.json')):
+            text = json.dumps(self.stats.to_dict(), indent=4)
+        else:
+            text = self.stats.to_prometheus()
+
+        # replace the file at once, so that it is never read while partially written
+        temporary_file_name = self.file_name + '.tmp'
+        with open(temporary_file_name, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(temporary_file_name, self.file_name)
+
+    def close(self):
+        self.__closed.set()
+        self.save()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class RequestScheduler:
+    """
+    Decide when requests are sent, and whether failed requests are retried (thread-safe, and shared by
+    every download of a session).
+
+    Requests to each host are limited by a token bucket. Its rate is unlimited (or max_rate) until
+    requests are throttled (429 or 503) several times within a few seconds, after which it is halved (from
+    the rate requests were being made at), and then increased again by one request per second every second
+    while requests succeed. Isolated rejections (e.g. random errors) are only retried.
+
+    Requests which fail with a status in RETRY_STATUS_CODES (or a connection error) are retried up to
+    max_retries times, after a random delay of up to backoff * 2**attempt seconds (at most max_backoff),
+    or after the delay given by the Retry-After header.
+    """
+
+    RETRY_STATUS_CODES = frozenset((429, 500, 502, 503, 504))
+    THROTTLE_STATUS_CODES = frozenset((429, 503))
+
+    # number of seconds of requests used to estimate the rate requests are made at (and to count rejections)
+    __WINDOW = 5
+    # number of rejections within the window after which the rate is halved
+    __DENSE_REJECTIONS = 3
+    # number of requests per second the rate increases by, every second
+    __INCREASE = 1
+
+    def __init__(self, max_rate=None, min_rate=0.2, burst=1, max_retries=5, backoff=0.5, max_backoff=60):
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.__hosts = {}
+        self.__lock = threading.Lock()
+        self.__random = random.Random()
+
+    def __get_host(self, url):
+        host = parse.urlsplit(url).netloc
+        if(host not in self.__hosts):
+            self.__hosts[host] = {
+                'rate': self.max_rate,
+                'tokens': self.burst,
+                'updated': time.monotonic(),
+                'blocked_until': 0,
+                'throttled': 0,
+                'increased': 0,
+                'times': collections.deque(),
+                'rejections': collections.deque()
+            }
+        return self.__hosts[host]
+
+    def get_rate(self, url):
+        """Get the current rate limit of the host of a url (None if unlimited)."""
+        with self.__lock:
+            return self.__get_host(url)['rate']
+
+    def reserve(self, url):
+        """Reserve a request to url, and get the number of seconds to wait before sending it."""
+        now = time.monotonic()
+        with self.__lock:
+            host = self.__get_host(url)
+            times = host['times']
+            times.append(now)
+            while(now - times[0] > self.__WINDOW):
+                times.popleft()
+
+            delay = max(0, host['blocked_until'] - now)
+            rate = host['rate']
+            if(rate is not None):
+                host['tokens'] = min(self.burst, host['tokens'] +
+                                     (now - host['updated']) * rate) - 1
+                if(host['tokens'] < 0):
+                    delay = max(delay, -host['tokens'] / rate)
+            # kept up to date without a rate too, so that the bucket does not refill from before one is set
+            host['updated'] = now
+            return delay
+
+    def record(self, url, attempt, status_code=None, retry_after=None):
+        """
+        Record the result of a request to url (status_code is None after a connection error), and
+        get the number of seconds to wait before retrying it, or None if it should not be retried.
+        """
+        now = time.monotonic()
+        with self.__lock:
+            host = self.__get_host(url)
+            if(status_code is not None and status_code not in self.RETRY_STATUS_CODES):
+                rate = host['rate']
+                if(rate is not None and status_code < 400):
+                    # the increase depends on the time since the last one, not on the number of requests
+                    # (which is small at low rates)
+                    rate += min(now - host['increased'], self.__WINDOW) * self.__INCREASE
+                    host['increased'] = now
+                    host['rate'] = rate if self.max_rate is None else min(
+                        rate, self.max_rate)
+                return None
+
+            retry_after = self.parse_retry_after(retry_after)
+            if(status_code in self.THROTTLE_STATUS_CODES):
+                rejections = host['rejections']
+                rejections.append(now)
+                while(now - rejections[0] > self.__WINDOW):
+                    rejections.popleft()
+                # slow down only when rejections are dense, and at most once per window
+                # (the previous rate needs time to take effect, and requests made at the same time often fail together)
+                if(len(rejections) >= self.__DENSE_REJECTIONS and now - host['throttled'] >= self.__WINDOW):
+                    host['throttled'] = host['increased'] = now
+                    rejections.clear()
+                    times = host['times']
+                    observed_rate = len(times) / max(now - times[0], 1)
+                    if(host['rate'] is not None):
+                        observed_rate = min(observed_rate, host['rate'])
+                    host['rate'] = max(self.min_rate, observed_rate / 2)
+                    host['tokens'] = min(host['tokens'], 0)
+                    host['updated'] = now
+            if(retry_after is not None):
+                host['blocked_until'] = max(
+                    host['blocked_until'], now + retry_after)
+
+            if(attempt >= self.max_retries):
+                return None
+            delay = self.__random.uniform(
+                0, min(self.max_backoff, self.backoff * 2 ** attempt))
+            return max(delay, retry_after or 0)
+
+    @staticmethod
+    def parse_retry_after(value):
+        """Get the number of seconds given by a Retry-After header (a number of seconds or a date)."""
+        if(value is None):
+            return None
+        try:
+            return max(0, float(value))
+        except ValueError:
+            pass
+        try:
+            date = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if(date.tzinfo is None):
+            date = date.replace(tzinfo=datetime.timezone.utc)
+        return max(0, (date - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+
 class ChatReplayDownloader:
     """A simple tool used to retrieve YouTube/Twitch chat from past broadcasts/VODs. No authentication needed!"""
 
@@ -74,7 +820,9 @@ class ChatReplayDownloader:
 
     __TWITCH_REGEX = r'(?:/videos/|/v/)(\d+)'
     __TWITCH_CLIENT_ID = 'kimne78kx3ncx6brgo4mv6wki5h1ko'  # public client id
-    __TWITCH_API_TEMPLATE = 'https://api.twitch.tv/v5/videos/{}/comments?client_id={}'
+    __TWITCH_API = 'https://api.twitch.tv'
+    __TWITCH_API_TEMPLATE = '{}/v5/videos/{}/comments?client_id={}'
+    __TWITCH_VIDEO_TEMPLATE = '{}/v5/videos/{}?client_id={}'
 
     __TYPES_OF_MESSAGES = {
         'ignore': [
@@ -104,6 +852,12 @@ class ChatReplayDownloader:
     for key in __TYPES_OF_MESSAGES:
         __TYPES_OF_KNOWN_MESSAGES.extend(__TYPES_OF_MESSAGES[key])
 
+    # sets used to classify items
+    __IGNORED_TYPES = frozenset(__TYPES_OF_MESSAGES['ignore'])
+    __NORMAL_TYPES = frozenset(__TYPES_OF_MESSAGES['message'])
+    __SUPERCHAT_TYPES = frozenset(
+        __TYPES_OF_MESSAGES['superchat_message'] + __TYPES_OF_MESSAGES['superchat_ticker'])
+
     __IMPORTANT_KEYS_AND_REMAPPINGS = {
         'timestampUsec': 'timestamp',
         'authorExternalChannelId': 'author_id',
@@ -121,10 +875,77 @@ class ChatReplayDownloader:
         'backgroundColor': 'body_color'
     }
 
-    def __init__(self, cookies=None):
-        """Initialise a new session for making requests."""
-        self.session = requests.Session()
-        self.session.headers = self.__HEADERS
+    # every key a message can have (e.g. the columns of CSV output)
+    MESSAGE_KEYS = sorted(set(__IMPORTANT_KEYS_AND_REMAPPINGS.values()) | {
+        'badges', 'time_in_seconds', 'video_offset_time_msec'})
+
+    # encodings which responses can be compressed with (including brotli, if it is installed)
+    __ACCEPT_ENCODING = getattr(
+        requests.utils, 'DEFAULT_ACCEPT_ENCODING', 'gzip, deflate')
+
+    # errors after which a request is retried
+    __CONNECTION_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError) + (
+        (httpx.TransportError,) if httpx is not None else ())
+
+    def __init__(self, cookies=None, max_connections_per_host=None, cache=None, json_backend=None, compact=False,
+                 youtube_home=None, twitch_api=None, stats=None, scheduler=None, pool_size=32, connect_timeout=10,
+                 read_timeout=60, http2=False, time_index=None, parse_processes=None):
+        """
+        Initialise a new session for making requests.
+        The session may be shared by many threads, in which case max_connections_per_host
+        limits the number of requests made to the same host at the same time.
+        If a ResponseCache is given, responses which do not change (chat replay continuations,
+        Twitch comments and the watch pages of videos which only have chat replays) are cached.
+        Live chat, and the watch pages of live, upcoming or unavailable videos, are never cached.
+        json_backend is the name of the function used to decode JSON (see JSON_BACKENDS),
+        or a function which decodes bytes and strings. By default, orjson is used if it is installed.
+        If compact is set, messages are ChatMessage records instead of dictionaries (which use much less memory).
+        youtube_home and twitch_api replace the base urls of YouTube and of the Twitch API,
+        e.g. to use a local stand-in server (see run_server.py).
+        Statistics of the downloads are added to stats (a new DownloadStats by default).
+        scheduler limits the rate of requests and retries failed requests (a new RequestScheduler by default).
+        pool_size is the number of connections to each host which are kept alive to be reused (it should be
+        at least the number of threads making requests at the same time). Requests fail (and are retried)
+        after connect_timeout seconds without a connection or read_timeout seconds without a response.
+        If http2 is set, requests are made with httpx over HTTP/2 (pip install httpx[http2]).
+        If a TimeIndex is given, the chat replays of YouTube videos are indexed as they are downloaded,
+        so that later downloads of the same video start close to their start time.
+        If parse_processes is given, pages of YouTube chat replay are decoded and parsed in a pool of that
+        many processes, while a thread keeps fetching the next pages (see __iter_youtube_pipeline).
+        """
+        self.compact = compact
+        self.time_index = time_index
+        self.parse_processes = parse_processes
+        self.__parse_pool = None
+        self.__parse_pool_lock = threading.Lock()
+        self.stats = stats if stats is not None else DownloadStats()
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler()
+        if(youtube_home is not None):
+            self.__YT_HOME = youtube_home.rstrip('/')
+        if(twitch_api is not None):
+            self.__TWITCH_API = twitch_api.rstrip('/')
+
+        if(json_backend is None):
+            json_backend = DEFAULT_JSON_BACKEND
+        # the name (or function) is passed to parse processes, which each create their own parser
+        self.__json_backend = json_backend
+        if(not callable(json_backend)):
+            if(json_backend not in JSON_BACKENDS):
+                raise ValueError('Unknown JSON backend: {} (available: {})'.format(
+                    json_backend, ', '.join(JSON_BACKENDS)))
+            json_backend = JSON_BACKENDS[json_backend]
+        elif(parse_processes):
+            try:
+                pickle.dumps(json_backend)
+            except (pickle.PicklingError, AttributeError, TypeError):
+                raise ValueError(
+                    'json_backend must be the name of a backend, or a module-level function, to use parse_processes.')
+        self.json_loads = json_backend
+
+        self.cache = cache
+        self.max_connections_per_host = max_connections_per_host
+        self.__host_semaphores = {}
+        self.__host_semaphores_lock = threading.Lock()
 
         cj = MozillaCookieJar(cookies)
         if cookies is not None:
@@ -134,57 +955,126 @@ class ChatReplayDownloader:
             else:
                 raise CookieError(
                     "The file '{}' could not be found.".format(cookies))
-        self.session.cookies = cj
+        self.cookies = cj
+
+        self.session = self.__create_session(
+            pool_size, connect_timeout, read_timeout, http2)
+
+    def __create_session(self, pool_size, connect_timeout, read_timeout, http2):
+        """Create the session used to make requests, keeping connections alive to be reused."""
+        if(http2):
+            if(httpx is None):
+                raise ImportError(
+                    'httpx must be installed (pip install httpx[http2]) to use HTTP/2.')
+            self.__request_arguments = {}
+            return httpx.Client(
+                http2=True,
+                headers=self.__HEADERS,
+                cookies=self.cookies,
+                follow_redirects=True,
+                timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+                limits=httpx.Limits(max_connections=None,
+                                    max_keepalive_connections=pool_size)
+            )
+
+        session = requests.Session()
+        session.headers = dict(
+            self.__HEADERS, **{'Accept-Encoding': self.__ACCEPT_ENCODING})
+        session.cookies = self.cookies
+        # by default, only 10 connections to each host are kept (the others are closed after each request)
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        self.__request_arguments = {
+            'timeout': (connect_timeout, read_timeout)}
+        return session
+
+    def __get_host_semaphore(self, url):
+        """Get the semaphore limiting the number of simultaneous requests to the host of a url."""
+        host = parse.urlsplit(url).netloc
+        with self.__host_semaphores_lock:
+            if(host not in self.__host_semaphores):
+                self.__host_semaphores[host] = threading.BoundedSemaphore(
+                    self.max_connections_per_host)
+            return self.__host_semaphores[host]
+
+    def __send(self, url):
+        if(self.max_connections_per_host is None):
+            return self.session.get(url, **self.__request_arguments)
+
+        with self.__get_host_semaphore(url):
+            return self.session.get(url, **self.__request_arguments)
+
+    def __wait(self, delay):
+        if(delay > 0):
+            time.sleep(delay)
+            self.stats.add_time('throttle', delay)
 
     def __session_get(self, url):
-        """Make a request using the current session."""
-        return self.session.get(url)
-
-    def __session_get_json(self, url):
-        """Make a request using the current session and get json data."""
-        return self.__session_get(url).json()
-
-    def __timestamp_to_microseconds(self, timestamp):
-        """
-        Convert RFC3339 timestamp to microseconds.
-        This is needed as datetime.datetime.strptime() does not support nanosecond precision.
-        """
-        info = list(filter(None, re.split('[\.|Z]{1}', timestamp))) + [0]
-        return round((datetime.datetime.strptime('{}Z'.format(info[0]), '%Y-%m-%dT%H:%M:%SZ').timestamp() + float('0.{}'.format(info[1])))*1e6)
-
-    def __time_to_seconds(self, time):
-        """Convert timestamp string of the form 'hh:mm:ss' to seconds."""
-        return sum(abs(int(x)) * 60 ** i for i, x in enumerate(reversed(time.replace(',', '').split(':')))) * (-1 if time[0] == '-' else 1)
-
-    def __seconds_to_time(self, seconds):
-        """Convert seconds to timestamp."""
-        return re.sub(r'^0:0?', '', str(datetime.timedelta(0, seconds)))
+        """Make a request using the current session, when the scheduler allows it (retrying it if it fails)."""
+        attempt = 0
+        while True:
+            self.__wait(self.scheduler.reserve(url))
+            start = time.perf_counter()
+            try:
+                response = self.__send(url)
+            except self.__CONNECTION_ERRORS:
+                self.stats.add_request(time.perf_counter() - start, 0, None)
+                delay = self.scheduler.record(url, attempt)
+                if(delay is None):
+                    raise
+            else:
+                self.stats.add_request(time.perf_counter() - start,
+                                       len(response.content), response.status_code)
+                delay = self.scheduler.record(
+                    url, attempt, response.status_code, response.headers.get('Retry-After'))
+                if(delay is None):
+                    return response
+
+            self.stats.add_retry()
+            self.__wait(delay)
+            attempt += 1
+
+    def _get_cached_content(self, url):
+        """Get the content of a cached response (None if there is no cache, or it is not cached)."""
+        if(self.cache is None):
+            return None
+        content = self.cache.get(url)
+        if(content is not None):
+            self.stats.add_cache_hit(len(content))
+        return content
+
+    def _is_replay_info(self, continuation_by_title_map):
+        """Whether the continuations of a video are all chat replays (so its watch page no longer changes)."""
+        return bool(continuation_by_title_map) and all(
+            title.endswith(' replay') for title in continuation_by_title_map)
+
+    def __session_get_content(self, url, cacheable=False):
+        """Make a request using the current session (or the cache) and get the response content."""
+        if(cacheable):
+            content = self._get_cached_content(url)
+            if(content is not None):
+                return content
+
+        response = self.__session_get(url)
+        if(cacheable and self.cache is not None and response.status_code == 200):
+            self.cache.set(url, response.content)
+
+        return response.content
+
+    def __session_get_json(self, url, cacheable=False):
+        """Make a request using the current session (or the cache) and get json data."""
+        content = self.__session_get_content(url, cacheable)
+        start = time.perf_counter()
+        data = self.json_loads(content)
+        self.stats.add_time('decode', time.perf_counter() - start)
+        return data
 
     def __microseconds_to_timestamp(self, microseconds):
         """Convert unix time to human-readable timestamp."""
         return datetime.datetime.fromtimestamp(microseconds//1000000).strftime('%Y-%m-%d %H:%M:%S')
 
-    def __arbg_int_to_rgba(self, argb_int):
-        """Convert ARGB integer to RGBA array."""
-        red = (argb_int >> 16) & 255
-        green = (argb_int >> 8) & 255
-        blue = argb_int & 255
-        alpha = (argb_int >> 24) & 255
-        return [red, green, blue, alpha]
-
-    def __rgba_to_hex(self, colours):
-        """Convert RGBA array to hex colour."""
-        return '#{:02x}{:02x}{:02x}{:02x}'.format(*colours)
-
-    def __get_colours(self, argb_int):
-        """Given an ARGB integer, return both RGBA and hex values."""
-        rgba_colour = self.__arbg_int_to_rgba(argb_int)
-        hex_colour = self.__rgba_to_hex(rgba_colour)
-        return {
-            'rgba': rgba_colour,
-            'hex': hex_colour
-        }
-
     def message_to_string(self, item):
         """
         Format item for printing to standard output.
@@ -205,10 +1095,10 @@ class ChatReplayDownloader:
         Ensure printing to standard output can be done safely (especially on Windows).
         There are usually issues with printing emojis and non utf-8 characters.
         """
-        message = emoji.demojize(self.message_to_string(item))
+        message = demojize_text(self.message_to_string(item))
 
         try:
-            safe_string = message.encode(
+            safe_string = message if message.isascii() else message.encode(
                 'utf-8', 'ignore').decode('utf-8', 'ignore')
             print(safe_string, flush=True)
         except UnicodeEncodeError:
@@ -230,39 +1120,122 @@ class ChatReplayDownloader:
 
     def __parse_message_runs(self, runs):
         """ Reads and parses YouTube formatted messages (i.e. runs). """
-        message_text = ''
+        if(len(runs) == 1 and 'text' in runs[0] and 'navigationEndpoint' not in runs[0]):
+            return runs[0]['text']  # most messages are a single run of text
+
+        message_text = []
         for run in runs:
             if 'text' in run:
                 if 'navigationEndpoint' in run:  # is a link
                     try:
                         url = run['navigationEndpoint']['commandMetadata']['webCommandMetadata']['url']
-                        message_text += self.__parse_youtube_link(url)
+                        message_text.append(self.__parse_youtube_link(url))
                     except:
                         # if something fails, use default text
-                        message_text += run['text']
+                        message_text.append(run['text'])
 
                 else:  # is a normal message
-                    message_text += run['text']
+                    message_text.append(run['text'])
             elif 'emoji' in run:
-                message_text += run['emoji']['shortcuts'][0]
+                message_text.append(run['emoji']['shortcuts'][0])
             else:
-                message_text += str(run)
-
-        return message_text
-
-    _YT_INITIAL_DATA_RE = r'(?:window\s*\[\s*["\']ytInitialData["\']\s*\]|ytInitialData)\s*=\s*({.+?})\s*;'
-    def __get_initial_youtube_info(self, video_id):
-        """ Get initial YouTube video information. """
-        original_url = '{}/watch?v={}'.format(self.__YT_HOME, video_id)
-        html = self.__session_get(original_url)
-
-        info = re.search(self._YT_INITIAL_DATA_RE, html.text)
+                message_text.append(str(run))
+
+        return ''.join(message_text)
+
+    # start of the ytInitialData object (its end is found separately)
+    _YT_INITIAL_DATA_RE = r'(?:window\s*\[\s*["\']ytInitialData["\']\s*\]|ytInitialData)\s*=\s*(?={)'
+    # where a JSON object at the start of a statement usually ends
+    __JSON_END_CANDIDATE_RE = re.compile(r'}\s*;')
+    # skips everything up to the next brace which is not inside a string (or the end of the text).
+    # The closing quote is optional, so that an unterminated string cannot cause backtracking.
+    __JSON_NEXT_BRACE_RE = re.compile(
+        r'[^{}"]*(?:"[^"\\]*(?:\\.[^"\\]*)*"?[^{}"]*)*([{}]|\Z)')
+    _YT_LENGTH_SECONDS_RE = r'"lengthSeconds"\s*:\s*"(\d+)"'
+    def __get_initial_youtube_info(self, video_id, refresh=False):
+        """
+        Get initial YouTube video information.
+        Returns the continuations (by title), the length of the video in seconds (None if unknown)
+        and whether they were taken from the time index. If refresh is set, the watch page is fetched
+        again (rather than taken from the time index or the cache).
+        """
+        if(self.time_index is not None and not refresh):
+            info = self.time_index.get_info(video_id)
+            if(info is not None):
+                return info + (True,)
+
+        url = self._get_watch_url(video_id)
+        content = None if refresh else self._get_cached_content(url)
+        response = None
+        if(content is None):
+            response = self.__session_get(url)
+            content = response.content
+        start = time.perf_counter()
+        try:
+            continuation_by_title_map, duration = self._parse_initial_youtube_info(
+                content.decode('utf-8', 'replace'))
+        finally:
+            self.stats.add_time('parse', time.perf_counter() - start)
+
+        # live streams become replays later, so only the watch pages (and continuations) of replays are kept
+        if(self._is_replay_info(continuation_by_title_map)):
+            if(response is not None and response.status_code == 200 and self.cache is not None):
+                self.cache.set(url, content)
+            if(self.time_index is not None):
+                self.time_index.set_info(
+                    video_id, continuation_by_title_map, duration)
+        return continuation_by_title_map, duration, False
+
+    def _get_watch_url(self, video_id):
+        """Get the url of a YouTube video's watch page."""
+        return '{}/watch?v={}'.format(self.__YT_HOME, video_id)
+
+    def _find_json_end(self, text, start):
+        """
+        Find the end of the JSON object which starts at text[start], in a single pass
+        (only counting braces outside of strings). Returns None if the object is not closed.
+        """
+        depth = 0
+        for match in self.__JSON_NEXT_BRACE_RE.finditer(text, start):
+            brace = match.group(1)
+            if(brace == '{'):
+                depth += 1
+            elif(brace == '}'):
+                depth -= 1
+                if(depth == 0):
+                    return match.end()
+            else:
+                break
+        return None
 
-        if(not info):
+    def __decode_json_object(self, text, start):
+        """
+        Decode the JSON object which starts at text[start], or return None if it is not closed.
+        The object usually ends at the first closing brace followed by a semicolon, so that is
+        tried first (which saves scanning it). Otherwise, its end is found by _find_json_end.
+        """
+        candidate = self.__JSON_END_CANDIDATE_RE.search(text, start)
+        if(candidate):
+            try:
+                return self.json_loads(text[start:candidate.start() + 1])
+            except ValueError:
+                pass  # a string in the object contains '};'
+
+        end = self._find_json_end(text, start)
+        if(end is None):
+            return None
+        return self.json_loads(text[start:end])
+
+    def _parse_initial_youtube_info(self, html):
+        """Parse the continuations (by title) and the length of the video from a YouTube watch page."""
+        info = re.search(self._YT_INITIAL_DATA_RE, html)
+        ytInitialData = self.__decode_json_object(
+            html, info.end()) if info else None
+
+        if(ytInitialData is None):
             raise ParsingError(
                 'Unable to parse video data. Please try again.')
 
-        ytInitialData = json.loads(info.group(1))
         # print(ytInitialData)
         contents = ytInitialData.get('contents')
         if(not contents):
@@ -290,101 +1263,667 @@ class ChatReplayDownloader:
             for x in viewselector_submenuitems
         }
 
-        return continuation_by_title_map
+        length = re.search(self._YT_LENGTH_SECONDS_RE, html)
+        duration = int(length.group(1)) if length else None
+
+        return continuation_by_title_map, duration
+
+    def _get_replay_url(self, continuation, offset_microseconds):
+        """Get the url of YouTube replay info, given a continuation or a certain offset."""
+        return self.__YOUTUBE_API_BASE_TEMPLATE.format(self.__YT_HOME,
+                                                       'live_chat_replay', 'get_live_chat_replay', continuation) + self.__YOUTUBE_API_PARAMETERS_TEMPLATE.format(offset_microseconds)
+
+    def _get_live_url(self, continuation):
+        """Get the url of YouTube live info, given a continuation."""
+        return self.__YOUTUBE_API_BASE_TEMPLATE.format(self.__YT_HOME,
+                                                       'live_chat', 'get_live_chat', continuation)
 
     def __get_replay_info(self, continuation, offset_microseconds):
         """Get YouTube replay info, given a continuation or a certain offset."""
-        url = self.__YOUTUBE_API_BASE_TEMPLATE.format(self.__YT_HOME,
-                                                      'live_chat_replay', 'get_live_chat_replay', continuation) + self.__YOUTUBE_API_PARAMETERS_TEMPLATE.format(offset_microseconds)
-        return self.__get_continuation_info(url)
+        return self.__get_continuation_info(self._get_replay_url(continuation, offset_microseconds), cacheable=True)
 
     def __get_live_info(self, continuation):
         """Get YouTube live info, given a continuation."""
-        url = self.__YOUTUBE_API_BASE_TEMPLATE.format(self.__YT_HOME,
-                                                      'live_chat', 'get_live_chat', continuation)
-        return(self.__get_continuation_info(url))
+        return(self.__get_continuation_info(self._get_live_url(continuation)))
 
-    def __get_continuation_info(self, url):
+    def __get_continuation_info(self, url, cacheable=False):
         """Get continuation info for a YouTube video."""
-        info = self.__session_get_json(url)
+        return self._parse_continuation_info(self.__session_get_json(url, cacheable))
+
+    def _parse_continuation_info(self, info):
+        """Extract the continuation info from a YouTube (live or replay) response."""
         if('continuationContents' in info['response']):
             return info['response']['continuationContents']['liveChatContinuation']
         else:
             raise NoContinuation
 
-    def __ensure_seconds(self, time, default=0):
+    def _ensure_seconds(self, time, default=0):
         """Ensure time is returned in seconds."""
         try:
             return int(time)
         except ValueError:
-            return self.__time_to_seconds(time)
+            return time_to_seconds(time)
         except:
             return default
 
-    def __parse_item(self, item):
-        """Parse YouTube item information."""
+    # fields extracted from each type of item, in the order they are applied
+    # (later fields take precedence over earlier ones with the same name)
+    __TEXT_FIELDS = (
+        ('authorName', 'author'),
+        ('authorExternalChannelId', 'author_id'),
+        ('timestampUsec', 'timestamp'),
+        ('timestampText', 'time_text'),
+        ('message', 'message')
+    )
+    __PAID_MESSAGE_FIELDS = __TEXT_FIELDS + (
+        ('purchaseAmountText', 'amount'),
+        ('headerBackgroundColor', 'header_color'),
+        ('bodyBackgroundColor', 'body_color')
+    )
+    __PAID_STICKER_FIELDS = __TEXT_FIELDS + (
+        ('purchaseAmountText', 'amount'),
+        ('backgroundColor', 'body_color')
+    )
+    __MEMBERSHIP_FIELDS = __TEXT_FIELDS + (
+        ('headerSubtext', 'message'),
+    )
+    __TICKER_FIELDS = (
+        ('authorExternalChannelId', 'author_id'),
+        ('amount', 'amount'),
+        ('startBackgroundColor', 'body_color'),
+        ('durationSec', 'ticker_duration'),
+        ('detailText', 'message')
+    )
+
+    def __extract_fields(self, item_info, fields):
+        """Extract (and rename) the given fields of an item, using the text of simple text fields."""
         data = {}
-        index = list(item.keys())[0]
-        item_info = item[index]
+        for key, new_key in fields:
+            if(key in item_info):
+                value = item_info[key]
+                if(type(value) is dict and 'simpleText' in value):
+                    value = value['simpleText']
+                data[new_key] = value
+        return data
 
-        # Never before seen index, may cause error (used for debugging)
-        if(index not in self.__TYPES_OF_KNOWN_MESSAGES):
-            pass
+    def __parse_badges(self, item_info, data):
+        """Add the tooltips of the author's badges (if any) to the data."""
+        if('authorBadges' in item_info):
+            data['badges'] = ', '.join([
+                badge['liveChatAuthorBadgeRenderer']['tooltip']
+                for badge in item_info['authorBadges']
+                if 'liveChatAuthorBadgeRenderer' in badge and 'tooltip' in badge['liveChatAuthorBadgeRenderer']
+            ])
+
+    def __parse_chat_item(self, item_info, data, colour_keys=()):
+        """Finish parsing an item which appears in chat (normal message, superchat, sticker or membership)."""
+        self.__parse_badges(item_info, data)
+
+        message = data.get('message')
+        if(type(message) is dict):
+            data['message'] = self.__parse_message_runs(message['runs'])
+        elif(message is None):
+            data['message'] = None
 
-        important_item_info = {key: value for key, value in item_info.items(
-        ) if key in self.__IMPORTANT_KEYS_AND_REMAPPINGS}
+        data['timestamp'] = int(
+            data['timestamp']) if 'timestamp' in data else None
 
-        data.update(important_item_info)
+        if('time_text' in data):
+            data['time_in_seconds'] = int(time_to_seconds(data['time_text']))
 
-        for key in important_item_info:
-            new_key = self.__IMPORTANT_KEYS_AND_REMAPPINGS[key]
-            data[new_key] = data.pop(key)
+        for colour_key in colour_keys:
+            if(colour_key in data):
+                data[colour_key] = unpack_colour(data[colour_key])
 
-            # get simpleText if it exists
-            if(type(data[new_key]) is dict and 'simpleText' in data[new_key]):
-                data[new_key] = data[new_key]['simpleText']
+        return data
 
-        if('authorBadges' in item_info):
-            badges = []
-            for badge in item_info['authorBadges']:
-                if('liveChatAuthorBadgeRenderer' in badge and 'tooltip' in badge['liveChatAuthorBadgeRenderer']):
-                    badges.append(
-                        badge['liveChatAuthorBadgeRenderer']['tooltip'])
-            data['badges'] = ', '.join(badges)
-
-        if('showItemEndpoint' in item_info):  # has additional information
-            data.update(self.__parse_item(
-                item_info['showItemEndpoint']['showLiveChatItemEndpoint']['renderer']))
-            return data
+    def __parse_text_item(self, item_info):
+        return self.__parse_chat_item(item_info, self.__extract_fields(item_info, self.__TEXT_FIELDS))
 
-        data['message'] = self.__parse_message_runs(
-            data['message']['runs']) if 'message' in data else None
+    def __parse_paid_message_item(self, item_info):
+        return self.__parse_chat_item(item_info, self.__extract_fields(item_info, self.__PAID_MESSAGE_FIELDS), ('header_color', 'body_color'))
 
-        data['timestamp'] = int(
-            data['timestamp']) if 'timestamp' in data else None
+    def __parse_paid_sticker_item(self, item_info):
+        return self.__parse_chat_item(item_info, self.__extract_fields(item_info, self.__PAID_STICKER_FIELDS), ('body_color',))
 
-        if('time_text' in data):
-            data['time_in_seconds'] = int(
-                self.__time_to_seconds(data['time_text']))
+    def __parse_membership_item(self, item_info):
+        return self.__parse_chat_item(item_info, self.__extract_fields(item_info, self.__MEMBERSHIP_FIELDS))
 
-        for colour_key in ('header_color', 'body_color'):
-            if(colour_key in data):
-                data[colour_key] = self.__get_colours(data[colour_key])
+    def __get_shown_item(self, item_info):
+        """Get the item shown when an item (e.g. a ticker) is clicked, or None if there is none."""
+        return item_info.get('showItemEndpoint', {}).get('showLiveChatItemEndpoint', {}).get('renderer')
 
+    def __parse_ticker_item(self, item_info):
+        """
+        Parse a ticker item. Most of its information comes from the item it shows when clicked,
+        which takes precedence over the ticker's own fields (whose colours are left as integers).
+        A ticker which shows nothing is parsed like an item of an unknown type.
+        """
+        shown_item = self.__get_shown_item(item_info)
+        if(shown_item is None):
+            return self.__parse_other_item(item_info)
+        data = self.__extract_fields(item_info, self.__TICKER_FIELDS)
+        self.__parse_badges(item_info, data)
+        data.update(self.__parse_item(shown_item))
         return data
 
-    def get_youtube_messages(self, video_id, start_time=0, end_time=None, message_type='messages', chat_type='live', callback=None):
-        """ Get chat messages for a YouTube video. """
+    def __parse_other_item(self, item_info):
+        """Parse an item of an unknown type, by looking for any of the important keys."""
+        data = {}
+        for key, value in item_info.items():
+            if(key in self.__IMPORTANT_KEYS_AND_REMAPPINGS):
+                new_key = self.__IMPORTANT_KEYS_AND_REMAPPINGS[key]
+                if(key == new_key and new_key in data):
+                    # already set by a field it is remapped from, which takes precedence
+                    continue
+
+                # get simpleText if it exists
+                if(type(value) is dict and 'simpleText' in value):
+                    value = value['simpleText']
+                data[new_key] = value
+
+        shown_item = self.__get_shown_item(item_info)
+        if(shown_item is not None):  # has additional information
+            self.__parse_badges(item_info, data)
+            data.update(self.__parse_item(shown_item))
+            return data
 
-        start_time = self.__ensure_seconds(start_time, 0)
-        end_time = self.__ensure_seconds(end_time, None)
+        return self.__parse_chat_item(item_info, data, ('header_color', 'body_color'))
+
+    # parser used for each type of item (other types use __parse_other_item)
+    __ITEM_PARSERS = {
+        'liveChatTextMessageRenderer': __parse_text_item,
+        'liveChatPaidMessageRenderer': __parse_paid_message_item,
+        'liveChatPaidStickerRenderer': __parse_paid_sticker_item,
+        'liveChatMembershipItemRenderer': __parse_membership_item,
+        'liveChatTickerPaidMessageItemRenderer': __parse_ticker_item,
+        'liveChatTickerPaidStickerItemRenderer': __parse_ticker_item,
+        'liveChatTickerSponsorItemRenderer': __parse_ticker_item
+    }
+
+    def __parse_item(self, item):
+        """Parse YouTube item information."""
+        index = next(iter(item))
+        return self.__ITEM_PARSERS.get(index, ChatReplayDownloader.__parse_other_item)(self, item[index])
 
+    def __handle_message(self, data, callback):
+        """Pass a message to the callback function."""
+        if(callable(callback)):
+            start = time.perf_counter()
+            try:
+                callback(data)
+            except TypeError:
+                raise CallbackFunction(
+                    'Incorrect number of parameters for function '+callback.__name__)
+            finally:
+                self.stats.add_time('callback', time.perf_counter() - start)
+
+    def _compact_messages(self, messages):
+        """Convert messages (an iterable of dictionaries) to ChatMessage records, if the session is compact."""
+        # a generator (unlike map), so that it can be closed
+        return (ChatMessage.from_dict(message) for message in messages) if self.compact else messages
+
+    def __collect_messages(self, messages_iterator, callback):
+        """Collect all messages from a generator, passing each one to the callback function."""
         messages = []
+        # messages are printed if there is no callback function
+        console = ConsoleWriter(
+            self.message_to_string, stats=self.stats) if callback is None else None
+        try:
+            for data in messages_iterator:
+                messages.append(data)
+
+                if(console is not None):
+                    console.write(data)
+                else:
+                    self.__handle_message(data, callback)
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            if(console is not None):
+                console.close()
+
+        return messages
+
+    def _parse_youtube_page(self, info, is_live, start_time, end_time, message_type, exclusive_end=False):
+        """
+        Parse a page of YouTube continuation info.
+        Returns the messages between start_time and end_time, and whether the end of the chat has been reached.
+        If exclusive_end is set, messages at end_time are left for the next segment.
+        """
+        messages = []
+
+        if('actions' not in info):
+            # no more actions to process in a chat replay
+            return messages, not is_live
+
+        for action in info['actions']:
+            video_offset_time_msec = None
+
+            if('replayChatItemAction' in action):
+                replay_chat_item_action = action['replayChatItemAction']
+                if('videoOffsetTimeMsec' in replay_chat_item_action):
+                    video_offset_time_msec = int(
+                        replay_chat_item_action['videoOffsetTimeMsec'])
+                action = replay_chat_item_action['actions'][0]
+
+            for action_name in action:
+                if(action_name != 'clickTrackingParams'):
+                    break
+            else:
+                continue
+
+            if('item' not in action[action_name]):
+                # not a valid item to display (usually message deleted)
+                continue
+
+            item = action[action_name]['item']
+            index = next(iter(item))
+
+            if(index in self.__IGNORED_TYPES):
+                # can ignore message (not a chat message)
+                continue
+
+            # user wants everything, keep going
+            if(message_type == 'all'):
+                pass
+
+            # user does not want superchat + message is superchat
+            elif(message_type != 'superchat' and index in self.__SUPERCHAT_TYPES):
+                continue
+
+            # user does not want normal messages + message is normal
+            elif(message_type != 'messages' and index in self.__NORMAL_TYPES):
+                continue
+
+            data = self.__parse_item(item)
+            if(video_offset_time_msec is not None):
+                data['video_offset_time_msec'] = video_offset_time_msec
+
+            time_in_seconds = data.get('time_in_seconds')
+
+            valid_seconds = time_in_seconds is not None
+            if(end_time is not None and valid_seconds and (time_in_seconds >= end_time if exclusive_end else time_in_seconds > end_time)):
+                return messages, True
+
+            if(is_live or (valid_seconds and time_in_seconds >= start_time)):
+                messages.append(data)
+
+        return messages, False
+
+    def _get_page_offset(self, info):
+        """Get the offset (in milliseconds) of the first message of a page of chat replay (None if unknown)."""
+        for action in info.get('actions', ()):
+            offset = action.get('replayChatItemAction', {}).get(
+                'videoOffsetTimeMsec')
+            if(offset is not None):
+                return int(offset)
+        return None
+
+    def _get_next_continuation(self, info, continuation):
+        """
+        Get the next continuation and how long to wait (in seconds) before requesting it.
+        Returns (None, None) if there are no more continuations.
+        """
+        if('continuations' not in info):
+            return None, None
+
+        continuation_info = info['continuations'][0]
+        # possible continuations:
+        # invalidationContinuationData, timedContinuationData,
+        # liveChatReplayContinuationData, reloadContinuationData
+        continuation_info = continuation_info[next(iter(continuation_info))]
+
+        # must wait before calling again (if timeoutMs is given)
+        # prevents 429 errors (too many requests)
+        return continuation_info.get('continuation', continuation), continuation_info.get('timeoutMs', 0)/1000
+
+    # the first of the continuations of a raw page, e.g. "continuations": [{"liveChatReplayContinuationData": {...}}]
+    __CONTINUATION_DATA_REGEX = re.compile(
+        rb'"continuations"\s*:\s*\[\s*\{\s*"\w+"\s*:\s*\{([^{}]*)\}')
+    __CONTINUATION_REGEX = re.compile(rb'"continuation"\s*:\s*"([^"\\]+)"')
+    __TIMEOUT_REGEX = re.compile(rb'"timeoutMs"\s*:\s*(\d+)')
+
+    def _find_next_continuation(self, content, continuation):
+        """
+        Get the next continuation and how long to wait before requesting it (like _get_next_continuation),
+        from the raw content of a page, without decoding all of it.
+        """
+        if(b'"continuations"' not in content):
+            return None, None
+
+        match = self.__CONTINUATION_DATA_REGEX.search(content)
+        if(match is None):
+            # unexpected layout, so decode the whole page instead
+            try:
+                info = self._parse_continuation_info(self.json_loads(content))
+            except NoContinuation:
+                return None, None
+            return self._get_next_continuation(info, continuation)
+
+        continuation_match = self.__CONTINUATION_REGEX.search(match.group(1))
+        timeout_match = self.__TIMEOUT_REGEX.search(match.group(1))
+        return (continuation_match.group(1).decode() if continuation_match else continuation,
+                int(timeout_match.group(1))/1000 if timeout_match else 0)
+
+    def __update_state(self, state, message):
+        """Record that a message of the current page has been yielded."""
+        state['page_messages'] += 1
+        for key in ('time_in_seconds', 'video_offset_time_msec'):
+            if(key in message):
+                state[key] = message[key]
+
+    def __iter_youtube_chain(self, continuation, is_live, start_time, end_time, message_type, warm_up=True, exclusive_end=False, state=None, video_id=None, stop_event=None, indexed=False, strict=False):
+        """
+        Follow a single chain of YouTube continuations, yielding messages as each page is parsed.
+        If exclusive_end is set, messages at end_time are left for the next segment.
+        If a state dictionary is given, it is kept up to date with the continuation of the current page
+        and the number of its messages which have been yielded. If it already contains a continuation,
+        the chain is resumed from there, without repeating any messages.
+        If the session has a time index (and video_id is given), a chat replay starts from the closest
+        indexed page before start_time, and the pages which are fetched are indexed.
+        If stop_event (a threading.Event) is set, the chain stops before fetching its next page.
+        If indexed is set (the continuation was taken from the time index), NoContinuation is raised
+        if it no longer works, so that the watch page can be fetched again. If strict is set, it is also
+        raised when a chat replay cannot be followed to its end (instead of printing a message).
+        """
+        if(not is_live and state is None and self.parse_processes):
+            yield from self.__iter_youtube_pipeline(
+                continuation, warm_up, start_time, end_time, message_type, exclusive_end, video_id, stop_event, indexed, strict)
+            return
 
         offset_milliseconds = start_time * 1000 if start_time > 0 else 0
 
-        continuation_by_title_map = self.__get_initial_youtube_info(video_id)
+        first_time = warm_up
+        skip = 0
+        resuming = state is not None and 'continuation' in state
+        if(resuming):
+            continuation = state['continuation']
+            first_time = state['warm_up']
+            skip = state['page_messages']
+
+        # the first continuation identifies the chat (e.g. live or top chat) in the time index
+        first_continuation = continuation
+        time_index = self.time_index if video_id is not None and not is_live and not resuming else None
+        from_index = False
+        if(time_index is not None and offset_milliseconds > 0):
+            indexed_continuation = time_index.find(
+                video_id, first_continuation, offset_milliseconds)
+            if(indexed_continuation is not None):
+                continuation = indexed_continuation
+                first_time = False
+                from_index = True
+
+        while True:
+            if(stop_event is not None and stop_event.is_set()):
+                break
+            if(state is not None):
+                state.update(continuation=continuation, warm_up=first_time and not is_live,
+                             page_messages=skip)
+
+            try:
+                if(is_live):
+                    info = self.__get_live_info(continuation)
+                else:
+                    # must run to get first few messages, otherwise might miss some
+                    if(first_time):
+                        info = self.__get_replay_info(continuation, 0)
+                        first_time = False
+                    else:
+                        info = self.__get_replay_info(
+                            continuation, offset_milliseconds)
+
+            except NoContinuation:
+                if(from_index):
+                    # the indexed continuation no longer works, so start from the beginning again
+                    time_index.remove(video_id)
+                    continuation, first_time, from_index = first_continuation, warm_up, False
+                    continue
+                if(indexed and continuation == first_continuation):
+                    raise
+                if(strict and not is_live):
+                    raise NoContinuation(
+                        'No continuation found, the chat replay stopped before its end.')
+                print('No continuation found, stream may have ended.')
+                break
+
+            start = time.perf_counter()
+            messages, finished = self._parse_youtube_page(
+                info, is_live, start_time, end_time, message_type, exclusive_end)
+            self.stats.add_time('parse', time.perf_counter() - start)
+            self.stats.add_page(len(messages))
+            from_index = False
+            if(time_index is not None and continuation != first_continuation):
+                page_offset = self._get_page_offset(info)
+                if(page_offset is not None):
+                    time_index.add(video_id, first_continuation,
+                                   page_offset, continuation)
+            for message in messages[skip:]:
+                if(state is not None):
+                    self.__update_state(state, message)
+                yield message
+            skip = 0
+            if(finished):
+                break
+
+            continuation, timeout = self._get_next_continuation(
+                info, continuation)
+            if(continuation is None):
+                break
+            if(timeout):
+                time.sleep(timeout)
+                self.stats.add_time('sleep', timeout)
+
+        if(time_index is not None):
+            time_index.save(video_id)
+
+    def __get_parse_pool(self):
+        """Get the pool of processes which parse pages of chat replay, creating it if needed."""
+        with self.__parse_pool_lock:
+            if(self.__parse_pool is None):
+                # processes are spawned rather than forked, since other threads may be holding locks
+                self.__parse_pool = ProcessPoolExecutor(
+                    self.parse_processes, mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_parse_process, initargs=(self.__json_backend,))
+            return self.__parse_pool
+
+    def close(self):
+        """Shut down the pool of parse processes (if any) and close the connections of the session."""
+        with self.__parse_pool_lock:
+            if(self.__parse_pool is not None):
+                self.__parse_pool.shutdown(cancel_futures=True)
+                self.__parse_pool = None
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter_youtube_pipeline(self, continuation, warm_up, start_time, end_time, message_type, exclusive_end, video_id, stop_event=None, indexed=False, strict=False):
+        """
+        Follow a chain of YouTube replay continuations (like __iter_youtube_chain), parsing the pages in
+        the session's process pool. A thread fetches the pages, finding each next continuation in the
+        raw content, while up to twice as many pages as there are processes are decoded and parsed.
+        Messages are yielded in the order of the pages.
+        """
+        offset_milliseconds = start_time * 1000 if start_time > 0 else 0
+
+        first_continuation = continuation
+        time_index = self.time_index if video_id is not None else None
+        first_time = warm_up
+        from_index = False
+        if(time_index is not None and offset_milliseconds > 0):
+            indexed_continuation = time_index.find(
+                video_id, first_continuation, offset_milliseconds)
+            if(indexed_continuation is not None):
+                continuation = indexed_continuation
+                first_time = False
+                from_index = True
+
+        pool = self.__get_parse_pool()
+        pages = queue.Queue(2 * self.parse_processes)
+        stopped = threading.Event()
+
+        def put(page):
+            while not stopped.is_set():
+                try:
+                    pages.put(page, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        def fetch_pages(continuation, first_time):
+            try:
+                while continuation is not None and not stopped.is_set():
+                    # must run to get first few messages, otherwise might miss some
+                    content = self.__session_get_content(self._get_replay_url(
+                        continuation, 0 if first_time else offset_milliseconds), cacheable=True)
+                    first_time = False
+                    put((continuation, pool.submit(_parse_youtube_content, content,
+                                                   start_time, end_time, message_type, exclusive_end)))
+                    continuation, timeout = self._find_next_continuation(
+                        content, continuation)
+                    if(timeout):
+                        time.sleep(timeout)
+                        self.stats.add_time('sleep', timeout)
+                put(None)
+            except Exception as e:
+                put(e)
+
+        fetcher = threading.Thread(target=fetch_pages, args=(
+            continuation, first_time), daemon=True)
+        fetcher.start()
+        restart = False
+        try:
+            while True:
+                if(stop_event is not None and stop_event.is_set()):
+                    break
+                page = pages.get()
+                if(page is None):
+                    break
+                if(isinstance(page, Exception)):
+                    raise page
 
+                continuation, future = page
+                try:
+                    messages, finished, page_offset, decode_time, parse_time = future.result()
+                except NoContinuation:
+                    # an indexed continuation which no longer works is removed and the chat started again
+                    restart = from_index
+                    if(restart):
+                        break
+                    if(indexed and continuation == first_continuation):
+                        raise
+                    if(strict):
+                        raise NoContinuation(
+                            'No continuation found, the chat replay stopped before its end.')
+                    print('No continuation found, stream may have ended.')
+                    break
+
+                self.stats.add_time('decode', decode_time)
+                self.stats.add_time('parse', parse_time)
+                self.stats.add_page(len(messages))
+                from_index = False
+                if(time_index is not None and continuation != first_continuation and page_offset is not None):
+                    time_index.add(video_id, first_continuation,
+                                   page_offset, continuation)
+                yield from messages
+                if(finished):
+                    break
+        finally:
+            stopped.set()
+            while not pages.empty():
+                page = pages.get()
+                if(isinstance(page, tuple)):
+                    page[1].cancel()
+
+        if(restart):
+            time_index.remove(video_id)
+            yield from self.__iter_youtube_pipeline(
+                first_continuation, warm_up, start_time, end_time, message_type, exclusive_end, video_id, stop_event, indexed, strict)
+        elif(time_index is not None):
+            time_index.save(video_id)
+
+    def _get_live_continuation(self, video_id, chat_type='live'):
+        """Get the first continuation of the live chat of a YouTube stream."""
+        continuation_by_title_map, duration, indexed = self.__get_initial_youtube_info(
+            video_id)
+        continuation, is_live = self._select_continuation(
+            continuation_by_title_map, chat_type)
+        if(not is_live):
+            raise NotLive('Video is not a live stream.')
+        return continuation
+
+    def _get_live_page(self, continuation, message_type='messages'):
+        """
+        Get a single page of live chat. Returns its messages, the next continuation (None once
+        the stream has ended) and how long to wait (in seconds) before requesting it.
+        """
+        try:
+            info = self.__get_live_info(continuation)
+        except NoContinuation:
+            return [], None, None
+
+        start = time.perf_counter()
+        messages, finished = self._parse_youtube_page(
+            info, True, 0, None, message_type)
+        self.stats.add_time('parse', time.perf_counter() - start)
+        self.stats.add_page(len(messages))
+        continuation, timeout = self._get_next_continuation(
+            info, continuation)
+        return list(self._compact_messages(messages)), continuation, timeout
+
+    def __iter_segments(self, get_segment, bounds, end_time, workers):
+        """
+        Run get_segment(index, start_time, end_time, is_last, stop_event) for each window [bounds[i], bounds[i+1])
+        in a pool of workers (the last window ends at end_time instead, which may be None).
+        The list of messages of each window is yielded in order, as soon as every window before it has finished.
+        stop_event is set when the generator is closed (e.g. on KeyboardInterrupt), and windows which are
+        already running must then stop at their next page.
+        """
+        number_of_segments = len(bounds) - 1
+        stop_event = threading.Event()
+        executor = ThreadPoolExecutor(
+            max_workers=workers or number_of_segments)
+        futures = []
+        for i in range(number_of_segments):
+            is_last = i == number_of_segments - 1
+            futures.append(executor.submit(
+                get_segment, i, bounds[i], end_time if is_last else bounds[i + 1], is_last, stop_event))
+
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            stop_event.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def __iter_youtube_segments(self, continuation, end_time, message_type, bounds, workers, video_id=None, indexed=False, strict=False):
+        """
+        Fetch the windows [bounds[i], bounds[i+1]) of a chat replay in parallel, each with its own chain
+        of continuations. Every chain runs past the end of its window, so messages belonging to the next
+        window are dropped (this removes the overlap at the boundaries).
+        """
+        def get_segment(index, start_time, end_time, is_last, stop_event):
+            return list(self.__iter_youtube_chain(
+                continuation, False, start_time, end_time, message_type,
+                warm_up=(index == 0), exclusive_end=not is_last, video_id=video_id, stop_event=stop_event, indexed=indexed, strict=strict))
+
+        for messages in self.__iter_segments(get_segment, bounds, end_time, workers):
+            yield from messages
+
+    def _get_segment_bounds(self, start_time, end_time, segments):
+        """Split [start_time, end_time] into (at most) the given number of equal windows."""
+        step = (end_time - start_time) / segments
+        bounds = [start_time + round(step * i) for i in range(segments)]
+        return sorted(set(bounds)) + [end_time]
+
+    def _select_continuation(self, continuation_by_title_map, chat_type):
+        """Select the continuation of the requested type of chat. Returns the continuation and whether the video is live."""
         # Top chat replay - Some messages, such as potential spam, may not be visible
         # Live chat replay - All messages are visible
         chat_type_field = chat_type.title()
@@ -392,185 +1931,1526 @@ class ChatReplayDownloader:
         chat_live_field = '{} chat'.format(chat_type_field)
 
         if(chat_replay_field in continuation_by_title_map):
-            is_live = False
-            continuation_title = chat_replay_field
+            return continuation_by_title_map[chat_replay_field], False
         elif(chat_live_field in continuation_by_title_map):
-            is_live = True
-            continuation_title = chat_live_field
+            return continuation_by_title_map[chat_live_field], True
         else:
             raise NoChatReplay('Video does not have a chat replay.')
 
-        continuation = continuation_by_title_map[continuation_title]
+    def iter_youtube_messages(self, video_id, start_time=0, end_time=None, message_type='messages', chat_type='live', segments=1, workers=None, state=None, strict=False):
+        """
+        Generator of chat messages for a YouTube video. Messages are yielded as each page is parsed.
+        If segments > 1, the chat replay is split into that many time windows,
+        which are downloaded in parallel using (at most) the given number of workers.
+        Windows which finish early are held in memory until every window before them has been yielded.
 
-        first_time = True
+        If a state dictionary is given, it records the progress of the download (it can be saved as JSON,
+        see Checkpoint). Passing the same state again resumes the download from the last message yielded.
+        Segments are not used when there is a state.
+
+        If strict is set, NoContinuation is raised if the chat replay stops before its end (or end_time),
+        rather than the messages ending early (after printing 'No continuation found').
+        """
+        return self._compact_messages(self.__iter_youtube_messages(
+            video_id, start_time, end_time, message_type, chat_type, segments, workers, state, strict))
+
+    def __iter_youtube_messages(self, video_id, start_time, end_time, message_type, chat_type, segments, workers, state, strict):
+        start_time = self._ensure_seconds(start_time, 0)
+        end_time = self._ensure_seconds(end_time, None)
+
+        if(state is not None and 'continuation' in state):
+            # resuming, so the watch page is not needed
+            yield from self.__iter_youtube_chain(
+                None, state['is_live'], start_time, end_time, message_type, state=state, strict=strict)
+            return
+
+        continuation_by_title_map, duration, indexed = self.__get_initial_youtube_info(
+            video_id)
+        yielded = False
         try:
-            while True:
-                try:
-                    if(is_live):
-                        info = self.__get_live_info(continuation)
-                    else:
-                        # must run to get first few messages, otherwise might miss some
-                        if(first_time):
-                            info = self.__get_replay_info(continuation, 0)
-                            first_time = False
-                        else:
-                            info = self.__get_replay_info(
-                                continuation, offset_milliseconds)
+            for message in self.__iter_youtube_chat(video_id, continuation_by_title_map, duration, indexed, start_time,
+                                                    end_time, message_type, chat_type, segments, workers, state, strict):
+                yielded = True
+                yield message
+        except NoContinuation:
+            if(not indexed or yielded):
+                raise
+            # the continuations in the time index no longer work, so they are forgotten and the
+            # watch page is fetched again (once, as its continuations are not taken from the index)
+            self.time_index.remove(video_id)
+            if(state is not None):
+                state.pop('continuation', None)
+            continuation_by_title_map, duration, indexed = self.__get_initial_youtube_info(
+                video_id, refresh=True)
+            yield from self.__iter_youtube_chat(video_id, continuation_by_title_map, duration, indexed, start_time,
+                                                end_time, message_type, chat_type, segments, workers, state, strict)
+
+    def __iter_youtube_chat(self, video_id, continuation_by_title_map, duration, indexed, start_time, end_time, message_type, chat_type, segments, workers, state, strict):
+        """Download the chosen chat of a YouTube video, given its continuations (see __get_initial_youtube_info)."""
+        continuation, is_live = self._select_continuation(
+            continuation_by_title_map, chat_type)
+
+        if(state is not None):
+            state['is_live'] = is_live
+            yield from self.__iter_youtube_chain(
+                continuation, is_live, start_time, end_time, message_type, state=state, video_id=video_id, indexed=indexed, strict=strict)
+            return
+
+        last_time = end_time if end_time is not None else duration
+        if(not is_live and segments is not None and segments > 1 and last_time is not None and last_time > start_time):
+            bounds = self._get_segment_bounds(
+                start_time, last_time, segments)
+            yield from self.__iter_youtube_segments(
+                continuation, end_time, message_type, bounds, workers, video_id, indexed, strict)
+        else:
+            yield from self.__iter_youtube_chain(
+                continuation, is_live, start_time, end_time, message_type, video_id=video_id, indexed=indexed, strict=strict)
 
-                except NoContinuation:
-                    print('No continuation found, stream may have ended.')
-                    break
+    def get_youtube_messages(self, video_id, start_time=0, end_time=None, message_type='messages', chat_type='live', callback=None, segments=1, workers=None):
+        """ Get chat messages for a YouTube video. """
+        return self.__collect_messages(self.iter_youtube_messages(video_id, start_time, end_time, message_type, chat_type, segments, workers), callback)
 
-                if('actions' in info):
-                    for action in info['actions']:
-                        data = {}
+    def _get_twitch_url(self, video_id, cursor, start_time):
+        """Get the url of a page of Twitch comments."""
+        return '{}&cursor={}&content_offset_seconds={}'.format(
+            self.__TWITCH_API_TEMPLATE.format(self.__TWITCH_API, video_id, self.__TWITCH_CLIENT_ID), cursor, start_time)
 
-                        if('replayChatItemAction' in action):
-                            replay_chat_item_action = action['replayChatItemAction']
-                            if('videoOffsetTimeMsec' in replay_chat_item_action):
-                                data['video_offset_time_msec'] = int(
-                                    replay_chat_item_action['videoOffsetTimeMsec'])
-                            action = replay_chat_item_action['actions'][0]
+    def _filter_twitch_comments(self, info, start_time, end_time, exclusive_end=False):
+        """
+        Get the comments of a page of Twitch comments which are between start_time and end_time,
+        and whether the end of the chat has been reached.
+        If exclusive_end is set, comments at end_time are left for the next segment.
+        """
+        if('error' in info):
+            raise TwitchError(info['message'])
+
+        comments = []
+        for comment in info['comments']:
+            time_in_seconds = float(comment['content_offset_seconds'])
+            if(time_in_seconds < start_time):
+                continue
+
+            if(end_time is not None and (time_in_seconds >= end_time if exclusive_end else time_in_seconds > end_time)):
+                return comments, True
+
+            comments.append(comment)
+
+        return comments, '_next' not in info
+
+    def _parse_twitch_comments(self, comments):
+        """Parse the information of a page of Twitch comments (converting all their times at once)."""
+        times_in_seconds = [float(comment['content_offset_seconds'])
+                            for comment in comments]
+        timestamps = timestamps_to_microseconds(
+            [comment['created_at'] for comment in comments])
+        time_texts = seconds_to_times(
+            [int(time_in_seconds) for time_in_seconds in times_in_seconds])
+
+        return [{
+            'timestamp': timestamp,
+            'time_text': time_text,
+            'time_in_seconds': time_in_seconds,
+            'author': comment['commenter']['display_name'],
+            'message': comment['message']['body']
+        } for comment, timestamp, time_text, time_in_seconds in zip(comments, timestamps, time_texts, times_in_seconds)]
+
+    def __get_twitch_video_length(self, video_id):
+        """Get the length of a Twitch video in seconds (None if unknown)."""
+        info = self.__session_get_json(self.__TWITCH_VIDEO_TEMPLATE.format(
+            self.__TWITCH_API, video_id, self.__TWITCH_CLIENT_ID), cacheable=True)
+        return info.get('length')
+
+    def __iter_twitch_chain(self, video_id, start_time, end_time, exclusive_end=False, state=None, stop_event=None):
+        """
+        Follow a single chain of Twitch cursors, yielding comments (and the messages parsed from them)
+        as each page is retrieved.
+        The state dictionary (if given) and stop_event are used in the same way as for YouTube, but with cursors.
+        """
+        cursor = ''
+        skip = 0
+        if(state is not None and 'cursor' in state):
+            cursor = state['cursor']
+            skip = state['page_messages']
+
+        while True:
+            if(stop_event is not None and stop_event.is_set()):
+                return
+            if(state is not None):
+                state.update(cursor=cursor, page_messages=skip)
+
+            info = self.__session_get_json(
+                self._get_twitch_url(video_id, cursor, start_time), cacheable=True)
+
+            start = time.perf_counter()
+            comments, finished = self._filter_twitch_comments(
+                info, start_time, end_time, exclusive_end)
+            self.stats.add_page(len(comments))
+            comments = comments[skip:]
+            messages = self._parse_twitch_comments(comments)
+            self.stats.add_time('parse', time.perf_counter() - start)
+            for comment, data in zip(comments, messages):
+                if(state is not None):
+                    self.__update_state(state, data)
+                yield comment, data
+            skip = 0
+            if(finished):
+                return
+
+            cursor = info['_next']
+
+    def __iter_twitch_segments(self, video_id, end_time, bounds, workers):
+        """
+        Fetch the windows [bounds[i], bounds[i+1]) of a Twitch video in parallel, each with its own chain
+        of cursors (starting at content_offset_seconds=bounds[i]) which stops at the start of the next window.
+        Comments are de-duplicated by id at the boundaries.
+        """
+        def get_segment(index, start_time, end_time, is_last, stop_event):
+            return [(comment['_id'], data)
+                    for comment, data in self.__iter_twitch_chain(video_id, start_time, end_time, not is_last, stop_event=stop_event)]
+
+        previous_ids = set()
+        for messages in self.__iter_segments(get_segment, bounds, end_time, workers):
+            ids = set()
+            for comment_id, data in messages:
+                if(comment_id not in previous_ids):
+                    ids.add(comment_id)
+                    yield data
+            previous_ids = ids
+
+    def iter_twitch_messages(self, video_id, start_time=0, end_time=None, segments=1, workers=None, state=None):
+        """
+        Generator of chat messages for a Twitch video. Messages are yielded as each page is parsed.
+        If segments > 1, the video is split into that many ranges of offsets,
+        which are downloaded in parallel using (at most) the given number of workers.
+        The state dictionary (if given) is used in the same way as for YouTube.
+        """
+        return self._compact_messages(self.__iter_twitch_messages(
+            video_id, start_time, end_time, segments, workers, state))
+
+    def __iter_twitch_messages(self, video_id, start_time, end_time, segments, workers, state):
+        start_time = self._ensure_seconds(start_time, 0)
+        end_time = self._ensure_seconds(end_time, None)
+
+        if(state is None and segments is not None and segments > 1):
+            last_time = end_time if end_time is not None else self.__get_twitch_video_length(
+                video_id)
+            if(last_time is not None and last_time > start_time):
+                bounds = self._get_segment_bounds(
+                    start_time, last_time, segments)
+                yield from self.__iter_twitch_segments(video_id, end_time, bounds, workers)
+                return
+
+        for comment, data in self.__iter_twitch_chain(video_id, start_time, end_time, state=state):
+            yield data
+
+    def get_twitch_messages(self, video_id, start_time=0, end_time=None, callback=None, segments=1, workers=None):
+        """ Get chat messages for a Twitch video. """
+        return self.__collect_messages(self.iter_twitch_messages(video_id, start_time, end_time, segments, workers), callback)
+
+    def _parse_url(self, url):
+        """Get the site ('youtube' or 'twitch') and video id of a url."""
+        match = re.search(self.__YT_REGEX, url)
+        if(match):
+            return 'youtube', match.group(1)
+
+        match = re.search(self.__TWITCH_REGEX, url)
+        if(match):
+            return 'twitch', match.group(1)
 
-                        action.pop('clickTrackingParams', None)
-                        action_name = list(action.keys())[0]
-                        if('item' not in action[action_name]):
-                            # not a valid item to display (usually message deleted)
-                            continue
+        raise InvalidURL('The url provided ({}) is invalid.'.format(url))
 
-                        item = action[action_name]['item']
-                        index = list(item.keys())[0]
+    def iter_chat_replay(self, url, start_time=0, end_time=None, message_type='messages', chat_type='live', segments=1, workers=None, state=None, strict=False):
+        """
+        Generator of chat messages for a YouTube/Twitch video, given its url.
+        strict is used for YouTube videos (see iter_youtube_messages).
+        """
+        site, video_id = self._parse_url(url)
+        if(site == 'youtube'):
+            return self.iter_youtube_messages(video_id, start_time, end_time, message_type, chat_type, segments, workers, state, strict)
+        else:
+            return self.iter_twitch_messages(video_id, start_time, end_time, segments, workers, state)
 
-                        if(index in self.__TYPES_OF_MESSAGES['ignore']):
-                            # can ignore message (not a chat message)
-                            continue
+    def get_chat_replay(self, url, start_time=0, end_time=None, message_type='messages', chat_type='live', callback=None, segments=1, workers=None):
+        """ Get chat messages for a YouTube/Twitch video, given its url. """
+        return self.__collect_messages(self.iter_chat_replay(url, start_time, end_time, message_type, chat_type, segments, workers), callback)
 
-                        # user wants everything, keep going
-                        if(message_type == 'all'):
-                            pass
 
-                        # user does not want superchat + message is superchat
-                        elif(message_type != 'superchat' and index in self.__TYPES_OF_MESSAGES['superchat_message'] + self.__TYPES_OF_MESSAGES['superchat_ticker']):
-                            continue
+def _init_parse_process(json_backend):
+    """Create the parser of a process of a parse pool (which decodes JSON with the session's backend)."""
+    global _page_parser
+    _page_parser = ChatReplayDownloader(json_backend=json_backend)
 
-                        # user does not want normal messages + message is normal
-                        elif(message_type != 'messages' and index in self.__TYPES_OF_MESSAGES['message']):
-                            continue
 
-                        data = dict(self.__parse_item(item), **data)
+def _parse_youtube_content(content, start_time, end_time, message_type, exclusive_end):
+    """
+    Decode and parse the raw content of a page of chat replay (in a process of a parse pool).
+    Returns its messages, whether the end has been reached, the offset of the page
+    and how long decoding and parsing took.
+    """
+    start = time.perf_counter()
+    info = _page_parser.json_loads(content)
+    decoded = time.perf_counter()
+    info = _page_parser._parse_continuation_info(info)
+    messages, finished = _page_parser._parse_youtube_page(
+        info, False, start_time, end_time, message_type, exclusive_end)
+    return messages, finished, _page_parser._get_page_offset(info), decoded - start, time.perf_counter() - decoded
 
-                        time_in_seconds = data['time_in_seconds'] if 'time_in_seconds' in data else None
 
-                        valid_seconds = time_in_seconds is not None
-                        if(end_time is not None and valid_seconds and time_in_seconds > end_time):
-                            return messages
+_page_parser = None
 
-                        if(is_live or (valid_seconds and time_in_seconds >= start_time)):
-                            messages.append(data)
 
-                            if(callback is None):
-                                # print if it is not a ticker message (prevents duplicates)
-                                if(index not in self.__TYPES_OF_MESSAGES['superchat_ticker']):
-                                    self.print_item(data)
+class AsyncChatReplayDownloader(ChatReplayDownloader):
+    """
+    Asynchronous version of ChatReplayDownloader (requires aiohttp).
+    All downloads started from the same instance share one connection pool, so a single
+    event loop can follow many chats at once:
 
-                            elif(callable(callback)):
-                                try:
-                                    callback(data)
-                                except TypeError:
-                                    raise CallbackFunction(
-                                        'Incorrect number of parameters for function '+callback.__name__)
-                else:
-                    # no more actions to process in a chat replay
-                    if(not is_live):
-                        break
+        async with AsyncChatReplayDownloader() as downloader:
+            async for message in downloader.chat_replay(url):
+                ...
+    """
 
-                if('continuations' in info):
-                    continuation_info = info['continuations'][0]
-                    # possible continuations:
-                    # invalidationContinuationData, timedContinuationData,
-                    # liveChatReplayContinuationData, reloadContinuationData
-                    continuation_info = continuation_info[next(
-                        iter(continuation_info))]
-
-                    if 'continuation' in continuation_info:
-                        continuation = continuation_info['continuation']
-                    if 'timeoutMs' in continuation_info:
-                        # must wait before calling again
-                        # prevents 429 errors (too many requests)
-                        time.sleep(continuation_info['timeoutMs']/1000)
-                else:
-                    break
+    def __init__(self, cookies=None, limit=100, limit_per_host=0, cache=None, json_backend=None, compact=False,
+                 youtube_home=None, twitch_api=None, stats=None, scheduler=None, connect_timeout=10, read_timeout=60):
+        """
+        Initialise a new downloader. limit and limit_per_host are the maximum number of
+        simultaneous connections (in total, and to a single host). 0 means no limit.
+        """
+        if(aiohttp is None):
+            raise ImportError(
+                'aiohttp must be installed to use AsyncChatReplayDownloader.')
+
+        super().__init__(cookies, cache=cache, json_backend=json_backend, compact=compact,
+                         youtube_home=youtube_home, twitch_api=twitch_api, stats=stats, scheduler=scheduler,
+                         connect_timeout=connect_timeout, read_timeout=read_timeout)
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.timeout = aiohttp.ClientTimeout(
+            sock_connect=connect_timeout, sock_read=read_timeout)
+        self.async_session = None
+
+    def __get_async_session(self):
+        """Get the shared aiohttp session, creating it (inside the running event loop) if needed."""
+        if(self.async_session is None or self.async_session.closed):
+            self.async_session = aiohttp.ClientSession(
+                headers=self.session.headers,
+                connector=aiohttp.TCPConnector(
+                    limit=self.limit, limit_per_host=self.limit_per_host),
+                timeout=self.timeout
+            )
+            for cookie in self.cookies:
+                self.async_session.cookie_jar.update_cookies(
+                    {cookie.name: cookie.value}, yarl.URL('https://{}'.format(cookie.domain.lstrip('.'))))
+
+        return self.async_session
+
+    async def close(self):
+        """Close the shared connection pool."""
+        if(self.async_session is not None):
+            await self.async_session.close()
+            self.async_session = None
+        super().close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def __session_get_content(self, url, cacheable=False):
+        """Make a request using the shared session (or the cache) and get the response content."""
+        if(cacheable):
+            content = self._get_cached_content(url)
+            if(content is not None):
+                return content
+
+        status, content = await self.__session_get(url)
+        if(cacheable and self.cache is not None and status == 200):
+            self.cache.set(url, content)
+        return content
+
+    async def __wait(self, delay):
+        if(delay > 0):
+            await asyncio.sleep(delay)
+            self.stats.add_time('throttle', delay)
+
+    async def __session_get(self, url):
+        """
+        Make a request using the shared session, when the scheduler allows it (retrying it if it fails),
+        and get the status and content of the response.
+        """
+        attempt = 0
+        while True:
+            await self.__wait(self.scheduler.reserve(url))
+            start = time.perf_counter()
+            try:
+                async with self.__get_async_session().get(url) as response:
+                    content = await response.read()
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                self.stats.add_request(time.perf_counter() - start, 0, None)
+                delay = self.scheduler.record(url, attempt)
+                if(delay is None):
+                    raise
+            else:
+                self.stats.add_request(time.perf_counter() - start,
+                                       len(content), response.status)
+                delay = self.scheduler.record(
+                    url, attempt, response.status, response.headers.get('Retry-After'))
+                if(delay is None):
+                    return response.status, content
+
+            self.stats.add_retry()
+            await self.__wait(delay)
+            attempt += 1
+
+    async def __session_get_json(self, url, cacheable=False):
+        """Make a request using the shared session (or the cache) and get json data."""
+        content = await self.__session_get_content(url, cacheable)
+        start = time.perf_counter()
+        data = self.json_loads(content)
+        self.stats.add_time('decode', time.perf_counter() - start)
+        return data
 
-            return messages
+    async def youtube_messages(self, video_id, start_time=0, end_time=None, message_type='messages', chat_type='live'):
+        """ Asynchronous generator of chat messages for a YouTube video. """
+        start_time = self._ensure_seconds(start_time, 0)
+        end_time = self._ensure_seconds(end_time, None)
+
+        url = self._get_watch_url(video_id)
+        content = self._get_cached_content(url)
+        status = None
+        if(content is None):
+            status, content = await self.__session_get(url)
+        start = time.perf_counter()
+        continuation_by_title_map, duration = self._parse_initial_youtube_info(
+            content.decode('utf-8', 'replace'))
+        self.stats.add_time('parse', time.perf_counter() - start)
+        # only the watch pages of replays are kept, since live streams become replays later
+        if(status == 200 and self.cache is not None and self._is_replay_info(continuation_by_title_map)):
+            self.cache.set(url, content)
+        continuation, is_live = self._select_continuation(
+            continuation_by_title_map, chat_type)
 
-        except KeyboardInterrupt:
-            return messages
+        offset_milliseconds = start_time * 1000 if start_time > 0 else 0
 
-    def get_twitch_messages(self, video_id, start_time=0, end_time=None, callback=None):
-        start_time = self.__ensure_seconds(start_time, 0)
-        end_time = self.__ensure_seconds(end_time, None)
+        first_time = True
+        while True:
+            if(is_live):
+                url = self._get_live_url(continuation)
+            else:
+                # must run to get first few messages, otherwise might miss some
+                url = self._get_replay_url(
+                    continuation, 0 if first_time else offset_milliseconds)
+                first_time = False
 
-        messages = []
-        api_url = self.__TWITCH_API_TEMPLATE.format(
-            video_id, self.__TWITCH_CLIENT_ID)
+            try:
+                info = self._parse_continuation_info(await self.__session_get_json(url, cacheable=not is_live))
+            except NoContinuation:
+                print('No continuation found, stream may have ended.')
+                break
+
+            start = time.perf_counter()
+            messages, finished = self._parse_youtube_page(
+                info, is_live, start_time, end_time, message_type)
+            self.stats.add_time('parse', time.perf_counter() - start)
+            self.stats.add_page(len(messages))
+            for message in self._compact_messages(messages):
+                yield message
+            if(finished):
+                break
+
+            continuation, timeout = self._get_next_continuation(
+                info, continuation)
+            if(continuation is None):
+                break
+            if(timeout):
+                await asyncio.sleep(timeout)
+                self.stats.add_time('sleep', timeout)
+
+    async def twitch_messages(self, video_id, start_time=0, end_time=None):
+        """ Asynchronous generator of chat messages for a Twitch video. """
+        start_time = self._ensure_seconds(start_time, 0)
+        end_time = self._ensure_seconds(end_time, None)
 
         cursor = ''
+        while True:
+            info = await self.__session_get_json(self._get_twitch_url(video_id, cursor, start_time), cacheable=True)
+
+            start = time.perf_counter()
+            comments, finished = self._filter_twitch_comments(
+                info, start_time, end_time)
+            messages = self._parse_twitch_comments(comments)
+            self.stats.add_time('parse', time.perf_counter() - start)
+            self.stats.add_page(len(comments))
+            for data in self._compact_messages(messages):
+                yield data
+            if(finished):
+                return
+
+            cursor = info['_next']
+
+    def chat_replay(self, url, start_time=0, end_time=None, message_type='messages', chat_type='live'):
+        """ Asynchronous generator of chat messages for a YouTube/Twitch video, given its url. """
+        site, video_id = self._parse_url(url)
+        if(site == 'youtube'):
+            return self.youtube_messages(video_id, start_time, end_time, message_type, chat_type)
+        else:
+            return self.twitch_messages(video_id, start_time, end_time)
+
+
+class ChatMessage:
+    """
+    Compact record of a chat message, which can be used in place of the dictionary (see the compact
+    parameter of ChatReplayDownloader). Fields which a message does not have are left unset.
+    Authors, author ids, badges, amounts and time texts are interned (so each distinct value is only
+    stored once), and colours are packed into ARGB integers (see pack_colour). Reading a message
+    like a dictionary (or with to_dict) gives the same values as the dictionary it was made from.
+    """
+
+    __slots__ = tuple(ChatReplayDownloader.MESSAGE_KEYS) + ('_raw_colours',)
+    __KEYS = frozenset(ChatReplayDownloader.MESSAGE_KEYS)
+
+    INTERNED_KEYS = ('author', 'author_id', 'badges', 'amount', 'time_text')
+    COLOUR_KEYS = ('header_color', 'body_color')
+
+    @classmethod
+    def from_dict(cls, data):
+        """Make a record from a message dictionary."""
+        message = cls()
+        raw_colours = ()
+        for key, value in data.items():
+            if(key in cls.COLOUR_KEYS):
+                if(type(value) is dict):
+                    value = pack_colour(value)
+                else:  # e.g. ticker colours, which are left as integers
+                    raw_colours += (key,)
+            elif(type(value) is str and key in cls.INTERNED_KEYS):
+                value = sys.intern(value)
+            setattr(message, key, value)
+        message._raw_colours = raw_colours
+        return message
+
+    def to_dict(self):
+        """Convert the record to a message dictionary (with its keys in the order of MESSAGE_KEYS)."""
+        return {key: self[key] for key in self.keys()}
+
+    def keys(self):
+        return [key for key in ChatReplayDownloader.MESSAGE_KEYS if hasattr(self, key)]
+
+    def get(self, key, default=None):
         try:
-            while True:
-                url = '{}&cursor={}&content_offset_seconds={}'.format(
-                    api_url, cursor, start_time)
-                info = self.__session_get_json(url)
+            return self[key]
+        except KeyError:
+            return default
 
-                if('error' in info):
-                    raise TwitchError(info['message'])
+    def __getitem__(self, key):
+        if(key not in self.__KEYS):
+            raise KeyError(key)
+        try:
+            value = getattr(self, key)
+        except AttributeError:
+            raise KeyError(key)
+        if(key in self.COLOUR_KEYS and key not in self._raw_colours):
+            return unpack_colour(value)
+        return value
+
+    def __contains__(self, key):
+        return key in self.__KEYS and hasattr(self, key)
+
+    def __eq__(self, other):
+        if(isinstance(other, (ChatMessage, dict))):
+            return self.to_dict() == dict(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return 'ChatMessage({!r})'.format(self.to_dict())
+
+
+class MessageWriter:
+    """
+    Base class for writing messages to a file (or stream), which is kept open until close() is called.
+    Writes are buffered, and the file is flushed every flush_every messages, and every flush_interval
+    seconds (if there is anything to flush), so output is written in batches instead of once per message.
+    Subclasses implement _write (and optionally _close).
+    The time spent writing is added to stats (a DownloadStats), if given.
+    """
+
+    include_tickers = True  # whether to write superchat ticker messages
+    resumable = True  # whether the file can be appended to when resuming a download (see Checkpoint)
+    multiple_videos = False  # whether the messages of many videos can be written to the same file
+
+    def __init__(self, file, flush_every=1000, flush_interval=1, num_of_messages=0, stats=None):
+        self.file = file
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.num_of_messages = num_of_messages
+        self.stats = stats
+
+        self.__unflushed = 0
+        self.__lock = threading.Lock()
+        self.__closed = threading.Event()
+        if(flush_interval):
+            threading.Thread(target=self.__flush_periodically,
+                             daemon=True).start()
+
+    def __flush_periodically(self):
+        while not self.__closed.wait(self.flush_interval):
+            self.flush()
+
+    def __flush(self):
+        if(self.__unflushed > 0):
+            self._flush()
+            self.__unflushed = 0
+
+    def __add_time(self, start):
+        if(self.stats is not None):
+            self.stats.add_time('write', time.perf_counter() - start)
+
+    def write(self, message):
+        """Write a message, flushing the file if enough messages have been written since the last flush."""
+        if(not self.include_tickers and 'ticker_duration' in message):
+            return
+        if(type(message) is ChatMessage):
+            message = message.to_dict()
+
+        with self.__lock:
+            start = time.perf_counter()
+            self._write(message)
+            self.num_of_messages += 1
+            self.__unflushed += 1
+            if(self.__unflushed >= self.flush_every):
+                self.__flush()
+            self.__add_time(start)
+
+    def flush(self):
+        with self.__lock:
+            if(self.__closed.is_set()):
+                return  # e.g. flushing periodically while the writer is closed
+            start = time.perf_counter()
+            self.__flush()
+            self.__add_time(start)
+
+    def tell(self):
+        """Flush the file and get the current position in it."""
+        with self.__lock:
+            self.__flush()
+            return self.file.tell()
+
+    def close(self):
+        self.__closed.set()
+        with self.__lock:
+            start = time.perf_counter()
+            self._close()
+            self.__unflushed = 0
+            self.__add_time(start)
+
+    def _write(self, message):
+        raise NotImplementedError
+
+    def _flush(self):
+        self.file.flush()
+
+    def _close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_output_file(file_name, offset=None, buffer_size=65536, **kwargs):
+    """
+    Open a file for writing, with a larger buffer than usual (so it is written in fewer, bigger chunks).
+    If an offset is given, the file is truncated to that many bytes and appended to (used to resume downloads).
+    """
+    if(offset is None):
+        return open(file_name, 'w', buffering=buffer_size, encoding='utf-8', **kwargs)
+
+    with open(file_name, 'r+b') as f:
+        f.truncate(offset)
+    return open(file_name, 'a', buffering=buffer_size, encoding='utf-8', **kwargs)
+
+
+class TextWriter(MessageWriter):
+    """Write messages to a file as text, one per line (formatted by format_message)."""
+
+    include_tickers = False  # prevents duplicates
+
+    def __init__(self, file_name, format_message, offset=None, **kwargs):
+        super().__init__(open_output_file(file_name, offset), **kwargs)
+        self.format_message = format_message
+
+    def _write(self, message):
+        self.file.write(self.format_message(message))
+        self.file.write('\n')
+
+
+class ConsoleWriter(MessageWriter):
+    """
+    Print messages to standard output, one per line (formatted by format_message).
+    Emojis and characters which cannot be printed are removed (especially needed on Windows).
+    Lines are collected and written in one chunk whenever the writer is flushed (even if standard
+    output is line buffered), so flush_interval is the longest a message can wait before being shown.
+    """
+
+    include_tickers = False  # prevents duplicates
+
+    def __init__(self, format_message, **kwargs):
+        self.format_message = format_message
+        self.__lines = []
+        self.__ascii_only = False
+        super().__init__(sys.stdout, **kwargs)
+
+    def _write(self, message):
+        line = demojize_text(self.format_message(message))
+        if(not line.isascii()):
+            line = line.encode('utf-8', 'ignore').decode('utf-8', 'ignore')
+        self.__lines.append(line)
+
+    def _flush(self):
+        if(self.__lines):
+            chunk = '\n'.join(self.__lines) + '\n'
+            self.__lines = []
+            if(not self.__ascii_only):
+                try:
+                    self.file.write(chunk)
+                except UnicodeEncodeError:
+                    # in the rare case that standard output does not support utf-8
+                    self.__ascii_only = True
+            if(self.__ascii_only):
+                self.file.write(chunk.encode(
+                    'ascii', 'ignore').decode('ascii', 'ignore'))
+        self.file.flush()
+
+    def _close(self):
+        self._flush()  # do not close standard output
+
+
+class JSONWriter(MessageWriter):
+    """Write messages to a file as a JSON array, one message at a time."""
+
+    def __init__(self, file_name, offset=None, **kwargs):
+        super().__init__(open_output_file(file_name, offset), **kwargs)
+        if(offset is None):
+            self.file.write('[')
+
+    def _write(self, message):
+        if(self.num_of_messages > 0):
+            self.file.write(', ')
+        self.file.write(json.dumps(message, sort_keys=True))
+
+    def _close(self):
+        """Close the array (so that the file is valid JSON, even if the download was interrupted)."""
+        self.file.write(']')
+        self.file.close()
+
+
+class JSONLinesWriter(MessageWriter):
+    """Write messages to a file in JSON lines format (one JSON object per line)."""
+
+    def __init__(self, file_name, offset=None, **kwargs):
+        super().__init__(open_output_file(file_name, offset), **kwargs)
+
+    def _write(self, message):
+        self.file.write(json.dumps(message, sort_keys=True))
+        self.file.write('\n')
+
+
+class CSVWriter(MessageWriter):
+    """Write messages to a CSV file, using every key a message can have as the columns."""
+
+    def __init__(self, file_name, fieldnames=ChatReplayDownloader.MESSAGE_KEYS, offset=None, **kwargs):
+        super().__init__(open_output_file(file_name, offset, newline=''), **kwargs)
+        self.csv_writer = csv.DictWriter(
+            self.file, fieldnames=fieldnames, extrasaction='ignore')
+        if(offset is None):
+            self.csv_writer.writeheader()
+
+    def _write(self, message):
+        self.csv_writer.writerow(message)
+
+
+class ColumnarWriter(MessageWriter):
+    """
+    Write messages to a Parquet (.parquet) or Arrow (.arrow, .feather) file, with a typed column
+    for every key a message can have (requires pyarrow). Authors, author ids, badges and amounts are
+    dictionary-encoded, and colours are packed into ARGB integers (see pack_colour).
+    Messages are written in groups of row_group_size as they arrive. The files can be loaded
+    (memory-mapped) with load_columnar.
+    """
+
+    resumable = False
+
+    DICTIONARY_COLUMNS = ('author', 'author_id', 'badges', 'amount')
+    COLOUR_COLUMNS = ('header_color', 'body_color')
+
+    @staticmethod
+    def get_schema():
+        dictionary = pyarrow.dictionary(pyarrow.int32(), pyarrow.string())
+        return pyarrow.schema([
+            ('timestamp', pyarrow.int64()),
+            ('time_in_seconds', pyarrow.float64()),
+            ('time_text', pyarrow.string()),
+            ('video_offset_time_msec', pyarrow.int64()),
+            ('author', dictionary),
+            ('author_id', dictionary),
+            ('badges', dictionary),
+            ('message', pyarrow.string()),
+            ('amount', dictionary),
+            ('header_color', pyarrow.uint32()),
+            ('body_color', pyarrow.uint32()),
+            ('ticker_duration', pyarrow.int64())
+        ])
+
+    def __init__(self, file_name, row_group_size=65536, **kwargs):
+        if(pyarrow is None):
+            raise ImportError(
+                'pyarrow must be installed to write Parquet or Arrow files.')
+
+        kwargs.setdefault('flush_interval', 0)
+        super().__init__(pyarrow.OSFile(file_name, 'wb'), **kwargs)
+        self.row_group_size = row_group_size
+        self.schema = self.get_schema()
+        if(os.path.splitext(file_name)[1].lower() == '.parquet'):
+            self.table_writer = pyarrow.parquet.ParquetWriter(
+                self.file, self.schema)
+        else:
+            # each group only adds the new values to the dictionaries (so they can be memory-mapped)
+            self.table_writer = pyarrow.ipc.new_file(self.file, self.schema, options=pyarrow.ipc.IpcWriteOptions(
+                emit_dictionary_deltas=True))
+
+        self.__columns = {name: [] for name in self.schema.names}
+        # values of each dictionary-encoded column, and their indices. They start with an empty string,
+        # as Arrow files cannot add to a dictionary which was empty in the first group
+        self.__dictionaries = {name: ([''], {'': 0})
+                               for name in self.DICTIONARY_COLUMNS}
+
+    def _write(self, message):
+        for name, values in self.__columns.items():
+            value = message.get(name)
+            if(value is not None):
+                if(name in self.__dictionaries):
+                    dictionary, indices = self.__dictionaries[name]
+                    index = indices.get(value)
+                    if(index is None):
+                        index = indices[value] = len(dictionary)
+                        dictionary.append(value)
+                    value = index
+                elif(name in self.COLOUR_COLUMNS):
+                    value = pack_colour(value)
+            values.append(value)
+
+        if(len(self.__columns['timestamp']) >= self.row_group_size):
+            self.__write_row_group()
+
+    def __write_row_group(self):
+        arrays = []
+        for field in self.schema:
+            values = self.__columns[field.name]
+            if(field.name in self.__dictionaries):
+                arrays.append(pyarrow.DictionaryArray.from_arrays(pyarrow.array(
+                    values, pyarrow.int32()), pyarrow.array(self.__dictionaries[field.name][0], pyarrow.string())))
+            else:
+                arrays.append(pyarrow.array(values, field.type))
+            values.clear()
+
+        self.table_writer.write_batch(
+            pyarrow.record_batch(arrays, schema=self.schema))
+
+    def _flush(self):
+        pass  # groups are only written once they are full (or when closing)
+
+    def _close(self):
+        if(self.__columns['timestamp'] or self.num_of_messages == 0):
+            self.__write_row_group()
+        self.table_writer.close()
+        self.file.close()
+
+
+def load_columnar(file_name):
+    """Load a Parquet or Arrow file written by ColumnarWriter as a pyarrow Table, memory-mapping the file."""
+    if(pyarrow is None):
+        raise ImportError(
+            'pyarrow must be installed to read Parquet or Arrow files.')
+
+    if(os.path.splitext(file_name)[1].lower() == '.parquet'):
+        return pyarrow.parquet.read_table(file_name, memory_map=True)
+    return pyarrow.ipc.open_file(pyarrow.memory_map(file_name)).read_all()
+
+
+class SQLiteWriter(MessageWriter):
+    """
+    Write messages to an SQLite database (.sqlite, .db), in a table of messages which is indexed by
+    video and time, and by author id. Many videos can be written to the same database, and messages
+    which are already in it (e.g. when a video is downloaded again) are skipped.
+    Messages are inserted in one transaction per flush. Colours are packed into ARGB integers
+    (see pack_colour). Messages can be queried with load_sqlite.
+    """
+
+    multiple_videos = True
+
+    COLUMNS = ('site', 'video_id', 'message_hash') + \
+        tuple(ChatReplayDownloader.MESSAGE_KEYS)
+    COLOUR_COLUMNS = ('header_color', 'body_color')
+
+    SCHEMA = [
+        """CREATE TABLE IF NOT EXISTS messages (
+            site TEXT NOT NULL,
+            video_id TEXT NOT NULL,
+            message_hash INTEGER NOT NULL,
+            amount TEXT,
+            author TEXT,
+            author_id TEXT,
+            badges TEXT,
+            body_color INTEGER,
+            header_color INTEGER,
+            message TEXT,
+            ticker_duration INTEGER,
+            time_in_seconds NUMERIC,
+            time_text TEXT,
+            timestamp INTEGER,
+            video_offset_time_msec INTEGER
+        )""",
+        'CREATE UNIQUE INDEX IF NOT EXISTS messages_by_hash ON messages (site, video_id, message_hash)',
+        'CREATE INDEX IF NOT EXISTS messages_by_time ON messages (video_id, time_in_seconds)',
+        'CREATE INDEX IF NOT EXISTS messages_by_author ON messages (author_id)'
+    ]
+
+    def __init__(self, file_name, site='', video_id='', offset=None, timeout=60, **kwargs):
+        """
+        site and video_id are stored with every message. offset is ignored (when resuming,
+        messages which were already written are skipped, so nothing needs to be removed).
+        timeout is the number of seconds to wait for other writers to finish their transactions.
+        """
+        # the file is flushed by the thread which flushes periodically, so it is shared by threads
+        connection = sqlite3.connect(
+            file_name, timeout=timeout, check_same_thread=False)
+        super().__init__(connection, **kwargs)
+        self.site = site or ''
+        self.video_id = video_id or ''
+        self.num_of_inserted = 0
+
+        # many downloads (i.e. processes or threads) can write to the database at the same time
+        self.file.execute('PRAGMA journal_mode=WAL')
+        with self.file:
+            for statement in self.SCHEMA:
+                self.file.execute(statement)
+
+        self.__insert = 'INSERT OR IGNORE INTO messages ({}) VALUES ({})'.format(
+            ', '.join(self.COLUMNS), ', '.join('?' * len(self.COLUMNS)))
+        self.__rows = []
+
+    @staticmethod
+    def get_message_hash(message):
+        """Get a 64-bit hash of a message, which identifies it in its video."""
+        return int.from_bytes(hashlib.blake2b(json.dumps(message, sort_keys=True).encode('utf-8'),
+                                              digest_size=8).digest(), 'big', signed=True)
+
+    def _write(self, message):
+        row = [self.site, self.video_id, self.get_message_hash(message)]
+        for name in self.COLUMNS[3:]:
+            value = message.get(name)
+            if(value is not None and name in self.COLOUR_COLUMNS):
+                value = pack_colour(value)
+            row.append(value)
+        self.__rows.append(row)
+
+    def _flush(self):
+        if(self.__rows):
+            with self.file:
+                self.num_of_inserted += self.file.executemany(
+                    self.__insert, self.__rows).rowcount
+            self.__rows.clear()
+
+    def tell(self):
+        """Flush the database. There is no position to resume from, since duplicates are skipped."""
+        self.flush()
+        return None
+
+    def _close(self):
+        self._flush()
+        self.file.close()
+
+
+def load_sqlite(file_name, site=None, video_id=None, start_time=None, end_time=None, author_id=None):
+    """
+    Load messages from an SQLite database written by SQLiteWriter, optionally only those of a video
+    (between start_time and end_time, in seconds), or those of an author. Messages are returned in
+    order of time (for each video), with colours as RGBA and hex values. Keys which are not set are
+    left out, except for message and timestamp (which every message has, even if they are None).
+    """
+    conditions = []
+    parameters = []
+    for condition, value in (('site = ?', site), ('video_id = ?', video_id), ('time_in_seconds >= ?', start_time),
+                             ('time_in_seconds <= ?', end_time), ('author_id = ?', author_id)):
+        if(value is not None):
+            conditions.append(condition)
+            parameters.append(value)
+
+    columns = ChatReplayDownloader.MESSAGE_KEYS
+    query = 'SELECT {} FROM messages {} ORDER BY site, video_id, time_in_seconds, rowid'.format(
+        ', '.join(columns), 'WHERE ' + ' AND '.join(conditions) if conditions else '')
+
+    connection = sqlite3.connect(file_name)
+    try:
+        messages = []
+        for row in connection.execute(query, parameters):
+            message = {name: value for name, value in zip(
+                columns, row) if value is not None or name in ('message', 'timestamp')}
+            for name in SQLiteWriter.COLOUR_COLUMNS:
+                if(name in message):
+                    message[name] = unpack_colour(message[name])
+            messages.append(message)
+        return messages
+    finally:
+        connection.close()
+
+
+class ArchiveCatalog:
+    """
+    Record of the time ranges of each video which are stored in an archive (an SQLite database written
+    by SQLiteWriter, in a table next to the messages), so that syncing the archive only downloads the
+    ranges which are missing (see BatchDownloader.sync). Ranges are kept separately for each type of
+    message and chat, and a range stored with message_type 'all' also counts for the other types.
+    An end_time of None means until the end of the video.
+    """
+
+    SCHEMA = """CREATE TABLE IF NOT EXISTS ranges (
+            site TEXT NOT NULL,
+            video_id TEXT NOT NULL,
+            message_type TEXT NOT NULL,
+            chat_type TEXT NOT NULL,
+            start_time NUMERIC NOT NULL,
+            end_time NUMERIC
+        )"""
+
+    def __init__(self, file_name, timeout=60):
+        self.file_name = file_name
+        self.connection = sqlite3.connect(
+            file_name, timeout=timeout, check_same_thread=False)
+        self.__lock = threading.Lock()
+
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        with self.connection:
+            self.connection.execute(self.SCHEMA)
+
+    @staticmethod
+    def merge_ranges(ranges):
+        """Merge overlapping (or touching) ranges, returning them in order."""
+        merged = []
+        for start_time, end_time in sorted(ranges, key=lambda time_range: time_range[0]):
+            if(merged and (merged[-1][1] is None or start_time <= merged[-1][1])):
+                if(merged[-1][1] is not None and (end_time is None or end_time > merged[-1][1])):
+                    merged[-1][1] = end_time
+            else:
+                merged.append([start_time, end_time])
+        return [tuple(time_range) for time_range in merged]
+
+    def __select_ranges(self, site, video_id, message_types, chat_type):
+        query = 'SELECT start_time, end_time FROM ranges WHERE site = ? AND video_id = ? AND chat_type = ? AND message_type IN ({})'.format(
+            ', '.join('?' * len(message_types)))
+        return self.connection.execute(query, (site, video_id, chat_type) + tuple(message_types)).fetchall()
+
+    def get_ranges(self, site, video_id, message_type='messages', chat_type='live'):
+        """Get the (merged) ranges of a video which are stored, as (start_time, end_time) pairs."""
+        with self.__lock:
+            return self.merge_ranges(self.__select_ranges(
+                site, video_id, {message_type, 'all'}, chat_type))
+
+    def add_range(self, site, video_id, start_time, end_time, message_type='messages', chat_type='live'):
+        """Record that a range of a video is stored."""
+        with self.__lock, self.connection:
+            ranges = self.merge_ranges(self.__select_ranges(
+                site, video_id, (message_type,), chat_type) + [(start_time, end_time)])
+            self.connection.execute('DELETE FROM ranges WHERE site = ? AND video_id = ? AND message_type = ? AND chat_type = ?',
+                                    (site, video_id, message_type, chat_type))
+            self.connection.executemany('INSERT INTO ranges VALUES (?, ?, ?, ?, ?, ?)', [
+                (site, video_id, message_type, chat_type, start, end) for start, end in ranges])
+
+    def get_missing_ranges(self, site, video_id, start_time=0, end_time=None, message_type='messages', chat_type='live'):
+        """
+        Get the ranges between start_time and end_time of a video which are not stored, as (start_time, end_time)
+        pairs. Missing ranges include the times at which they meet stored ranges (whose messages are skipped
+        when they are written again).
+        """
+        missing = []
+        position = start_time
+        for stored_start, stored_end in self.get_ranges(site, video_id, message_type, chat_type):
+            if(stored_end is not None and stored_end < position):
+                continue
+            if(end_time is not None and stored_start > end_time):
+                break
+            if(stored_start > position):
+                missing.append((position, stored_start))
+            if(stored_end is None or (end_time is not None and stored_end >= end_time)):
+                return missing
+            position = stored_end
+
+        missing.append((position, end_time))
+        return missing
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# writers used for each type of output file (any other file is written as text)
+WRITERS_BY_EXTENSION = {
+    '.json': JSONWriter,
+    '.jsonl': JSONLinesWriter,
+    '.ndjson': JSONLinesWriter,
+    '.csv': CSVWriter,
+    '.parquet': ColumnarWriter,
+    '.arrow': ColumnarWriter,
+    '.feather': ColumnarWriter,
+    '.sqlite': SQLiteWriter,
+    '.db': SQLiteWriter
+}
+
+
+def get_writer_class(file_name):
+    """Get the class of writer used for an output file, based on its extension."""
+    return WRITERS_BY_EXTENSION.get(os.path.splitext(file_name)[1].lower(), TextWriter)
+
+
+def get_writer(file_name, format_message, site=None, video_id=None, **kwargs):
+    """
+    Get a writer for an output file, based on its extension.
+    The site and id of the video are only used by writers which can hold many videos.
+    """
+    writer_class = get_writer_class(file_name)
+    if(writer_class.multiple_videos):
+        kwargs.update(site=site, video_id=video_id)
+    if(writer_class is TextWriter):
+        return TextWriter(file_name, format_message, **kwargs)
+    else:
+        return writer_class(file_name, **kwargs)
+
+
+class Checkpoint:
+    """
+    Progress of a download which writes to a file, saved periodically so that an interrupted download
+    can be resumed. It records the continuation (or cursor) of the current page and how many of its
+    messages have been written (the state passed to iter_chat_replay), the time of the last message,
+    and the size of the output file at that point.
+    """
+
+    def __init__(self, file_name, arguments, interval=10):
+        self.file_name = file_name
+        self.arguments = arguments  # the download being checkpointed (must match to resume)
+        self.interval = interval
+        self.state = {}
+        self.output_offset = None
+        self.num_of_messages = 0
+        self.__last_save = time.monotonic()
+
+    @classmethod
+    def load(cls, file_name, arguments, interval=10):
+        """Load a saved checkpoint, ensuring that it was made by the same download."""
+        try:
+            with open(file_name, encoding='utf-8') as f:
+                info = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CheckpointError(
+                "The checkpoint '{}' could not be loaded ({}).".format(file_name, e))
+
+        if(info['arguments'] != arguments):
+            raise CheckpointError("The checkpoint '{}' was made with different arguments: {}".format(
+                file_name, info['arguments']))
+
+        checkpoint = cls(file_name, arguments, interval)
+        checkpoint.state = info['state']
+        checkpoint.output_offset = info['output_offset']
+        checkpoint.num_of_messages = info['num_of_messages']
+        return checkpoint
+
+    def is_due(self):
+        """Whether the checkpoint should be saved again."""
+        return time.monotonic() - self.__last_save >= self.interval
+
+    def save(self, writer, pending=False):
+        """
+        Save the checkpoint, after flushing everything written so far.
+        pending is whether the state already counts a message (the last one yielded) which the writer
+        has not written yet, e.g. when the download is interrupted before it is written.
+        """
+        self.output_offset = writer.tell()
+        self.num_of_messages = writer.num_of_messages
+        state = self.state
+        if(pending):
+            # the message is always part of the current page, so it is downloaded again when resuming
+            state = dict(state, page_messages=state['page_messages'] - 1)
+
+        temporary_file_name = self.file_name + '.tmp'
+        with open(temporary_file_name, 'w', encoding='utf-8') as f:
+            json.dump({
+                'arguments': self.arguments,
+                'state': state,
+                'output_offset': self.output_offset,
+                'num_of_messages': self.num_of_messages
+            }, f)
+        os.replace(temporary_file_name, self.file_name)
+        self.__last_save = time.monotonic()
+
+    def remove(self):
+        """Remove the saved checkpoint (once the download has finished)."""
+        if(os.path.exists(self.file_name)):
+            os.remove(self.file_name)
+
+
+def read_url_file(file_name):
+    """Read a list of urls from a file (one per line). Empty lines and lines starting with '#' are ignored."""
+    with open(file_name, encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+
+
+class BatchDownloader:
+    """
+    Download the chat replays of many videos (one output file per video), using a bounded pool of
+    threads which share the same session (and so the same cookies and connection pool).
+    """
+
+    def __init__(self, chat_downloader=None, workers=4):
+        self.chat_downloader = chat_downloader or ChatReplayDownloader()
+        self.workers = workers
+        self.__stopped = threading.Event()
+
+    def get_output_name(self, output, url):
+        """
+        Get the name of the output file of a video. {site} and {video_id} in the output
+        name are replaced, otherwise the video id is added before the extension
+        (unless the file can hold many videos, e.g. an SQLite database).
+        """
+        site, video_id = self.chat_downloader._parse_url(url)
+        if('{site}' in output or '{video_id}' in output):
+            return output.format(site=site, video_id=video_id)
+        if(get_writer_class(output).multiple_videos):
+            return output
+
+        name, extension = os.path.splitext(output)
+        return '{}_{}{}'.format(name, video_id, extension)
+
+    def download_one(self, url, output, **kwargs):
+        """Download the chat replay of a single video. Returns the result of the download."""
+        result = {'url': url, 'output': None,
+                  'num_of_messages': 0, 'error': None}
+        try:
+            result['output'] = self.get_output_name(output, url)
+            site, video_id = self.chat_downloader._parse_url(url)
+            messages = self.chat_downloader.iter_chat_replay(url, **kwargs)
+
+            # only create the output file once the chat has been found
+            first_message = next(messages, None)
+            with get_writer(result['output'], self.chat_downloader.message_to_string, site=site, video_id=video_id,
+                            stats=self.chat_downloader.stats) as writer:
+                if(first_message is not None):
+                    writer.write(first_message)
+
+                for message in messages:
+                    if(self.__stopped.is_set()):
+                        messages.close()
+                        result['error'] = 'Interrupted.'
+                        break
+                    writer.write(message)
+            result['num_of_messages'] = writer.num_of_messages
 
-                for comment in info['comments']:
-                    time_in_seconds = float(comment['content_offset_seconds'])
-                    if(time_in_seconds < start_time):
-                        continue
+        except Exception as e:
+            result['error'] = '[{}] {}'.format(type(e).__name__, e)
 
-                    if(end_time is not None and time_in_seconds > end_time):
-                        return messages
+        return result
 
-                    created_at = comment['created_at']
+    def __sync_range(self, url, writer, catalog, site, video_id, start_time, end_time, message_type, chat_type, **kwargs):
+        """
+        Download a range of a video into an archive, and record it in the catalog (only the part which was
+        downloaded, if the download fails). Returns False if the download was interrupted.
+        """
+        # if the download stops, messages are only known to be stored up to the time before that of the last
+        # message (as more messages may have the same time)
+        stored_until = None
+        last_time = None
+        finished = False
+        try:
+            # strict, so that a chat replay which stops early is not recorded as stored until end_time
+            messages = self.chat_downloader.iter_chat_replay(
+                url, start_time, end_time, message_type, chat_type, strict=True, **kwargs)
+            for message in messages:
+                if(self.__stopped.is_set()):
+                    messages.close()
+                    return False
+                writer.write(message)
+                message_time = message.get('time_in_seconds')
+                if(message_time is not None and message_time != last_time):
+                    stored_until, last_time = last_time, message_time
+            finished = True
+            return True
+
+        finally:
+            # messages are committed before their range is recorded
+            writer.tell()
+            if(finished):
+                catalog.add_range(site, video_id, start_time,
+                                  end_time, message_type, chat_type)
+            elif(stored_until is not None):
+                catalog.add_range(site, video_id, start_time,
+                                  stored_until, message_type, chat_type)
+
+    def sync_one(self, url, output, start_time=0, end_time=None, message_type='messages', chat_type='live', **kwargs):
+        """
+        Sync the chat of a single video into an archive (an SQLite database), downloading only the ranges
+        between start_time and end_time which are not in it yet (see ArchiveCatalog). Returns the result of
+        the sync, with the number of new messages and the missing ranges.
+        """
+        result = {'url': url, 'output': None, 'num_of_messages': 0,
+                  'ranges': [], 'error': None}
+        try:
+            result['output'] = self.get_output_name(output, url)
+            if(get_writer_class(result['output']) is not SQLiteWriter):
+                raise ValueError('Only SQLite databases can be synced.')
+
+            site, video_id = self.chat_downloader._parse_url(url)
+            with ArchiveCatalog(result['output']) as catalog:
+                result['ranges'] = catalog.get_missing_ranges(
+                    site, video_id, self.chat_downloader._ensure_seconds(
+                        start_time, 0),
+                    self.chat_downloader._ensure_seconds(end_time, None), message_type, chat_type)
+                if(not result['ranges']):
+                    return result
+
+                with get_writer(result['output'], self.chat_downloader.message_to_string, site=site, video_id=video_id,
+                                stats=self.chat_downloader.stats) as writer:
+                    try:
+                        for range_start, range_end in result['ranges']:
+                            if(not self.__sync_range(url, writer, catalog, site, video_id, range_start, range_end,
+                                                     message_type, chat_type, **kwargs)):
+                                result['error'] = 'Interrupted.'
+                                break
+                    finally:
+                        # every range is committed once it has been downloaded
+                        result['num_of_messages'] = writer.num_of_inserted
 
-                    data = {
-                        'timestamp': self.__timestamp_to_microseconds(created_at),
-                        'time_text': self.__seconds_to_time(int(time_in_seconds)),
-                        'time_in_seconds': time_in_seconds,
-                        'author': comment['commenter']['display_name'],
-                        'message': comment['message']['body']
-                    }
+        except Exception as e:
+            result['error'] = '[{}] {}'.format(type(e).__name__, e)
 
-                    messages.append(data)
+        return result
 
-                    if(callback is None):
-                        self.print_item(data)
+    def download(self, urls, output, callback=None, **kwargs):
+        """
+        Download the chat replays of many videos. Keyword arguments are passed to iter_chat_replay.
+        Returns the result of each download (in the same order as urls).
+        The callback function (if given) is called with each result as soon as the download finishes.
+        """
+        return self.__run(self.download_one, urls, output, callback, kwargs)
 
-                    elif(callable(callback)):
-                        try:
-                            callback(data)
-                        except TypeError:
-                            raise CallbackFunction(
-                                'Incorrect number of parameters for function '+callback.__name__)
+    def sync(self, urls, output, callback=None, **kwargs):
+        """
+        Sync the chats of many videos into an archive (see sync_one). Keyword arguments are passed to sync_one.
+        Returns the result of each sync (in the same order as urls).
+        The callback function (if given) is called with each result as soon as the sync finishes.
+        """
+        return self.__run(self.sync_one, urls, output, callback, kwargs)
+
+    def __run(self, function, urls, output, callback, kwargs):
+        """Run function(url, output, **kwargs) for each url in the pool, collecting the results."""
+        self.__stopped.clear()
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        futures = [executor.submit(function, url, output, **kwargs)
+                   for url in urls]
+        try:
+            if(callable(callback)):
+                for future in as_completed(futures):
+                    callback(future.result())
+            return [future.result() for future in futures]
 
-                if '_next' in info:
-                    cursor = info['_next']
-                else:
-                    return messages
         except KeyboardInterrupt:
-            return messages
-
-    def get_chat_replay(self, url, start_time=0, end_time=None, message_type='messages', chat_type='live', callback=None):
-        match = re.search(self.__YT_REGEX, url)
-        if(match):
-            return self.get_youtube_messages(match.group(1), start_time, end_time, message_type, chat_type, callback)
-
-        match = re.search(self.__TWITCH_REGEX, url)
-        if(match):
-            return self.get_twitch_messages(match.group(1), start_time, end_time, callback)
+            # let running downloads finish their current message and close their files
+            self.__stopped.set()
+            executor.shutdown(wait=True, cancel_futures=True)
+            return [future.result() if future.done() and not future.cancelled() else
+                    {'url': url, 'output': None, 'num_of_messages': 0, 'error': 'Interrupted.'}
+                    for url, future in zip(urls, futures)]
+
+        finally:
+            executor.shutdown(wait=False)
+
+
+class LiveChatMonitor:
+    """
+    Follow the live chat of many YouTube streams at once. Each stream keeps its own continuation and is
+    polled again once its timeout has passed, by a single scheduling thread and a small pool of workers,
+    so hundreds of streams only need a few threads. Streams can be added and removed at any time, and
+    the messages of each stream are passed to its own sink.
+
+        with LiveChatMonitor() as monitor:
+            monitor.add(url, print)
+            monitor.wait()
+    """
+
+    def __init__(self, chat_downloader=None, workers=4):
+        self.chat_downloader = chat_downloader or ChatReplayDownloader()
+        self.workers = workers
+        self.__streams = {}
+        self.__queue = []  # heap of (time of the next poll, sequence number, stream)
+        self.__sequence = itertools.count()
+        self.__condition = threading.Condition()
+        self.__executor = None
+        self.__thread = None
+        self.__stopped = False
+
+    @property
+    def video_ids(self):
+        """Ids of the streams being followed."""
+        with self.__condition:
+            return list(self.__streams)
+
+    def add(self, url, sink, message_type='messages', chat_type='live', on_end=None):
+        """
+        Start following the live chat of a stream. Returns its video id.
+        sink is called with each message (e.g. the write method of a MessageWriter), and on_end (if given)
+        with the video id and the error (None if the stream ended normally) once the stream is no longer
+        followed. on_end is not called for streams which are removed.
+        """
+        site, video_id = self.chat_downloader._parse_url(url)
+        if(site != 'youtube'):
+            raise NotLive('Only YouTube live streams can be monitored.')
+
+        stream = {
+            'video_id': video_id,
+            'sink': sink,
+            'message_type': message_type,
+            'chat_type': chat_type,
+            'on_end': on_end,
+            'continuation': None,
+            'num_of_messages': 0
+        }
+        with self.__condition:
+            if(video_id in self.__streams):
+                raise ValueError(
+                    'Stream {} is already being followed.'.format(video_id))
+            self.__streams[video_id] = stream
+            self.__schedule(stream, 0)
+        return video_id
+
+    def remove(self, video_id):
+        """Stop following a stream (given its video id). Returns whether it was being followed."""
+        with self.__condition:
+            stream = self.__streams.pop(video_id, None)
+            self.__condition.notify_all()
+            return stream is not None
+
+    def get_num_of_messages(self, video_id):
+        """Get the number of messages of a stream passed to its sink so far."""
+        with self.__condition:
+            return self.__streams[video_id]['num_of_messages']
+
+    def __is_followed(self, stream):
+        return self.__streams.get(stream['video_id']) is stream
+
+    def __schedule(self, stream, delay):
+        heapq.heappush(self.__queue, (time.monotonic() + delay,
+                                      next(self.__sequence), stream))
+        self.__condition.notify_all()
+
+    def __run(self):
+        """Hand streams to the workers when they are due to be polled."""
+        with self.__condition:
+            while not self.__stopped:
+                if(not self.__queue):
+                    self.__condition.wait()
+                    continue
+
+                delay = self.__queue[0][0] - time.monotonic()
+                if(delay > 0):
+                    self.__condition.wait(delay)
+                    continue
+
+                stream = heapq.heappop(self.__queue)[2]
+                if(self.__is_followed(stream)):
+                    self.__executor.submit(self.__poll, stream)
+
+    def __poll(self, stream):
+        """Get the next page of a stream, pass its messages to the sink and schedule the next poll."""
+        with self.__condition:
+            if(self.__stopped):
+                # polled again as soon as the monitor is restarted
+                self.__schedule(stream, 0)
+                return
 
-        raise InvalidURL('The url provided ({}) is invalid.'.format(url))
+        try:
+            if(stream['continuation'] is None):
+                stream['continuation'] = self.chat_downloader._get_live_continuation(
+                    stream['video_id'], stream['chat_type'])
+
+            messages, continuation, timeout = self.chat_downloader._get_live_page(
+                stream['continuation'], stream['message_type'])
+            for message in messages:
+                if(not self.__is_followed(stream)):
+                    return
+                stream['sink'](message)
+                stream['num_of_messages'] += 1
+
+        except Exception as e:
+            self.__end(stream, e)
+            return
+
+        if(continuation is None):
+            self.__end(stream, None)
+            return
+
+        stream['continuation'] = continuation
+        with self.__condition:
+            if(self.__is_followed(stream)):
+                self.__schedule(stream, timeout)
+
+    def __end(self, stream, error):
+        if(not self.__is_followed(stream)):
+            return
+        # called before the stream is removed, so that wait() only returns once every on_end has run
+        if(callable(stream['on_end'])):
+            stream['on_end'](stream['video_id'], error)
+        with self.__condition:
+            if(self.__is_followed(stream)):
+                del self.__streams[stream['video_id']]
+            self.__condition.notify_all()
+
+    def start(self):
+        """Start polling streams (in the background)."""
+        with self.__condition:
+            if(self.__thread is not None):
+                return
+            self.__stopped = False
+            self.__executor = ThreadPoolExecutor(max_workers=self.workers)
+            self.__thread = threading.Thread(target=self.__run, daemon=True)
+            self.__thread.start()
+
+    def wait(self, timeout=None):
+        """Wait until every stream has ended (or been removed). Returns False if the timeout expired first."""
+        with self.__condition:
+            return self.__condition.wait_for(lambda: not self.__streams, timeout)
+
+    def stop(self):
+        """Stop polling streams, letting the workers finish the pages they are handling."""
+        with self.__condition:
+            if(self.__thread is None):
+                return
+            self.__stopped = True
+            self.__condition.notify_all()
+            thread, self.__thread = self.__thread, None
+        thread.join()
+        self.__executor.shutdown(wait=True)
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
 
 
 if __name__ == '__main__':
@@ -578,7 +3458,8 @@ if __name__ == '__main__':
         description='A simple tool used to retrieve YouTube/Twitch chat from past broadcasts/VODs. No authentication needed!',
         formatter_class=argparse.RawTextHelpFormatter)
 
-    parser.add_argument('url', help='YouTube/Twitch video URL')
+    parser.add_argument('urls', nargs='*', metavar='url',
+                        help='YouTube/Twitch video URL(s)')
 
     parser.add_argument('-start_time', '-from', default=0,
                         help='start time in seconds or hh:mm:ss\n(default: %(default)s)')
@@ -591,17 +3472,121 @@ if __name__ == '__main__':
     parser.add_argument('-chat_type', choices=['live', 'top'], default='live',
                         help='which chat to get messages from [YouTube only]\n(default: %(default)s)')
 
+    parser.add_argument('-segments', type=int, default=1,
+                        help='number of time windows to download in parallel\n(default: %(default)s)')
+
+    parser.add_argument('-workers', type=int, default=None,
+                        help='maximum number of windows to download at the same time\n(default: %(default)s = one per window)')
+
     parser.add_argument('-output', '-o', default=None,
-                        help='name of output file\n(default: %(default)s = print to standard output)')
+                        help='name of output file. If there are many URLs, {site} and {video_id} are replaced\n(or the video id is added before the extension, except for SQLite databases)\n(default: %(default)s = print to standard output)')
 
     parser.add_argument('-cookies', '-c', default=None,
                         help='name of cookies file\n(default: %(default)s)')
 
+    parser.add_argument('-batch_file', '-a', default=None,
+                        help='file containing URLs to download (one per line)\n(default: %(default)s)')
+
+    parser.add_argument('-batch_workers', type=int, default=4,
+                        help='maximum number of videos to download at the same time\n(default: %(default)s)')
+
+    parser.add_argument('-max_connections_per_host', type=int, default=None,
+                        help='maximum number of simultaneous requests to the same host\n(default: %(default)s = no limit)')
+
+    parser.add_argument('-max_rate', type=float, default=None,
+                        help='maximum number of requests per second to the same host. Requests are\nslowed down further when the host asks for it (e.g. with 429 Too Many Requests)\n(default: %(default)s = no limit)')
+
+    parser.add_argument('-max_retries', type=int, default=5,
+                        help='number of times failed requests are retried (after increasing delays)\n(default: %(default)s)')
+
+    parser.add_argument('-timeout', type=float, default=60,
+                        help='number of seconds to wait for a response before retrying the request\n(default: %(default)s)')
+
+    parser.add_argument('--http2', action='store_true',
+                        help='make requests over HTTP/2 (requires httpx[http2])\n(default: %(default)s)')
+
+    parser.add_argument('-index_dir', default=None,
+                        help='directory where YouTube chat replays are indexed by time as they are downloaded,\nso that later downloads of other parts of the same video start close to their start time\n(default: %(default)s = no index)')
+
+    parser.add_argument('-parse_processes', type=int, default=None,
+                        help='number of processes which decode and parse pages of YouTube chat replay,\nwhile a thread fetches the next pages (useful with message_type all)\n(default: %(default)s = parse while fetching)')
+
+    parser.add_argument('-cache_dir', '--cache-dir', default=None,
+                        help='directory used to cache responses between runs\n(default: %(default)s = no cache)')
+
+    parser.add_argument('-cache_ttl', type=float, default=None,
+                        help='number of seconds before a cached response expires\n(default: %(default)s = never)')
+
+    parser.add_argument('-cache_size', type=float, default=None,
+                        help='maximum size of the cache in megabytes\n(default: %(default)s = no limit)')
+
+    parser.add_argument('-json_backend', choices=list(JSON_BACKENDS), default=DEFAULT_JSON_BACKEND,
+                        help='library used to decode JSON\n(default: orjson if it is installed, otherwise json)')
+
+    parser.add_argument('-youtube_home', default=None,
+                        help='base url of YouTube, e.g. of a local stand-in server (see run_server.py)\n(default: %(default)s = https://www.youtube.com)')
+
+    parser.add_argument('-twitch_api', default=None,
+                        help='base url of the Twitch API, e.g. of a local stand-in server\n(default: %(default)s = https://api.twitch.tv)')
+
+    parser.add_argument('-flush_interval', type=float, default=1,
+                        help='maximum number of seconds a message waits before being shown (or written)\n(default: %(default)s)')
+
+    parser.add_argument('-stats_file', default=None,
+                        help='file where download statistics are saved periodically, in the Prometheus text format\n(or in JSON if its name ends in .json)\n(default: %(default)s = not saved)')
+
+    parser.add_argument('-stats_interval', type=float, default=10,
+                        help='number of seconds between saves of the statistics file\n(default: %(default)s)')
+
+    parser.add_argument('--profile', action='store_true',
+                        help='print a summary of where the time was spent at the end\n(default: %(default)s)')
+
+    parser.add_argument('--monitor', action='store_true',
+                        help='follow the live chat of every url (YouTube live streams) at the same time, until they end,\npolling them from -batch_workers threads\n(default: %(default)s)')
+
+    parser.add_argument('--sync', action='store_true',
+                        help='only download the parts of each video (between start_time and end_time) which are not in\nthe output yet, and add them to it. The output must be an SQLite database, which records\nthe parts of each video it contains\n(default: %(default)s)')
+
+    parser.add_argument('--resume', action='store_true',
+                        help='resume an interrupted download, using the checkpoint saved next to the output file\n(not available with segments)\n(default: %(default)s)')
+
     parser.add_argument('--hide_output', action='store_true',
                         help='whether to hide output or not\n(default: %(default)s)')
 
     args = parser.parse_args()
 
+    urls = args.urls
+    if(args.batch_file is not None):
+        try:
+            urls += read_url_file(args.batch_file)
+        except OSError as e:
+            parser.error(e)
+
+    if(not urls):
+        parser.error('at least one url (or a batch file) is required')
+
+    if(len(urls) > 1 and args.output is None):
+        parser.error('an output file is required when downloading many videos')
+
+    if(args.resume and (len(urls) > 1 or args.output is None or args.segments > 1)):
+        parser.error(
+            '--resume can only be used when downloading one video (in one segment) to an output file')
+
+    if(args.http2 and httpx is None):
+        parser.error('--http2 requires httpx (pip install httpx[http2])')
+
+    if(args.sync and (args.output is None or get_writer_class(args.output) is not SQLiteWriter)):
+        parser.error('--sync requires an SQLite output file (.sqlite or .db)')
+
+    if(args.sync and (args.resume or args.monitor)):
+        parser.error('--sync cannot be used with --resume or --monitor')
+
+    if(args.resume and args.monitor):
+        parser.error('--resume cannot be used with --monitor')
+
+    if(args.resume and not get_writer_class(args.output).resumable):
+        parser.error('--resume cannot be used with Parquet or Arrow output files')
+
     if(args.hide_output):
         f = open(os.devnull, 'w')
         sys.stdout = f
@@ -611,63 +3596,213 @@ if __name__ == '__main__':
         sys.stdout = codecs.getwriter('utf-8')(sys.stdout.detach())
         sys.stderr = codecs.getwriter('utf-8')(sys.stderr.detach())
 
+    stats = DownloadStats()
+    stats_exporter = None
+    chat_downloader = None
     try:
-        chat_downloader = ChatReplayDownloader(cookies=args.cookies)
-
-        num_of_messages = 0
-
-        def print_item(item):
-            chat_downloader.print_item(item)
-
-        def write_to_file(item):
-            global num_of_messages
-
-            # only file format capable of appending properly
-            with open(args.output, 'a', encoding='utf-8') as f:
-                if('ticker_duration' not in item):  # needed for duplicates
-                    num_of_messages += 1
-                    print_item(item)
-                    text = chat_downloader.message_to_string(item)
-                    print(text, file=f)
+        if(args.stats_file is not None):
+            stats_exporter = StatsExporter(
+                stats, args.stats_file, args.stats_interval)
+
+        cache = None
+        if(args.cache_dir is not None):
+            cache = ResponseCache(
+                args.cache_dir,
+                ttl=args.cache_ttl,
+                max_size=None if args.cache_size is None else int(
+                    args.cache_size * 1024 * 1024)
+            )
+
+        chat_downloader = ChatReplayDownloader(
+            cookies=args.cookies, max_connections_per_host=args.max_connections_per_host, cache=cache,
+            json_backend=args.json_backend, youtube_home=args.youtube_home, twitch_api=args.twitch_api,
+            stats=stats, scheduler=RequestScheduler(max_rate=args.max_rate, max_retries=args.max_retries),
+            pool_size=max(32, args.segments, args.batch_workers), read_timeout=args.timeout, http2=args.http2,
+            time_index=TimeIndex(args.index_dir) if args.index_dir is not None else None,
+            parse_processes=args.parse_processes)
+
+        if(args.monitor):
+            batch_downloader = BatchDownloader(chat_downloader)
+            # writers are flushed from this thread, instead of from a thread each
+            console = ConsoleWriter(
+                chat_downloader.message_to_string, flush_interval=0, stats=stats)
+            writers = {}  # writer and output name of each stream
+            ended = collections.deque()
+
+            def finish(video_id, error):
+                writer, output = writers.pop(video_id)
+                if(writer is not console):
+                    writer.close()
+                    print('Finished writing', writer.num_of_messages,
+                          'messages to', output, flush=True)
+                if(error is not None):
+                    print('Stopped following', video_id,
+                          '[{}] {}'.format(type(error).__name__, error), flush=True)
+
+            with LiveChatMonitor(chat_downloader, args.batch_workers) as monitor:
+                for url in urls:
+                    output = None
+                    if(args.output is None):
+                        writer = console
+                    else:
+                        site, video_id = chat_downloader._parse_url(url)
+                        output = batch_downloader.get_output_name(
+                            args.output, url) if len(urls) > 1 else args.output
+                        writer = get_writer(output, chat_downloader.message_to_string, site=site, video_id=video_id,
+                                            flush_interval=0, stats=stats)
+                    video_id = monitor.add(url, writer.write, message_type=args.message_type, chat_type=args.chat_type,
+                                           on_end=lambda video_id, error: ended.append((video_id, error)))
+                    writers[video_id] = writer, output
 
-        callback = None if args.output is None else print_item
+                try:
+                    finished = False
+                    while not finished:
+                        finished = monitor.wait(args.flush_interval)
+                        while ended:
+                            finish(*ended.popleft())
+                        for writer, output in writers.values():
+                            writer.flush()
+                except KeyboardInterrupt:
+                    pass
+
+            for video_id in list(writers):
+                finish(video_id, None)
+            console.close()
+            sys.exit(0)
+
+        if(args.sync):
+            def print_result(result):
+                if(result['error'] is None):
+                    print('Synced', result['url'], 'to', result['output'], '({} new messages, {} missing ranges)'.format(
+                        result['num_of_messages'], len(result['ranges'])), flush=True)
+                else:
+                    print('Failed to sync', result['url'],
+                          result['error'], flush=True)
+
+            results = BatchDownloader(chat_downloader, args.batch_workers).sync(
+                urls,
+                args.output,
+                callback=print_result,
+                start_time=args.start_time,
+                end_time=args.end_time,
+                message_type=args.message_type,
+                chat_type=args.chat_type,
+                segments=args.segments,
+                workers=args.workers
+            )
+
+            failed = [result for result in results if result['error']]
+            print('Synced {} of {} videos.'.format(
+                len(results) - len(failed), len(results)))
+            for result in failed:
+                print(' -', result['url'], result['error'])
+            sys.exit(1 if failed else 0)
+
+        if(len(urls) > 1):
+            def print_result(result):
+                if(result['error'] is None):
+                    print('Finished writing', result['num_of_messages'],
+                          'messages to', result['output'], flush=True)
+                else:
+                    print('Failed to download', result['url'],
+                          result['error'], flush=True)
+
+            results = BatchDownloader(chat_downloader, args.batch_workers).download(
+                urls,
+                args.output,
+                callback=print_result,
+                start_time=args.start_time,
+                end_time=args.end_time,
+                message_type=args.message_type,
+                chat_type=args.chat_type,
+                segments=args.segments,
+                workers=args.workers
+            )
+
+            failed = [result for result in results if result['error']]
+            print('Downloaded {} of {} videos.'.format(
+                len(results) - len(failed), len(results)))
+            for result in failed:
+                print(' -', result['url'], result['error'])
+            sys.exit(1 if failed else 0)
+
+        writers = [ConsoleWriter(
+            chat_downloader.message_to_string, flush_interval=args.flush_interval, stats=stats)]
+        checkpoint = None
         if(args.output is not None):
-            if(args.output.endswith('.json')):
-                pass
-            elif(args.output.endswith('.csv')):
-                fieldnames = []
+            if(args.segments <= 1 and get_writer_class(args.output).resumable):
+                # the download is checkpointed, so that it can be resumed if interrupted
+                checkpoint_file_name = args.output + '.checkpoint'
+                checkpoint_arguments = {
+                    'url': urls[0],
+                    'start_time': args.start_time,
+                    'end_time': args.end_time,
+                    'message_type': args.message_type,
+                    'chat_type': args.chat_type
+                }
+                if(args.resume):
+                    checkpoint = Checkpoint.load(
+                        checkpoint_file_name, checkpoint_arguments)
+                    print('Resuming download from',
+                          checkpoint.num_of_messages, 'messages', flush=True)
+                else:
+                    checkpoint = Checkpoint(
+                        checkpoint_file_name, checkpoint_arguments)
+
+            site, video_id = chat_downloader._parse_url(urls[0])
+            if(checkpoint is not None):
+                writers.append(get_writer(
+                    args.output, chat_downloader.message_to_string, site=site, video_id=video_id,
+                    flush_interval=args.flush_interval, offset=checkpoint.output_offset,
+                    num_of_messages=checkpoint.num_of_messages, stats=stats))
             else:
-                open(args.output, 'w').close()  # empty the file
-                callback = write_to_file
+                writers.append(get_writer(
+                    args.output, chat_downloader.message_to_string, site=site, video_id=video_id,
+                    flush_interval=args.flush_interval, stats=stats))
 
-        chat_messages = chat_downloader.get_chat_replay(
-            args.url,
+        chat_messages = chat_downloader.iter_chat_replay(
+            urls[0],
             start_time=args.start_time,
             end_time=args.end_time,
             message_type=args.message_type,
             chat_type=args.chat_type,
-            callback=callback
+            segments=args.segments,
+            workers=args.workers,
+            state=checkpoint.state if checkpoint is not None else None
         )
 
+        # messages are written as they are retrieved, so an interrupted
+        # download still leaves a usable file
+        finished = False
+        message = written = None
+        try:
+            for message in chat_messages:
+                # the output file is written first, so that the last message yielded has always been written
+                # to it unless the download is interrupted in between (see Checkpoint.save)
+                writers[-1].write(message)
+                written = message
+                for writer in writers[:-1]:
+                    writer.write(message)
+                if(checkpoint is not None and checkpoint.is_due()):
+                    checkpoint.save(writers[-1])
+            finished = True
+
+        except KeyboardInterrupt:
+            pass
+
+        finally:
+            # stops any segments which are still downloading
+            chat_messages.close()
+            if(checkpoint is not None):
+                if(finished):
+                    checkpoint.remove()
+                else:
+                    checkpoint.save(writers[-1], pending=message is not written)
+            for writer in writers:
+                writer.close()
+
         if(args.output is not None):
-            if(args.output.endswith('.json')):
-                num_of_messages = len(chat_messages)
-                with open(args.output, 'w') as f:
-                    json.dump(chat_messages, f, sort_keys=True)
-
-            elif(args.output.endswith('.csv')):
-                num_of_messages = len(chat_messages)
-                fieldnames = []
-                for message in chat_messages:
-                    fieldnames = list(set(fieldnames + list(message.keys())))
-                fieldnames.sort()
-
-                with open(args.output, 'w', newline='', encoding='utf-8') as f:
-                    fc = csv.DictWriter(f, fieldnames=fieldnames)
-                    fc.writeheader()
-                    fc.writerows(chat_messages)
-
-            print('Finished writing', num_of_messages,
+            print('Finished writing', writers[-1].num_of_messages,
                   'messages to', args.output, flush=True)
 
     except InvalidURL as e:
@@ -680,18 +3815,51 @@ if __name__ == '__main__':
         print('[Video Unavailable]', e)
     except TwitchError as e:
         print('[Twitch Error]', e)
+    except CheckpointError as e:
+        print('[Checkpoint Error]', e)
     except (LoadError, CookieError) as e:
         print('[Cookies Error]', e)
     except KeyboardInterrupt:
         print('Interrupted.')
+    finally:
+        if(chat_downloader is not None):
+            chat_downloader.close()
+        if(stats_exporter is not None):
+            stats_exporter.close()
+        if(args.profile):
+            print('Profile:')
+            print(stats.summary(), flush=True)
 
 else:
     # when used as a module
-    def get_chat_replay(url, start_time=0, end_time=None, message_type='messages', chat_type='live', callback=None):
-        return ChatReplayDownloader().get_chat_replay(url, start_time, end_time, message_type, chat_type, callback)
+    _default_downloader = None
+    _default_downloader_lock = threading.Lock()
+
+    def get_default_downloader():
+        """
+        Get the session shared by the functions below (created the first time it is needed), so that
+        repeated downloads reuse its connections instead of opening new ones.
+        """
+        global _default_downloader
+        with _default_downloader_lock:
+            if(_default_downloader is None):
+                _default_downloader = ChatReplayDownloader()
+            return _default_downloader
+
+    def get_chat_replay(url, start_time=0, end_time=None, message_type='messages', chat_type='live', callback=None, segments=1, workers=None):
+        return get_default_downloader().get_chat_replay(url, start_time, end_time, message_type, chat_type, callback, segments, workers)
+
+    def get_youtube_messages(url, start_time=0, end_time=None, message_type='messages', chat_type='live', callback=None, segments=1, workers=None):
+        return get_default_downloader().get_youtube_messages(url, start_time, end_time, message_type, chat_type, callback, segments, workers)
+
+    def get_twitch_messages(url, start_time=0, end_time=None, callback=None, segments=1, workers=None):
+        return get_default_downloader().get_twitch_messages(url, start_time, end_time, callback, segments, workers)
+
+    def iter_chat_replay(url, start_time=0, end_time=None, message_type='messages', chat_type='live', segments=1, workers=None, state=None):
+        return get_default_downloader().iter_chat_replay(url, start_time, end_time, message_type, chat_type, segments, workers, state)
 
-    def get_youtube_messages(url, start_time=0, end_time=None, message_type='messages', chat_type='live', callback=None):
-        return ChatReplayDownloader().get_youtube_messages(url, start_time, end_time, message_type, chat_type, callback)
+    def iter_youtube_messages(url, start_time=0, end_time=None, message_type='messages', chat_type='live', segments=1, workers=None, state=None):
+        return get_default_downloader().iter_youtube_messages(url, start_time, end_time, message_type, chat_type, segments, workers, state)
 
-    def get_twitch_messages(url, start_time=0, end_time=None, callback=None):
-        return ChatReplayDownloader().get_twitch_messages(url, start_time, end_time, callback)
+    def iter_twitch_messages(url, start_time=0, end_time=None, segments=1, workers=None, state=None):
+        return get_default_downloader().iter_twitch_messages(url, start_time, end_time, segments, workers, state)
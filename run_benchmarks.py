@@ -0,0 +1,1024 @@
+from chat_replay_downloader import *
+import argparse
+import datetime
+import emoji
+import glob
+import gzip
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+import types
+from urllib import parse
+import tracemalloc
+
+
+def load_recorded_messages(pattern='examples/*.json', repeat=1):
+    """Load messages from recorded chats (by default, the example outputs)."""
+    messages = []
+    for file_name in sorted(glob.glob(pattern)):
+        with open(file_name, encoding='utf-8') as f:
+            messages.extend(json.load(f))
+    return messages * repeat
+
+
+def count_syscalls():
+    """
+    Get the number of read and write system calls made by this process so far (Linux only).
+    Returns None if they cannot be counted.
+    """
+    try:
+        with open('/proc/self/io') as f:
+            info = dict(line.split(': ') for line in f.read().splitlines())
+        return {'read': int(info['syscr']), 'write': int(info['syscw'])}
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+class OpenCounter:
+    """Count the number of files opened by this process (using an audit hook, which cannot be removed)."""
+
+    count = 0
+    enabled = False
+
+    @classmethod
+    def hook(cls, event, args):
+        if(cls.enabled and event == 'open'):
+            cls.count += 1
+
+    def __enter__(self):
+        OpenCounter.count = 0
+        OpenCounter.enabled = True
+        return self
+
+    def __exit__(self, *exc_info):
+        OpenCounter.enabled = False
+
+
+sys.addaudithook(OpenCounter.hook)
+
+
+def measure(function):
+    """Run a function, returning its wall time, number of files opened and number of system calls."""
+    syscalls_before = count_syscalls()
+    with OpenCounter() as counter:
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+    syscalls_after = count_syscalls()
+
+    result = {'seconds': elapsed, 'opens': counter.count}
+    if(syscalls_before is not None and syscalls_after is not None):
+        result['write_syscalls'] = syscalls_after['write'] - \
+            syscalls_before['write']
+    return result
+
+
+def benchmark_output_writers(messages):
+    """
+    Compare writing a recorded chat with the old approach (reopening the output
+    file for every message and flushing every line printed) against the output writers.
+    """
+    chat_downloader = ChatReplayDownloader()
+    format_message = chat_downloader.message_to_string
+    directory = tempfile.mkdtemp()
+    file_name = os.path.join(directory, 'output.txt')
+    results = {}
+
+    def reopen_per_message():
+        open(file_name, 'w').close()
+        for item in messages:
+            with open(file_name, 'a', encoding='utf-8') as f:
+                if('ticker_duration' not in item):
+                    print(format_message(item), file=f)
+
+    def text_writer():
+        with TextWriter(file_name, format_message) as writer:
+            for item in messages:
+                writer.write(item)
+
+    results['text (reopen per message)'] = measure(reopen_per_message)
+    results['text (TextWriter)'] = measure(text_writer)
+
+    extensions = ['json', 'jsonl', 'csv']
+    if(pyarrow is not None):
+        extensions += ['parquet', 'arrow']
+    for extension in extensions:
+        def writer(extension=extension):
+            with get_writer(os.path.join(directory, 'output.' + extension), format_message) as writer:
+                for item in messages:
+                    writer.write(item)
+        results[extension] = measure(writer)
+
+    # standard output is replaced by a file, so that nothing is shown
+    stdout = sys.stdout
+    with open(os.path.join(directory, 'stdout.txt'), 'w', encoding='utf-8') as sys.stdout:
+        def print_flush_per_line():
+            # the previous print_item (demojizing and flushing every line)
+            for item in messages:
+                if('ticker_duration' not in item):
+                    line = emoji.demojize(format_message(item))
+                    print(line.encode('utf-8', 'ignore').decode('utf-8', 'ignore'), flush=True)
+
+        def console_writer():
+            with ConsoleWriter(format_message) as writer:
+                for item in messages:
+                    writer.write(item)
+
+        results['console (legacy print_item)'] = measure(print_flush_per_line)
+        results['console (ConsoleWriter)'] = measure(console_writer)
+    sys.stdout = stdout
+
+    return results
+
+
+def youtube_actions_from_messages(messages):
+    """Rebuild the YouTube replay actions which would have been parsed into the given (recorded) messages."""
+    def runs(text):
+        return {'runs': [{'text': text}]}
+
+    def argb(colour):
+        red, green, blue, alpha = colour['rgba']
+        return (alpha << 24) | (red << 16) | (green << 8) | blue
+
+    actions = []
+    for message in messages:
+        if('video_offset_time_msec' not in message):  # not from YouTube
+            continue
+
+        item = {
+            'authorName': {'simpleText': message['author']},
+            'authorExternalChannelId': message['author_id'],
+            'timestampUsec': str(message['timestamp']),
+            'timestampText': {'simpleText': message['time_text']},
+            'id': 'x' * 40,
+            'authorPhoto': {'thumbnails': [{'url': 'https://yt3.ggpht.com/x', 'width': 32, 'height': 32}]}
+        }
+        if('badges' in message):
+            item['authorBadges'] = [{'liveChatAuthorBadgeRenderer': {'tooltip': badge}}
+                                    for badge in message['badges'].split(', ')]
+        if(message['message'] is not None):
+            item['message'] = runs(message['message'])
+
+        if('header_color' in message):
+            item.update(purchaseAmountText={'simpleText': message['amount']}, headerBackgroundColor=argb(
+                message['header_color']), bodyBackgroundColor=argb(message['body_color']))
+            renderer = {'liveChatPaidMessageRenderer': item}
+        elif('amount' in message):
+            item.update(purchaseAmountText={'simpleText': message['amount']},
+                        backgroundColor=argb(message['body_color']))
+            renderer = {'liveChatPaidStickerRenderer': item}
+        elif('ticker_duration' in message or message.get('badges') == 'New member'):
+            item['headerSubtext'] = item.pop('message', runs(''))
+            renderer = {'liveChatMembershipItemRenderer': item}
+        else:
+            renderer = {'liveChatTextMessageRenderer': item}
+
+        if('ticker_duration' in message):
+            ticker = {'durationSec': message['ticker_duration'],
+                      'showItemEndpoint': {'showLiveChatItemEndpoint': {'renderer': renderer}}}
+            name = next(iter(renderer))
+            if(name == 'liveChatPaidMessageRenderer'):
+                ticker.update(amount=message['amount'], startBackgroundColor=argb(message['body_color']))
+                renderer = {'liveChatTickerPaidMessageItemRenderer': ticker}
+            elif(name == 'liveChatPaidStickerRenderer'):
+                ticker['startBackgroundColor'] = argb(message['body_color'])
+                renderer = {'liveChatTickerPaidStickerItemRenderer': ticker}
+            else:
+                ticker.update(detailText=runs(message['message'] or ''),
+                              startBackgroundColor=message.get('body_color', 0))
+                renderer = {'liveChatTickerSponsorItemRenderer': ticker}
+            action = {'addLiveChatTickerItemAction': {'item': renderer, 'durationSec': str(message['ticker_duration'])}}
+        else:
+            action = {'addChatItemAction': {'item': renderer, 'clientId': 'x'}}
+
+        actions.append({'clickTrackingParams': 'x' * 40, 'replayChatItemAction': {
+            'actions': [dict(action, clickTrackingParams='x' * 40)],
+            'videoOffsetTimeMsec': str(message['video_offset_time_msec'])}})
+
+    return actions
+
+
+def link_run(text, url=None):
+    """A run of a YouTube message which links to url (or which has no url)."""
+    endpoint = {'commandMetadata': {'webCommandMetadata': {'url': url}}} if url is not None else {'urlEndpoint': {}}
+    return {'text': text, 'navigationEndpoint': endpoint}
+
+
+# links of every kind the parsers handle: redirects, relative and protocol-relative links, and links without a url
+LINK_RUNS = [
+    link_run('example.com/...', '/redirect?event=live_chat&q=https%3A%2F%2Fexample.com%2Fpage%3Fa%3D1'),
+    link_run('/watch?v=x', '/watch?v=xxxxxxxxxxx&t=10s'),
+    link_run('//example.com', '//example.com/image.png'),
+    link_run('https://example.org', 'https://example.org/'),
+    link_run('broken link')
+]
+
+
+def add_unusual_items(actions, every=10):
+    """
+    Add link runs to the messages of every tenth action (of those with a message), and a ticker
+    which shows no item when clicked, so that the parsers are also compared on them.
+    """
+    actions = json.loads(json.dumps(actions))
+    for action in actions[::every]:
+        item = action['replayChatItemAction']['actions'][0]
+        item = next(iter(item.values()))['item']
+        item = next(iter(item.values()))
+        item = item.get('showItemEndpoint', {}).get('showLiveChatItemEndpoint', {}).get('renderer', {'': item})
+        item = next(iter(item.values()))
+        if('message' in item):
+            item['message']['runs'][1:1] = LINK_RUNS
+
+    ticker = {'durationSec': 10, 'detailText': {'runs': [{'text': 'Welcome'}]}, 'authorExternalChannelId': 'x' * 24,
+              'timestampText': {'simpleText': '0:01'}, 'startBackgroundColor': 4280150454, 'endBackgroundColor': 4278239141}
+    actions.append({'replayChatItemAction': {
+        'actions': [{'addLiveChatTickerItemAction': {'item': {'liveChatTickerSponsorItemRenderer': ticker}, 'durationSec': '10'}}],
+        'videoOffsetTimeMsec': '1000'}})
+    return actions
+
+
+class LegacyYouTubeParser:
+    """The YouTube item parser before it used a dispatch table (kept to compare against)."""
+
+    TYPES_OF_MESSAGES = {
+        'ignore': ['liveChatViewerEngagementMessageRenderer', 'liveChatPurchasedProductMessageRenderer',
+                   'liveChatPlaceholderItemRenderer', 'liveChatModeChangeMessageRenderer'],
+        'message': ['liveChatTextMessageRenderer'],
+        'superchat_message': ['liveChatMembershipItemRenderer', 'liveChatPaidMessageRenderer', 'liveChatPaidStickerRenderer'],
+        'superchat_ticker': ['liveChatTickerPaidStickerItemRenderer', 'liveChatTickerPaidMessageItemRenderer',
+                             'liveChatTickerSponsorItemRenderer']
+    }
+
+    IMPORTANT_KEYS_AND_REMAPPINGS = {
+        'timestampUsec': 'timestamp', 'authorExternalChannelId': 'author_id', 'authorName': 'author',
+        'purchaseAmountText': 'amount', 'message': 'message', 'headerBackgroundColor': 'header_color',
+        'bodyBackgroundColor': 'body_color', 'timestampText': 'time_text', 'amount': 'amount',
+        'startBackgroundColor': 'body_color', 'durationSec': 'ticker_duration', 'detailText': 'message',
+        'headerSubtext': 'message', 'backgroundColor': 'body_color'
+    }
+
+    def time_to_seconds(self, time):
+        return sum(abs(int(x)) * 60 ** i for i, x in enumerate(reversed(time.replace(',', '').split(':')))) * (-1 if time[0] == '-' else 1)
+
+    def get_colours(self, argb_int):
+        rgba_colour = [(argb_int >> 16) & 255, (argb_int >> 8) & 255, argb_int & 255, (argb_int >> 24) & 255]
+        return {'rgba': rgba_colour, 'hex': '#{:02x}{:02x}{:02x}{:02x}'.format(*rgba_colour)}
+
+    def parse_youtube_link(self, text):
+        if text.startswith(('/redirect', 'https://www.youtube.com/redirect')):
+            info = dict(parse.parse_qsl(parse.urlsplit(text).query))
+            return info.get('q') or ''
+        elif text.startswith('//'):
+            return 'https:' + text
+        elif text.startswith('/'):
+            return 'https://www.youtube.com' + text
+        else:
+            return text
+
+    def parse_message_runs(self, runs):
+        message_text = ''
+        for run in runs:
+            if 'text' in run:
+                if 'navigationEndpoint' in run:
+                    try:
+                        url = run['navigationEndpoint']['commandMetadata']['webCommandMetadata']['url']
+                        message_text += self.parse_youtube_link(url)
+                    except:
+                        message_text += run['text']
+                else:
+                    message_text += run['text']
+            elif 'emoji' in run:
+                message_text += run['emoji']['shortcuts'][0]
+            else:
+                message_text += str(run)
+        return message_text
+
+    def parse_item(self, item):
+        data = {}
+        index = list(item.keys())[0]
+        item_info = item[index]
+
+        important_item_info = {key: value for key, value in item_info.items(
+        ) if key in self.IMPORTANT_KEYS_AND_REMAPPINGS}
+
+        data.update(important_item_info)
+
+        for key in important_item_info:
+            new_key = self.IMPORTANT_KEYS_AND_REMAPPINGS[key]
+            data[new_key] = data.pop(key)
+            if(type(data[new_key]) is dict and 'simpleText' in data[new_key]):
+                data[new_key] = data[new_key]['simpleText']
+
+        if('authorBadges' in item_info):
+            badges = []
+            for badge in item_info['authorBadges']:
+                if('liveChatAuthorBadgeRenderer' in badge and 'tooltip' in badge['liveChatAuthorBadgeRenderer']):
+                    badges.append(
+                        badge['liveChatAuthorBadgeRenderer']['tooltip'])
+            data['badges'] = ', '.join(badges)
+
+        if('showItemEndpoint' in item_info):
+            data.update(self.parse_item(
+                item_info['showItemEndpoint']['showLiveChatItemEndpoint']['renderer']))
+            return data
+
+        data['message'] = self.parse_message_runs(
+            data['message']['runs']) if 'message' in data else None
+        data['timestamp'] = int(
+            data['timestamp']) if 'timestamp' in data else None
+        if('time_text' in data):
+            data['time_in_seconds'] = int(
+                self.time_to_seconds(data['time_text']))
+        for colour_key in ('header_color', 'body_color'):
+            if(colour_key in data):
+                data[colour_key] = self.get_colours(data[colour_key])
+        return data
+
+    def parse_page(self, info, message_type):
+        messages = []
+        for action in info['actions']:
+            data = {}
+            if('replayChatItemAction' in action):
+                replay_chat_item_action = action['replayChatItemAction']
+                if('videoOffsetTimeMsec' in replay_chat_item_action):
+                    data['video_offset_time_msec'] = int(
+                        replay_chat_item_action['videoOffsetTimeMsec'])
+                action = replay_chat_item_action['actions'][0]
+
+            action.pop('clickTrackingParams', None)
+            action_name = list(action.keys())[0]
+            if('item' not in action[action_name]):
+                continue
+            item = action[action_name]['item']
+            index = list(item.keys())[0]
+            if(index in self.TYPES_OF_MESSAGES['ignore']):
+                continue
+            if(message_type == 'all'):
+                pass
+            elif(message_type != 'superchat' and index in self.TYPES_OF_MESSAGES['superchat_message'] + self.TYPES_OF_MESSAGES['superchat_ticker']):
+                continue
+            elif(message_type != 'messages' and index in self.TYPES_OF_MESSAGES['message']):
+                continue
+            data = dict(self.parse_item(item), **data)
+            # replay messages without a time are dropped
+            if('time_in_seconds' in data):
+                messages.append(data)
+        return messages
+
+
+def benchmark_youtube_parser(messages, page_size=100):
+    """
+    Compare parsing pages of YouTube replay actions (rebuilt from the recorded messages, with links
+    and other unusual items added) with the legacy parser and the current one, ensuring both give the same messages.
+    """
+    chat_downloader = ChatReplayDownloader()
+    legacy_parser = LegacyYouTubeParser()
+    results = {}
+
+    actions = youtube_actions_from_messages(messages)
+    if(not actions):
+        return results
+    actions = add_unusual_items(actions)
+
+    def new_pages():
+        # pages are rebuilt for every run, as the legacy parser modifies them
+        return json.loads(json.dumps([{'actions': actions[i:i + page_size]} for i in range(0, len(actions), page_size)]))
+
+    for message_type in ('messages', 'all'):
+        parsed = {}
+
+        def legacy(pages):
+            parsed['legacy'] = [message for page in pages
+                                for message in legacy_parser.parse_page(page, message_type)]
+
+        def dispatch_table(pages):
+            parsed['dispatch table'] = [message for page in pages
+                                        for message in chat_downloader._parse_youtube_page(page, False, 0, None, message_type)[0]]
+
+        for name, function in (('legacy', legacy), ('dispatch table', dispatch_table)):
+            pages = new_pages()
+            result = measure(lambda: function(pages))
+            result['rate'] = (len(parsed[name]) / result['seconds'], 'messages')
+            results['{} ({})'.format(name, message_type)] = result
+
+        if(parsed['legacy'] != parsed['dispatch table']):
+            raise AssertionError(
+                'the parsers gave different messages ({})'.format(message_type))
+
+    return results
+
+
+def load_watch_pages(pattern, messages):
+    """
+    Load saved YouTube watch pages. If there are none, two pages are made up which contain
+    about a megabyte of (realistic) initial data, rebuilt from the recorded messages:
+    one where the initial data ends its script, and one where it is followed by more code.
+    """
+    pages = []
+    for file_name in sorted(glob.glob(pattern)):
+        with open(file_name, encoding='utf-8', errors='replace') as f:
+            pages.append(f.read())
+    if(pages):
+        return pages
+
+    actions = []
+    for action in youtube_actions_from_messages(messages) * 100:
+        actions.append(action)
+        if(len(actions) % 100 == 0 and len(json.dumps(actions)) > 1000000):
+            break
+    return [make_watch_page('x' * 60, 3600, actions, after) for after in ('', 'window.ytcsi = {};')]
+
+
+def make_watch_page(continuation, length_seconds, actions=(), after='', is_live=False):
+    """
+    Make up a YouTube watch page, whose initial data has the given continuation (for both the top
+    and live chat replays, or chats if is_live is set) and actions, followed by the code in after
+    (in the same script).
+    """
+    titles = ('Top chat', 'Live chat') if is_live else (
+        'Top chat replay', 'Live chat replay')
+    sub_menu_items = [{'title': title, 'continuation': {'reloadContinuationData': {'continuation': continuation}}}
+                      for title in titles]
+    initial_data = {
+        'contents': {'twoColumnWatchNextResults': {'conversationBar': {'liveChatRenderer': {
+            'header': {'liveChatHeaderRenderer': {'viewSelector': {'sortFilterSubMenuRenderer': {'subMenuItems': sub_menu_items}}}},
+            'actions': list(actions)
+        }}}}
+    }
+    player_response = {'videoDetails': {'videoId': 'x' * 11, 'lengthSeconds': str(length_seconds),
+                                        'shortDescription': 'var x = {};' * 1000}}
+    return ('<html><head><script>var ytInitialPlayerResponse = {};</script></head><body>'
+            '<script nonce="x">var ytInitialData = {};{}</script>{}</body></html>'.format(
+                json.dumps(player_response), json.dumps(initial_data), after, '<div></div>' * 20000))
+
+
+def benchmark_watch_pages(messages, pattern='benchmarks/watch_pages/*.html', rounds=5):
+    """
+    Compare extracting the initial data from YouTube watch pages with the previous regular expression
+    (and the json module) against the single-pass scanner, using each of the available JSON backends.
+    There are only a few pages, so the fastest of a few rounds is kept: a single round is swayed
+    by whether the garbage collector happens to run (or the previous result is freed) during it.
+    """
+    legacy_initial_data_re = r'(?:window\s*\[\s*["\']ytInitialData["\']\s*\]|ytInitialData)\s*=\s*({.+?})\s*;'
+    pages = load_watch_pages(pattern, messages)
+    results = {}
+
+    def legacy():
+        for html in pages:
+            json.loads(re.search(legacy_initial_data_re, html).group(1))
+
+    cases = [('regular expression + json', legacy)]
+    for name in JSON_BACKENDS:
+        def scanner(chat_downloader=ChatReplayDownloader(json_backend=name)):
+            for html in pages:
+                chat_downloader._parse_initial_youtube_info(html)
+        cases.append(('scanner + {}'.format(name), scanner))
+
+    for name, function in cases:
+        result = min((measure(function) for i in range(rounds)),
+                     key=lambda result: result['seconds'])
+        result['rate'] = (len(pages) / result['seconds'], 'pages')
+        results[name] = result
+
+    return results
+
+
+def benchmark_json_backends(messages, page_size=100):
+    """Compare decoding YouTube replay pages (rebuilt from the recorded messages) with each JSON backend."""
+    actions = youtube_actions_from_messages(messages)
+    pages = [json.dumps({'response': {'continuationContents': {'liveChatContinuation': {'actions': actions[i:i + page_size]}}}}).encode()
+             for i in range(0, len(actions), page_size)]
+    num_of_bytes = sum(len(page) for page in pages)
+    results = {}
+
+    for name, loads in JSON_BACKENDS.items():
+        def decode(loads=loads):
+            for page in pages:
+                loads(page)
+        result = measure(decode)
+        result['rate'] = (num_of_bytes / result['seconds'] / 1e6, 'MB')
+        results[name] = result
+
+    return results
+
+
+def legacy_timestamp_to_microseconds(timestamp):
+    info = list(filter(None, re.split(r'[\.|Z]{1}', timestamp))) + [0]
+    return round((datetime.datetime.strptime('{}Z'.format(info[0]), '%Y-%m-%dT%H:%M:%SZ').timestamp() + float('0.{}'.format(info[1])))*1e6)
+
+
+def legacy_seconds_to_time(seconds):
+    return re.sub(r'^0:0?', '', str(datetime.timedelta(0, seconds)))
+
+
+def benchmark_time_conversions(messages, page_size=60):
+    """
+    Compare the previous time conversions (made for every message) against the memoised ones,
+    converting the times of the recorded messages one at a time and a page at a time.
+    """
+    legacy_parser = LegacyYouTubeParser()
+    # RFC3339 timestamps (as given by Twitch) are rebuilt from the timestamps in microseconds
+    timestamps = [datetime.datetime.fromtimestamp(message['timestamp'] // 1000000, datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.')
+                  + str(message['timestamp'] % 1000000).zfill(6) + '789Z' for message in messages if message.get('timestamp')]
+    seconds = [int(message['time_in_seconds'])
+               for message in messages if 'time_in_seconds' in message]
+    time_texts = [message['time_text']
+                  for message in messages if 'time_text' in message]
+
+    cases = {
+        'timestamps (legacy)': (legacy_timestamp_to_microseconds, timestamps),
+        'timestamps': (timestamp_to_microseconds, timestamps),
+        'timestamps (pages)': (timestamps_to_microseconds, timestamps),
+        'seconds to text (legacy)': (legacy_seconds_to_time, seconds),
+        'seconds to text': (seconds_to_time, seconds),
+        'seconds to text (pages)': (seconds_to_times, seconds),
+        'text to seconds (legacy)': (legacy_parser.time_to_seconds, time_texts),
+        'text to seconds': (time_to_seconds, time_texts)
+    }
+    results = {}
+    converted = {}
+    for case, (function, values) in cases.items():
+        if(case.endswith('(pages)')):
+            def convert():
+                converted[case] = [result for i in range(0, len(values), page_size)
+                                   for result in function(values[i:i + page_size])]
+        else:
+            def convert():
+                converted[case] = [function(value) for value in values]
+        result = measure(convert)
+        result['rate'] = (len(values) / result['seconds'], 'conversions')
+        results[case] = result
+
+        legacy_case = case.split(' (')[0] + ' (legacy)'
+        if(converted[case] != converted[legacy_case]):
+            raise AssertionError(
+                '{} gave different results to {}'.format(case, legacy_case))
+
+    return results
+
+
+def benchmark_message_memory(messages, num_of_messages=1000000):
+    """
+    Compare the memory used to keep num_of_messages messages (the recorded messages, repeated)
+    as dictionaries and as ChatMessage records. Each repetition is decoded again, so that
+    (as when downloading) no strings are shared between messages unless they are interned.
+    """
+    encoded = json.dumps(messages)
+    repeats = -(-num_of_messages // len(messages))
+
+    def dictionaries():
+        kept = []
+        for i in range(repeats):
+            kept.extend(json.loads(encoded))
+        return kept[:num_of_messages]
+
+    def records():
+        kept = []
+        for i in range(repeats):
+            kept.extend(map(ChatMessage.from_dict, json.loads(encoded)))
+        return kept[:num_of_messages]
+
+    results = {}
+    kept = {}
+    for case, function in (('dictionaries', dictionaries), ('records', records)):
+        tracemalloc.start()
+
+        def keep():
+            kept[case] = function()
+        result = measure(keep)
+        result['memory'], result['peak_memory'] = tracemalloc.get_traced_memory()
+        result['num_of_messages'] = num_of_messages
+        tracemalloc.stop()
+        results[case] = result
+
+        if(case == 'records'):
+            if(any(record != data for record, data in zip(kept['records'], kept['dictionaries']))):
+                raise AssertionError(
+                    'records gave different messages to dictionaries')
+            kept.clear()
+
+    return results
+
+
+class FixtureResponse:
+    """A recorded response (only what ChatReplayDownloader uses)."""
+
+    def __init__(self, content, status_code=200):
+        self.content = content
+        self.status_code = status_code
+        self.headers = {}
+
+
+class Fixtures:
+    """
+    Recorded responses (by url) of the videos given in videos (as [site, video id] pairs), which are
+    replayed instead of accessing the network. They are saved to a directory, with an index.json file
+    and one (compressed) file per response.
+    """
+
+    def __init__(self):
+        self.videos = []
+        self.responses = {}
+
+    def add(self, url, content, status_code=200):
+        if(isinstance(content, str)):
+            content = content.encode('utf-8')
+        self.responses[url] = FixtureResponse(content, status_code)
+
+    def get(self, url, **kwargs):
+        """Get the recorded response of a url (in the same way as requests.Session.get)."""
+        if(url not in self.responses):
+            raise KeyError('No recorded response for {}'.format(url))
+        return self.responses[url]
+
+    @property
+    def num_of_pages(self):
+        return len(self.responses)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        responses = {}
+        for url, response in self.responses.items():
+            file_name = hashlib.sha256(url.encode('utf-8')).hexdigest() + '.gz'
+            with open(os.path.join(directory, file_name), 'wb') as f:
+                f.write(gzip.compress(response.content))
+            responses[url] = {'file': file_name,
+                              'status_code': response.status_code}
+        with open(os.path.join(directory, 'index.json'), 'w', encoding='utf-8') as f:
+            json.dump({'videos': self.videos, 'responses': responses}, f, indent=4)
+
+    @classmethod
+    def load(cls, directory):
+        """Load the fixtures saved in a directory (None if there are none)."""
+        try:
+            with open(os.path.join(directory, 'index.json'), encoding='utf-8') as f:
+                index = json.load(f)
+        except FileNotFoundError:
+            return None
+
+        fixtures = cls()
+        fixtures.videos = index['videos']
+        for url, info in index['responses'].items():
+            with open(os.path.join(directory, info['file']), 'rb') as f:
+                fixtures.add(url, gzip.decompress(f.read()),
+                             info['status_code'])
+        return fixtures
+
+
+class RecordingSession:
+    """Wrap a session, recording every response it gets in fixtures."""
+
+    def __init__(self, session, fixtures):
+        self.session = session
+        self.fixtures = fixtures
+
+    def get(self, url, **kwargs):
+        response = self.session.get(url, **kwargs)
+        self.fixtures.add(url, response.content, response.status_code)
+        return response
+
+
+def record_fixtures(urls, directory, **kwargs):
+    """
+    Download the chat replays of urls (accessing the network), saving every response to a directory
+    of fixtures. Keyword arguments are passed to ChatReplayDownloader.
+    """
+    fixtures = Fixtures.load(directory) or Fixtures()
+    chat_downloader = ChatReplayDownloader(**kwargs)
+    chat_downloader.session = RecordingSession(
+        chat_downloader.session, fixtures)
+    for url in urls:
+        site, video_id = chat_downloader._parse_url(url)
+        num_of_messages = sum(
+            1 for message in chat_downloader.iter_chat_replay(url, message_type='all'))
+        if([site, video_id] not in fixtures.videos):
+            fixtures.videos.append([site, video_id])
+        print('Recorded', num_of_messages, 'messages of', url)
+    fixtures.save(directory)
+    return fixtures
+
+
+def twitch_comments_from_messages(messages, first_index=0):
+    """
+    Rebuild the Twitch comments which would have been parsed into the given (recorded) messages.
+    Their ids are made from their indices (starting from first_index).
+    """
+    comments = []
+    for index, message in enumerate(messages, first_index):
+        seconds, microseconds = divmod(message['timestamp'], 1000000)
+        created_at = datetime.datetime.fromtimestamp(seconds, datetime.timezone.utc).strftime(
+            '%Y-%m-%dT%H:%M:%S.') + '{:06d}Z'.format(microseconds)
+        comments.append({
+            '_id': '{:036d}'.format(index),
+            'created_at': created_at,
+            'updated_at': created_at,
+            'channel_id': '0' * 9,
+            'content_type': 'video',
+            'content_offset_seconds': message['time_in_seconds'],
+            'commenter': {'display_name': message['author'], 'name': message['author'].lower(), '_id': '0' * 9},
+            'source': 'chat',
+            'state': 'published',
+            'message': {'body': message['message'], 'fragments': [{'text': message['message']}], 'is_action': False}
+        })
+    return comments
+
+
+def seed_fixtures(pattern='examples/*.json', repeat=1, page_size=100):
+    """
+    Make up fixtures from recorded chats (the JSON files in examples, by default), one video per file.
+    YouTube chats are split into replay pages of page_size actions (following a made-up watch page),
+    and Twitch chats into pages of page_size comments (linked by cursors).
+    """
+    chat_downloader = ChatReplayDownloader()  # only used to get urls
+    fixtures = Fixtures()
+    for index, file_name in enumerate(sorted(glob.glob(pattern))):
+        with open(file_name, encoding='utf-8') as f:
+            messages = json.load(f) * repeat
+        if(not messages):
+            continue
+
+        if(any('video_offset_time_msec' in message for message in messages)):
+            video_id = 'fixture{:04d}'.format(index)
+            actions = youtube_actions_from_messages(messages)
+            pages = [actions[i:i + page_size]
+                     for i in range(0, len(actions), page_size)]
+            continuations = ['{}{:06d}'.format(video_id, i) * 4
+                             for i in range(len(pages))]
+            length_seconds = max(message['video_offset_time_msec']
+                                 for message in messages if 'video_offset_time_msec' in message) // 1000 + 1
+            fixtures.add(chat_downloader._get_watch_url(video_id),
+                         make_watch_page(continuations[0], length_seconds))
+            for i, page in enumerate(pages):
+                info = {'actions': page}
+                if(i + 1 < len(pages)):
+                    info['continuations'] = [{'liveChatReplayContinuationData': {
+                        'continuation': continuations[i + 1], 'timeUntilLastMessageMsec': 5000}}]
+                fixtures.add(chat_downloader._get_replay_url(continuations[i], 0), json.dumps(
+                    {'response': {'continuationContents': {'liveChatContinuation': info}}}))
+            fixtures.videos.append(['youtube', video_id])
+
+        else:
+            video_id = str(100000000 + index)
+            comments = twitch_comments_from_messages(messages)
+            for i in range(0, len(comments), page_size):
+                info = {'comments': comments[i:i + page_size]}
+                if(i + page_size < len(comments)):
+                    info['_next'] = 'cursor{}'.format(i + page_size)
+                fixtures.add(chat_downloader._get_twitch_url(
+                    video_id, 'cursor{}'.format(i) if i else '', 0), json.dumps(info))
+            fixtures.videos.append(['twitch', video_id])
+
+    return fixtures
+
+
+class PhaseTimer:
+    """Add up the CPU time (of this process) spent in each phase of a download."""
+
+    def __init__(self, phases=()):
+        self.phases = {phase: 0 for phase in phases}
+
+    def wrap(self, phase, function):
+        """Get a function which calls function, adding the time it takes to the phase."""
+        self.phases.setdefault(phase, 0)
+
+        def timed(*args, **kwargs):
+            start = time.process_time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.phases[phase] += time.process_time() - start
+        return timed
+
+
+def measure_download(fixtures, download, memory=True):
+    """
+    Run download(chat_downloader, timer) with a ChatReplayDownloader which replays the fixtures.
+    Returns the wall and CPU times, the CPU time of each phase (fetching and decoding responses,
+    writing messages, and parsing, i.e. everything else), the number of pages and messages,
+    and (if memory is set) the peak memory used, which is measured in a second run
+    (as tracing memory slows everything down).
+    """
+    def run():
+        chat_downloader = ChatReplayDownloader()
+        timer = PhaseTimer(('fetch', 'decode', 'write'))
+        pages = []
+
+        def get(url, **kwargs):
+            pages.append(url)
+            return fixtures.get(url, **kwargs)
+        chat_downloader.session = types.SimpleNamespace(
+            get=timer.wrap('fetch', get))
+        chat_downloader.json_loads = timer.wrap(
+            'decode', chat_downloader.json_loads)
+
+        start, cpu_start = time.perf_counter(), time.process_time()
+        num_of_messages = download(chat_downloader, timer)
+        seconds, cpu_seconds = time.perf_counter() - start, time.process_time() - cpu_start
+
+        phases = dict(timer.phases)
+        phases['parse'] = cpu_seconds - sum(timer.phases.values())
+        return {'seconds': seconds, 'cpu_seconds': cpu_seconds, 'phases': phases,
+                'pages': len(pages), 'messages': num_of_messages}
+
+    result = run()
+    result['rate'] = (result['messages'] / result['seconds'], 'messages')
+    result['pages_per_second'] = result['pages'] / result['seconds']
+    if(memory):
+        tracemalloc.start()
+        run()
+        result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return result
+
+
+def load_fixtures(directory, pattern='examples/*.json', repeat=1):
+    """Load the fixtures saved in a directory, or seed them from recorded chats if there are none."""
+    return Fixtures.load(directory) or seed_fixtures(pattern, repeat)
+
+
+def benchmark_downloads(fixtures, site):
+    """
+    Download the chat replays of the fixtures of a site (get_youtube_messages or get_twitch_messages),
+    replaying recorded responses instead of accessing the network.
+    """
+    results = {}
+    for video_site, video_id in fixtures.videos:
+        if(video_site != site):
+            continue
+
+        def download(chat_downloader, timer):
+            if(site == 'youtube'):
+                messages = chat_downloader.get_youtube_messages(
+                    video_id, message_type='all', callback=lambda message: None)
+            else:
+                messages = chat_downloader.get_twitch_messages(
+                    video_id, callback=lambda message: None)
+            return len(messages)
+        results[video_id] = measure_download(fixtures, download)
+
+    return results
+
+
+def get_video_url(site, video_id):
+    """Get the url of a video (which ChatReplayDownloader parses back into its site and id)."""
+    if(site == 'youtube'):
+        return 'https://www.youtube.com/watch?v={}'.format(video_id)
+    return 'https://www.twitch.tv/videos/{}'.format(video_id)
+
+
+def benchmark_output_formats(fixtures):
+    """Download the chat replays of the fixtures, writing them in each output format."""
+    directory = tempfile.mkdtemp()
+    extensions = ['txt', 'json', 'jsonl', 'csv', 'sqlite']
+    if(pyarrow is not None):
+        extensions += ['parquet', 'arrow']
+
+    results = {}
+    for extension in extensions:
+        def download(chat_downloader, timer):
+            num_of_messages = 0
+            for site, video_id in fixtures.videos:
+                file_name = os.path.join(
+                    directory, '{}.{}'.format(video_id, extension))
+                writer = get_writer(file_name, chat_downloader.message_to_string,
+                                    site=site, video_id=video_id)
+                write = timer.wrap('write', writer.write)
+                try:
+                    for message in chat_downloader.iter_chat_replay(
+                            get_video_url(site, video_id), message_type='all'):
+                        write(message)
+                        num_of_messages += 1
+                finally:
+                    timer.wrap('write', writer.close)()
+                os.remove(file_name)
+            return num_of_messages
+        results[extension] = measure_download(fixtures, download)
+
+    return results
+
+
+benchmarks = {
+    'output_writers': benchmark_output_writers,
+    'youtube_parser': benchmark_youtube_parser,
+    'watch_pages': benchmark_watch_pages,
+    'json_backends': benchmark_json_backends,
+    'time_conversions': benchmark_time_conversions,
+    'message_memory': benchmark_message_memory,
+    'youtube_downloads': lambda fixtures: benchmark_downloads(fixtures, 'youtube'),
+    'twitch_downloads': lambda fixtures: benchmark_downloads(fixtures, 'twitch'),
+    'output_formats': benchmark_output_formats
+}
+
+# benchmarks which replay fixtures (instead of using the recorded messages)
+fixture_benchmarks = ('youtube_downloads',
+                      'twitch_downloads', 'output_formats')
+
+
+def print_results(name, results, description, previous=None):
+    """Print the results of a benchmark, and how much faster or slower each case is than before (if given)."""
+    print('{:=^80}'.format(' {} ({}) '.format(name, description)))
+    for case, result in results.items():
+        change = ''
+        if(previous is not None and case in previous):
+            change = ' ({:+.1%} time)'.format(
+                result['seconds'] / previous[case]['seconds'] - 1)
+
+        if('phases' in result):
+            print('{:<30} {:>10.3f}s {:>10.1f} messages/s {:>8.1f} pages/s {:>8.1f} MB peak{}'.format(
+                case, result['seconds'], result['rate'][0], result['pages_per_second'],
+                result.get('peak_memory', 0) / 1e6, change))
+            print('{:<30} {:>10.3f}s CPU: {}'.format('', result['cpu_seconds'], ', '.join(
+                '{} {:.3f}s'.format(phase, seconds) for phase, seconds in result['phases'].items())))
+        elif('memory' in result):
+            print('{:<30} {:>10.3f}s {:>10.1f} MB {:>10.1f} bytes/message{}'.format(
+                case, result['seconds'], result['memory'] / 1e6, result['memory'] / result['num_of_messages'], change))
+        elif('rate' in result):
+            print('{:<30} {:>10.3f}s {:>10.1f} {}/s{}'.format(
+                case, result['seconds'], *result['rate'], change))
+        else:
+            print('{:<30} {:>10.3f}s {:>10} opens {:>10} write syscalls{}'.format(
+                case, result['seconds'], result['opens'], result.get('write_syscalls', '?'), change))
+
+
+if __name__ == '__main__':
+    # the downloader converts Twitch timestamps in local time, but the seeded fixtures give them in UTC,
+    # so the downloaded messages only match the recorded ones (and other machines' results) in UTC
+    if(hasattr(time, 'tzset')):
+        os.environ['TZ'] = 'UTC'
+        time.tzset()
+
+    parser = argparse.ArgumentParser(
+        description='Run benchmarks on recorded chats (no network access needed).',
+        formatter_class=argparse.RawTextHelpFormatter)
+
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help='benchmarks to run: {}\n(default: all)'.format(', '.join(benchmarks)))
+    parser.add_argument('-messages', default='examples/*.json',
+                        help='recorded messages (JSON files) to use\n(default: %(default)s)')
+    parser.add_argument('-watch_pages', default='benchmarks/watch_pages/*.html',
+                        help='saved YouTube watch pages to use (one is made up if there are none)\n(default: %(default)s)')
+    parser.add_argument('-fixtures', default='benchmarks/fixtures',
+                        help='directory of recorded responses replayed by {}\n(they are made up from the recorded messages if there are none)\n(default: %(default)s)'.format(
+                            ', '.join(fixture_benchmarks)))
+    parser.add_argument('-repeat', type=int, default=1,
+                        help='number of times to repeat the recorded messages\n(default: %(default)s)')
+    parser.add_argument('-memory_messages', type=int, default=1000000,
+                        help='number of messages kept in memory by message_memory\n(default: %(default)s)')
+    parser.add_argument('-record', nargs='+', metavar='url',
+                        help='instead of running benchmarks, download the chat replays of the urls\nand add their responses to the fixtures (uses the network)')
+    parser.add_argument('-save', default=None,
+                        help='name of a JSON file to save the results to\n(default: %(default)s)')
+    parser.add_argument('-compare', default=None,
+                        help='name of a JSON file of saved results to compare against\n(default: %(default)s)')
+
+    args = parser.parse_args()
+
+    if(args.record):
+        record_fixtures(args.record, args.fixtures)
+        sys.exit()
+
+    for name in args.benchmarks:
+        if(name not in benchmarks):
+            parser.error('unknown benchmark: {}'.format(name))
+
+    previous = {}
+    if(args.compare is not None):
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)['benchmarks']
+
+    messages = load_recorded_messages(args.messages, args.repeat)
+    fixtures = None
+
+    all_results = {}
+    for name in (args.benchmarks or benchmarks):
+        description = '{} messages'.format(len(messages))
+        if(name == 'watch_pages'):
+            results = benchmark_watch_pages(messages, args.watch_pages)
+        elif(name == 'message_memory'):
+            results = benchmark_message_memory(
+                messages, args.memory_messages)
+        elif(name in fixture_benchmarks):
+            if(fixtures is None):
+                fixtures = load_fixtures(
+                    args.fixtures, args.messages, args.repeat)
+            results = benchmarks[name](fixtures)
+            description = '{} videos, {} pages'.format(
+                len(fixtures.videos), fixtures.num_of_pages)
+        else:
+            results = benchmarks[name](messages)
+        print_results(name, results, description, previous.get(name))
+        all_results[name] = results
+
+    if(args.save is not None):
+        with open(args.save, 'w', encoding='utf-8') as f:
+            json.dump({
+                'date': datetime.datetime.now().isoformat(),
+                'python': sys.version,
+                'platform': sys.platform,
+                'arguments': vars(args),
+                'benchmarks': all_results
+            }, f, indent=4)
@@ -0,0 +1,304 @@
+from chat_replay_downloader import *
+from run_benchmarks import make_watch_page, youtube_actions_from_messages, twitch_comments_from_messages
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import bisect
+import json
+import random
+import re
+import threading
+import time
+from urllib import parse
+
+
+def make_chat(video_id, num_of_messages=10000, rate=5, superchat_ratio=0.01, seed=0):
+    """
+    Make up the chat of a video: num_of_messages messages, sent at (on average) rate messages per second
+    by about one author for every 20 messages. About superchat_ratio of them are superchats.
+    The chat only depends on the arguments, so it is the same every time it is made.
+    """
+    generator = random.Random('{}/{}'.format(seed, video_id))
+    authors = [('User {}'.format(i), 'UC{:022d}'.format(generator.randrange(10 ** 22)))
+               for i in range(max(1, num_of_messages // 20))]
+    words = ['hello', 'lol', 'nice', 'gg', 'what', 'is', 'this', 'chat', 'hi', 'from', 'the', 'stream',
+             'pog', 'wow', 'first', 'time', 'here', 'love', 'it', '\U0001f602', '❤️', '\U0001f44d']
+    start = 1600000000000000 + generator.randrange(10 ** 13)
+
+    messages = []
+    offset_msec = 0
+    for i in range(num_of_messages):
+        offset_msec += int(generator.expovariate(rate) * 1000)
+        author, author_id = generator.choice(authors)
+        time_in_seconds = offset_msec // 1000
+        message = {
+            'author': author,
+            'author_id': author_id,
+            'message': ' '.join(generator.choice(words) for j in range(generator.randint(1, 12))),
+            'time_in_seconds': time_in_seconds,
+            'time_text': seconds_to_time(time_in_seconds),
+            'timestamp': start + offset_msec * 1000,
+            'video_offset_time_msec': offset_msec
+        }
+        if(generator.random() < 0.2):
+            message['badges'] = generator.choice(
+                ['Moderator', 'Member (1 month)', 'Verified'])
+        if(generator.random() < superchat_ratio):
+            message['amount'] = '${}.00'.format(generator.choice([2, 5, 10, 20, 50, 100]))
+            message['header_color'] = {'rgba': [0, 184, 212, 255], 'hex': '#00b8d4ff'}
+            message['body_color'] = {'rgba': [0, 229, 255, 255], 'hex': '#00e5ffff'}
+        messages.append(message)
+    return messages
+
+
+class StandInServer(ThreadingHTTPServer):
+    """
+    Local stand-in for YouTube and Twitch, serving made-up chats (see make_chat) for any video id:
+     - /watch?v=<video_id>: a watch page with initial data (ytInitialData)
+     - /live_chat_replay/get_live_chat_replay: pages of chat replay (seeking to playerOffsetMs)
+     - /live_chat/get_live_chat: live chat (for video ids starting with 'live'), where messages
+       arrive at their time since the watch page was first requested, waiting timeout_ms between pages
+     - /v5/videos/<video_id>/comments: pages of Twitch comments (linked by cursors)
+     - /v5/videos/<video_id>: Twitch video information
+    A fraction (error_rate) of requests fail with 429 (Too Many Requests), as do requests beyond
+    max_requests_per_second, and every response is delayed by latency seconds (plus up to jitter seconds).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, num_of_messages=10000, rate=5, page_size=100, twitch_page_size=60,
+                 timeout_ms=2000, error_rate=0, retry_after=1, max_requests_per_second=None, latency=0, jitter=0,
+                 seed=0, verbose=False):
+        super().__init__(address, StandInRequestHandler)
+        self.num_of_messages = num_of_messages
+        self.rate = rate
+        self.page_size = page_size
+        self.twitch_page_size = twitch_page_size
+        self.timeout_ms = timeout_ms
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.max_requests_per_second = max_requests_per_second
+        self.latency = latency
+        self.jitter = jitter
+        self.seed = seed
+        self.verbose = verbose
+
+        self.num_of_requests = 0
+        self.num_of_errors = 0
+        self.__random = random.Random(seed)
+        self.__second = 0
+        self.__requests_this_second = 0
+        self.__chats = {}
+        self.__live_starts = {}
+        self.__lock = threading.Lock()
+
+    @property
+    def url(self):
+        """Base url of the server (to use as youtube_home and twitch_api)."""
+        host, port = self.server_address[:2]
+        return 'http://{}:{}'.format(host, port)
+
+    def get_chat(self, video_id):
+        """Get the messages of a video, and their offsets (in milliseconds)."""
+        with self.__lock:
+            if(video_id not in self.__chats):
+                messages = make_chat(
+                    video_id, self.num_of_messages, self.rate, seed=self.seed)
+                self.__chats[video_id] = (messages, [message['video_offset_time_msec'] for message in messages])
+            return self.__chats[video_id]
+
+    def get_live_start(self, video_id):
+        """Get the time at which a live stream started (when its watch page was first requested)."""
+        with self.__lock:
+            return self.__live_starts.setdefault(video_id, time.monotonic())
+
+    def should_fail(self):
+        """Whether a request should fail (and count it)."""
+        with self.__lock:
+            self.num_of_requests += 1
+            second = int(time.monotonic())
+            if(second != self.__second):
+                self.__second = second
+                self.__requests_this_second = 0
+            self.__requests_this_second += 1
+
+            if(self.__random.random() < self.error_rate or (self.max_requests_per_second is not None
+                                                           and self.__requests_this_second > self.max_requests_per_second)):
+                self.num_of_errors += 1
+                return True
+            return False
+
+    def get_delay(self):
+        with self.__lock:
+            return self.latency + self.__random.random() * self.jitter
+
+
+class StandInRequestHandler(BaseHTTPRequestHandler):
+    """Handle a request to a StandInServer."""
+
+    protocol_version = 'HTTP/1.1'  # keep connections alive, as the real services do
+
+    __TWITCH_VIDEO_RE = re.compile(r'^/v5/videos/(\d+)(/comments)?$')
+
+    def do_GET(self):
+        delay = self.server.get_delay()
+        if(delay > 0):
+            time.sleep(delay)
+
+        if(self.server.should_fail()):
+            return self.send(429, b'Too Many Requests', 'text/plain', {'Retry-After': str(self.server.retry_after)})
+
+        url = parse.urlsplit(self.path)
+        query = dict(parse.parse_qsl(url.query))
+        match = self.__TWITCH_VIDEO_RE.match(url.path)
+        if(url.path == '/watch' and 'v' in query):
+            self.send(200, self.get_watch_page(query['v']).encode('utf-8'), 'text/html; charset=utf-8')
+        elif(url.path == '/live_chat_replay/get_live_chat_replay' and 'continuation' in query):
+            self.send_json(self.get_replay_page(
+                query['continuation'], int(query.get('playerOffsetMs', 0))))
+        elif(url.path == '/live_chat/get_live_chat' and 'continuation' in query):
+            self.send_json(self.get_live_page(query['continuation']))
+        elif(match and match.group(2)):
+            self.send_json(self.get_twitch_page(match.group(1), query.get(
+                'cursor', ''), float(query.get('content_offset_seconds', 0))))
+        elif(match):
+            messages, offsets = self.server.get_chat(match.group(1))
+            self.send_json({'_id': 'v' + match.group(1), 'length': offsets[-1] // 1000 + 1 if offsets else 0})
+        else:
+            self.send_json({'error': 'Not Found', 'status': 404, 'message': 'Not found'}, 404)
+
+    def get_watch_page(self, video_id):
+        messages, offsets = self.server.get_chat(video_id)
+        length_seconds = offsets[-1] // 1000 + 1 if offsets else 0
+        if(video_id.startswith('live')):
+            self.server.get_live_start(video_id)
+            return make_watch_page('{}.live.0'.format(video_id), length_seconds, is_live=True)
+        return make_watch_page('{}.replay'.format(video_id), length_seconds)
+
+    def get_replay_page(self, continuation, offset_milliseconds):
+        """Get a page of chat replay, starting from the continuation (or the offset, for the first continuation)."""
+        video_id, position = continuation.split('.', 1)
+        messages, offsets = self.server.get_chat(video_id)
+        if(position == 'replay'):
+            start = bisect.bisect_left(offsets, offset_milliseconds)
+        elif(position.isdigit()):
+            start = int(position)
+        else:
+            return {'response': {}}  # unknown continuation
+
+        end = start + self.server.page_size
+        info = {'actions': youtube_actions_from_messages(messages[start:end])}
+        if(end < len(messages)):
+            info['continuations'] = [{'liveChatReplayContinuationData': {
+                'continuation': '{}.{}'.format(video_id, end), 'timeUntilLastMessageMsec': 5000}}]
+        return {'response': {'continuationContents': {'liveChatContinuation': info}}}
+
+    def get_live_page(self, continuation):
+        """Get the messages of a live stream which have arrived since the continuation was given."""
+        video_id, live, position = continuation.split('.', 2)
+        messages, offsets = self.server.get_chat(video_id)
+        start = int(position)
+        if(start >= len(messages)):
+            return {'response': {}}  # the stream has ended
+
+        elapsed_milliseconds = (time.monotonic() - self.server.get_live_start(video_id)) * 1000
+        end = max(start, bisect.bisect_right(offsets, elapsed_milliseconds))
+        actions = []
+        for action in youtube_actions_from_messages(messages[start:end]):
+            action = action['replayChatItemAction']['actions'][0]
+            for item in action['addChatItemAction']['item'].values():
+                item.pop('timestampText', None)  # live messages only have timestamps
+            actions.append(action)
+        return {'response': {'continuationContents': {'liveChatContinuation': {
+            'actions': actions,
+            'continuations': [{'timedContinuationData': {
+                'continuation': '{}.live.{}'.format(video_id, end), 'timeoutMs': self.server.timeout_ms}}]
+        }}}}
+
+    def get_twitch_page(self, video_id, cursor, content_offset_seconds):
+        messages, offsets = self.server.get_chat(video_id)
+        if(cursor):
+            start = int(cursor)
+        else:
+            start = bisect.bisect_left(offsets, content_offset_seconds * 1000)
+
+        end = start + self.server.twitch_page_size
+        info = {'comments': twitch_comments_from_messages([
+            dict(message, time_in_seconds=message['video_offset_time_msec'] / 1000) for message in messages[start:end]], start)}
+        if(end < len(messages)):
+            info['_next'] = str(end)
+        return info
+
+    def send_json(self, data, status=200):
+        self.send(status, json.dumps(data).encode('utf-8'), 'application/json; charset=utf-8')
+
+    def send(self, status, body, content_type, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if(self.server.verbose):
+            super().log_message(format, *args)
+
+
+def start_server(host='127.0.0.1', port=0, **kwargs):
+    """Start a StandInServer in a background thread (on any free port by default). Keyword arguments are passed to it."""
+    server = StandInServer((host, port), **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Run a local stand-in for YouTube and Twitch, serving made-up chats (no network access needed).',
+        formatter_class=argparse.RawTextHelpFormatter)
+
+    parser.add_argument('-host', default='127.0.0.1',
+                        help='address to listen on\n(default: %(default)s)')
+    parser.add_argument('-port', type=int, default=8000,
+                        help='port to listen on\n(default: %(default)s)')
+    parser.add_argument('-messages', type=int, default=10000,
+                        help='number of messages in the chat of each video\n(default: %(default)s)')
+    parser.add_argument('-rate', type=float, default=5,
+                        help='average number of messages per second\n(default: %(default)s)')
+    parser.add_argument('-page_size', type=int, default=100,
+                        help='number of messages in each page of YouTube chat replay\n(default: %(default)s)')
+    parser.add_argument('-twitch_page_size', type=int, default=60,
+                        help='number of comments in each page of Twitch comments\n(default: %(default)s)')
+    parser.add_argument('-timeout_ms', type=int, default=2000,
+                        help='milliseconds to wait between pages of YouTube live chat\n(default: %(default)s)')
+    parser.add_argument('-error_rate', type=float, default=0,
+                        help='fraction of requests which fail with 429 (Too Many Requests)\n(default: %(default)s)')
+    parser.add_argument('-retry_after', type=int, default=1,
+                        help='seconds given in the Retry-After header of failed requests\n(default: %(default)s)')
+    parser.add_argument('-max_requests_per_second', type=int, default=None,
+                        help='number of requests per second after which requests fail with 429\n(default: %(default)s = no limit)')
+    parser.add_argument('-latency', type=float, default=0,
+                        help='seconds to wait before each response\n(default: %(default)s)')
+    parser.add_argument('-jitter', type=float, default=0,
+                        help='maximum number of seconds randomly added to the latency\n(default: %(default)s)')
+    parser.add_argument('-seed', type=int, default=0,
+                        help='seed of the made-up chats (and errors)\n(default: %(default)s)')
+    parser.add_argument('--verbose', action='store_true',
+                        help='print every request\n(default: %(default)s)')
+
+    args = parser.parse_args()
+
+    server = StandInServer(
+        (args.host, args.port), num_of_messages=args.messages, rate=args.rate, page_size=args.page_size,
+        twitch_page_size=args.twitch_page_size, timeout_ms=args.timeout_ms, error_rate=args.error_rate,
+        retry_after=args.retry_after, max_requests_per_second=args.max_requests_per_second,
+        latency=args.latency, jitter=args.jitter, seed=args.seed, verbose=args.verbose)
+
+    print('Serving on {0} (use -youtube_home {0} -twitch_api {0})'.format(server.url), flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print('Served {} requests ({} failed).'.format(
+            server.num_of_requests, server.num_of_errors))
+    finally:
+        server.server_close()
@@ -1,8 +1,17 @@
 from chat_replay_downloader import *
+import chat_replay_downloader
+import run_server
+import contextlib
+import csv
+import json
 import os
 import sys
 import subprocess
 import inspect
+import tempfile
+import threading
+import time
+import random
 
 
 def do_nothing(item):
@@ -52,6 +61,10 @@ def create_test(
 
     data['command'] = 'python chat_replay_downloader.py "{}"{}{}'.format(
         url, '' if len(args) == 0 else ' ', ' '.join(args))
+
+    # the same command, as a list of arguments (so that it can be run without a shell)
+    data['arguments'] = [sys.executable, 'chat_replay_downloader.py', url] + [
+        argument for (key, value) in final.items() for argument in ('-{}'.format(key), str(value))]
     return data
 
 
@@ -140,6 +153,7 @@ twitch_errors = [
 ]
 
 ### CONTROLS ###
+offline = True
 run = True
 document = True
 
@@ -157,6 +171,420 @@ def print_test(test):
     print('({}) {:=^120}'.format(counter, ' '+test['name']+' '))
 
 
+def simulate_requests(scheduler, url, seconds, rate, rejected, delays=None):
+    """
+    Make requests to url at the given rate for some (simulated) seconds, recording a 429 response
+    (with Retry-After: 0) for those where rejected(index) is true. Returns the scheduler's final rate.
+    The delay of each request is appended to delays (if given).
+    """
+    now = [1000]  # as time.monotonic() is, some time after the system started
+    monotonic = time.monotonic
+    chat_replay_downloader.time.monotonic = lambda: now[0]
+    try:
+        for index in range(int(seconds * rate)):
+            delay = scheduler.reserve(url)
+            if(delays is not None):
+                delays.append(delay)
+            now[0] += 1 / rate + delay
+            scheduler.record(url, 0, 429 if rejected(index) else 200, '0')
+    finally:
+        chat_replay_downloader.time.monotonic = monotonic
+    return scheduler.get_rate(url)
+
+
+def test_isolated_throttling():
+    """Isolated 429s (e.g. random errors) are only retried, while dense ones slow requests down."""
+    url = 'https://www.youtube.com/'
+
+    # one rejection every 3 seconds (so never three within a few seconds)
+    rate = simulate_requests(RequestScheduler(
+        max_rate=10), url, 60, 10, lambda index: index % 30 == 0)
+    assert rate == 10, rate
+
+    # 30% of requests rejected, at random
+    random_rejections = random.Random(0)
+    rate = simulate_requests(RequestScheduler(
+        max_rate=10), url, 60, 10, lambda index: random_rejections.random() < 0.3)
+    assert rate > 1, rate
+
+    # every request rejected
+    rate = simulate_requests(RequestScheduler(
+        max_rate=10), url, 20, 10, lambda index: True)
+    assert rate <= 1, rate
+
+    # without a rate limit, requests are not delayed until one is set (after the third rejection),
+    # and then the first request after it is delayed too
+    delays = []
+    simulate_requests(RequestScheduler(), url, 1, 10,
+                      lambda index: index >= 5, delays)
+    assert delays[:8] == [0] * 8, delays
+    assert delays[8] > 0, delays
+
+
+@contextlib.contextmanager
+def stand_in_server(**kwargs):
+    """Run a stand-in for YouTube and Twitch (see run_server.py) while the block runs."""
+    server = run_server.start_server(**kwargs)
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def twitch_fields(messages):
+    """The fields of Twitch messages which do not depend on the time zone (unlike timestamps)."""
+    return [(message['time_in_seconds'], message['author'], message['message']) for message in messages]
+
+
+def test_download_messages():
+    """Messages downloaded from the stand-in server are those of its chat, filtered by type and time."""
+    video_id = 'downloadabc'
+    chat = run_server.make_chat(video_id, 500)
+    with stand_in_server(num_of_messages=500) as server, ChatReplayDownloader(
+            youtube_home=server.url, twitch_api=server.url) as chat_downloader:
+        assert list(chat_downloader.iter_youtube_messages(
+            video_id, message_type='all')) == chat
+        assert list(chat_downloader.iter_youtube_messages(video_id)) == [
+            message for message in chat if 'amount' not in message]
+        assert list(chat_downloader.iter_youtube_messages(video_id, message_type='superchat')) == [
+            message for message in chat if 'amount' in message]
+        assert list(chat_downloader.iter_youtube_messages(video_id, start_time=20, end_time='0:40', message_type='all')) == [
+            message for message in chat if 20 <= message['time_in_seconds'] <= 40]
+
+        twitch_chat = run_server.make_chat('123456789', 500)
+        assert twitch_fields(chat_downloader.iter_twitch_messages('123456789')) == [
+            (message['video_offset_time_msec'] / 1000, message['author'], message['message']) for message in twitch_chat]
+
+
+def test_segments():
+    """Chats downloaded in segments are the same as those downloaded in one go (with no duplicates at the boundaries)."""
+    video_id = 'segmentsabc'
+    chat = run_server.make_chat(video_id, 2000)
+    with stand_in_server(num_of_messages=2000) as server, ChatReplayDownloader(
+            youtube_home=server.url, twitch_api=server.url) as chat_downloader:
+        for segments in (2, 5):
+            assert list(chat_downloader.iter_youtube_messages(
+                video_id, message_type='all', segments=segments)) == chat
+            assert list(chat_downloader.iter_youtube_messages(video_id, start_time=30, end_time=250, message_type='all', segments=segments)) == [
+                message for message in chat if 30 <= message['time_in_seconds'] <= 250]
+
+        twitch_messages = list(
+            chat_downloader.iter_twitch_messages('123456789'))
+        assert len(twitch_messages) == 2000
+        for segments in (2, 5):
+            assert twitch_fields(chat_downloader.iter_twitch_messages(
+                '123456789', segments=segments)) == twitch_fields(twitch_messages)
+            assert twitch_fields(chat_downloader.iter_twitch_messages('123456789', start_time=30, end_time=250, segments=segments)) == twitch_fields(
+                chat_downloader.iter_twitch_messages('123456789', start_time=30, end_time=250))
+
+
+def test_resume():
+    """A download which is interrupted (in the middle of a page) and resumed from its checkpoint writes every message once."""
+    with stand_in_server(num_of_messages=1000) as server, ChatReplayDownloader(
+            youtube_home=server.url, twitch_api=server.url) as chat_downloader, tempfile.TemporaryDirectory() as directory:
+        for url in ('https://www.youtube.com/watch?v=resumeresum', 'https://www.twitch.tv/videos/123456789'):
+            for extension in ('jsonl', 'csv', 'txt', 'sqlite'):
+                expected = os.path.join(directory, 'expected.' + extension)
+                with get_writer(expected, chat_downloader.message_to_string, 'site', 'video') as writer:
+                    for message in chat_downloader.iter_chat_replay(url, start_time=10, message_type='all'):
+                        writer.write(message)
+                expected_num_of_messages = writer.num_of_messages
+
+                output = os.path.join(directory, 'output.' + extension)
+                arguments = {'url': url, 'start_time': 10}
+                checkpoint = Checkpoint(output + '.checkpoint', arguments)
+                with get_writer(output, chat_downloader.message_to_string, 'site', 'video') as writer:
+                    messages = chat_downloader.iter_chat_replay(
+                        url, start_time=10, message_type='all', state=checkpoint.state)
+                    for index, message in enumerate(messages):
+                        writer.write(message)
+                        if(index == 250):
+                            checkpoint.save(writer)
+                        elif(index == 345):
+                            break  # interrupted, after more messages than were checkpointed
+                    messages.close()
+
+                checkpoint = Checkpoint.load(
+                    output + '.checkpoint', arguments)
+                with get_writer(output, chat_downloader.message_to_string, 'site', 'video', offset=checkpoint.output_offset,
+                                num_of_messages=checkpoint.num_of_messages) as writer:
+                    for message in chat_downloader.iter_chat_replay(url, start_time=10, message_type='all', state=checkpoint.state):
+                        writer.write(message)
+                    assert writer.num_of_messages == expected_num_of_messages
+                checkpoint.remove()
+
+                if(extension == 'sqlite'):
+                    assert load_sqlite(output) == load_sqlite(expected)
+                else:
+                    with open(output, encoding='utf-8') as f, open(expected, encoding='utf-8') as g:
+                        assert f.read() == g.read(), (url, extension)
+                assert not os.path.exists(output + '.checkpoint')
+
+
+def test_time_index():
+    """Downloads which use the time index get the same messages, even once the indexed continuations stop working."""
+    video_id = 'indexindexi'
+    chat = run_server.make_chat(video_id, 2000)
+    with stand_in_server(num_of_messages=2000) as server, tempfile.TemporaryDirectory() as directory:
+        def download(start_time):
+            with ChatReplayDownloader(youtube_home=server.url, time_index=TimeIndex(directory, interval=10)) as chat_downloader:
+                return list(chat_downloader.iter_youtube_messages(video_id, start_time=start_time, message_type='all'))
+
+        assert download(0) == chat
+        assert download(300) == [
+            message for message in chat if message['time_in_seconds'] >= 300]
+
+        # the continuations in the index are no longer accepted
+        file_name = os.path.join(directory, video_id + '.json')
+        with open(file_name, encoding='utf-8') as f:
+            index = json.load(f)
+        index['continuations'] = {
+            title: video_id + '.expired' for title in index['continuations']}
+        index['checkpoints'] = {video_id + '.expired': [[offset, video_id + '.expired'] for offset, continuation in checkpoints]
+                                for checkpoints in index['checkpoints'].values()}
+        with open(file_name, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        for start_time in (300, 0):
+            assert download(start_time) == [
+                message for message in chat if message['time_in_seconds'] >= start_time]
+
+
+def test_response_cache():
+    """Cached responses are used instead of requests, until they expire or are evicted."""
+    video_id = 'cachecachec'
+    chat = run_server.make_chat(video_id, 500)
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResponseCache(directory)
+        with stand_in_server(num_of_messages=500) as server:
+            url = server.url
+            with ChatReplayDownloader(youtube_home=url, cache=cache) as chat_downloader:
+                assert list(chat_downloader.iter_youtube_messages(
+                    video_id, message_type='all')) == chat
+        # the server has stopped, so every response must come from the cache
+        with ChatReplayDownloader(youtube_home=url, cache=cache) as chat_downloader:
+            assert list(chat_downloader.iter_youtube_messages(
+                video_id, message_type='all')) == chat
+            assert chat_downloader.stats.to_dict()['requests'] == 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResponseCache(directory, ttl=0.2)
+        cache.set('a', b'content')
+        assert cache.get('a') == b'content'
+        time.sleep(0.3)
+        assert cache.get('a') is None
+
+    # the least recently used entries are removed, until the cache is below 90% of its maximum size
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResponseCache(directory, max_size=3500, compress=False)
+        for url in ('a', 'b', 'c'):
+            cache.set(url, bytes(1000))
+            time.sleep(0.01)
+        assert cache.get('a') is not None
+        cache.set('d', bytes(1000))
+        assert [url for url in 'abcd' if cache.get(url) is not None] == [
+            'a', 'c', 'd']
+
+    # entries are evicted (and expire) while other threads use the cache
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResponseCache(directory, ttl=0.05, max_size=20000)
+        errors = []
+
+        def use_cache(thread):
+            try:
+                for index in range(200):
+                    cache.set('{}/{}'.format(thread, index), os.urandom(500))
+                    cache.get('{}/{}'.format(thread, index - 5))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=use_cache, args=(thread,))
+                   for thread in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors, errors
+
+
+def test_chat_messages():
+    """Compact downloads give ChatMessage records, which read the same as the message dictionaries."""
+    video_id = 'compactcomp'
+    chat = run_server.make_chat(video_id, 1000)
+    with stand_in_server(num_of_messages=1000) as server, ChatReplayDownloader(
+            youtube_home=server.url, compact=True) as chat_downloader:
+        messages = list(chat_downloader.iter_youtube_messages(
+            video_id, message_type='all'))
+    assert all(type(message) is ChatMessage for message in messages)
+    assert messages == chat
+    assert [message.to_dict() for message in messages] == chat
+
+    superchat = next(message for message in messages if 'amount' in message)
+    assert superchat['body_color'] == {
+        'rgba': [0, 229, 255, 255], 'hex': '#00e5ffff'}
+    assert ChatMessage.from_dict(superchat.to_dict()) == superchat
+    assert superchat.get('ticker_duration') is None
+    assert 'ticker_duration' not in superchat
+    try:
+        superchat['ticker_duration']
+        assert False, 'missing fields are not set'
+    except KeyError:
+        pass
+
+
+def test_writers():
+    """Every type of output file holds the downloaded messages, and writers are never flushed after they are closed."""
+    video_id = 'writerwrite'
+    chat = run_server.make_chat(video_id, 500)
+    with stand_in_server(num_of_messages=500) as server, ChatReplayDownloader(
+            youtube_home=server.url) as chat_downloader, tempfile.TemporaryDirectory() as directory:
+        extensions = ['txt', 'json', 'jsonl', 'csv', 'sqlite']
+        if(chat_replay_downloader.pyarrow is not None):
+            extensions.append('parquet')
+        for extension in extensions:
+            output = os.path.join(directory, 'output.' + extension)
+            with get_writer(output, chat_downloader.message_to_string, 'youtube', video_id, flush_every=100) as writer:
+                for message in chat_downloader.iter_youtube_messages(video_id, message_type='all'):
+                    writer.write(message)
+            assert writer.num_of_messages == len(chat)
+
+            if(extension in ('json', 'jsonl', 'txt', 'csv')):
+                with open(output, encoding='utf-8') as f:
+                    if(extension == 'json'):
+                        assert json.load(f) == chat
+                    elif(extension == 'jsonl'):
+                        assert [json.loads(line) for line in f] == chat
+                    elif(extension == 'txt'):
+                        assert f.read().splitlines() == [
+                            chat_downloader.message_to_string(message) for message in chat]
+                    else:
+                        assert [(row['author'], row['message']) for row in csv.DictReader(f)] == [
+                            (message['author'], message['message']) for message in chat]
+            elif(extension == 'sqlite'):
+                assert load_sqlite(output) == chat
+            else:
+                # missing fields are null, and colours are packed into integers
+                assert [{key: value for key, value in row.items() if value is not None} for row in load_columnar(output).to_pylist()] == [
+                    {key: pack_colour(value) if key in ChatMessage.COLOUR_KEYS else value for key, value in message.items()} for message in chat]
+
+        # the periodic flush must not run into close()
+        errors = []
+        excepthook = threading.excepthook
+        threading.excepthook = lambda args: errors.append(args.exc_value)
+        try:
+            for index in range(1000):
+                with JSONLinesWriter(os.path.join(directory, 'flushed.jsonl'), flush_interval=0.0001) as writer:
+                    for message in chat[:10]:
+                        writer.write(message)
+            time.sleep(0.1)
+        finally:
+            threading.excepthook = excepthook
+        assert not errors, errors
+
+
+def test_throttled_download():
+    """Downloads retry requests which are rejected (429), and still get every message."""
+    video_id = 'throttledab'
+    chat = run_server.make_chat(video_id, 1000)
+    with stand_in_server(num_of_messages=1000, page_size=50, error_rate=0.2, retry_after=0) as server, ChatReplayDownloader(
+            youtube_home=server.url, twitch_api=server.url, scheduler=RequestScheduler(backoff=0.01)) as chat_downloader:
+        assert list(chat_downloader.iter_youtube_messages(
+            video_id, message_type='all')) == chat
+        assert len(list(chat_downloader.iter_twitch_messages('123456789'))) == 1000
+        assert server.num_of_errors > 0
+        assert chat_downloader.stats.to_dict()['retries'] == server.num_of_errors
+
+
+def test_merge_ranges():
+    """Overlapping and touching ranges are merged, and an end_time of None lasts until the end of the video."""
+    merge_ranges = ArchiveCatalog.merge_ranges
+    assert merge_ranges([]) == []
+    assert merge_ranges([(50, 60), (0, 10), (10, 20), (15, 18)]) == [
+        (0, 20), (50, 60)]
+    assert merge_ranges([(30, None), (0, 10), (40, 50)]) == [
+        (0, 10), (30, None)]
+    assert merge_ranges([(0, 10), (5, None)]) == [(0, None)]
+
+
+def test_missing_ranges():
+    """Only the ranges which are not stored are missing (including the times at which they meet stored ranges)."""
+    with tempfile.TemporaryDirectory() as directory:
+        with ArchiveCatalog(os.path.join(directory, 'archive.sqlite')) as catalog:
+            assert catalog.get_missing_ranges(
+                'youtube', 'x', 0, None) == [(0, None)]
+
+            catalog.add_range('youtube', 'x', 10, 20)
+            catalog.add_range('youtube', 'x', 40, 50)
+            assert catalog.get_missing_ranges('youtube', 'x', 0, None) == [
+                (0, 10), (20, 40), (50, None)]
+            assert catalog.get_missing_ranges(
+                'youtube', 'x', 15, 45) == [(20, 40)]
+            assert catalog.get_missing_ranges(
+                'youtube', 'x', 12, 18) == []
+
+            # ranges are kept by type of message, and 'all' counts for every type
+            assert catalog.get_missing_ranges(
+                'youtube', 'x', 0, 30, 'superchat') == [(0, 30)]
+            catalog.add_range('youtube', 'x', 0, None, 'all')
+            assert catalog.get_missing_ranges('youtube', 'x', 0, None) == []
+
+
+def test_partial_sync():
+    """A sync which stops early only records what it stored, so that the next sync downloads the rest."""
+    video_id = 'syncsyncsyn'
+    url = 'https://www.youtube.com/watch?v={}'.format(video_id)
+    messages = run_server.make_chat(video_id, 1000)
+
+    # the continuations of the pages after the first five stop working
+    get_replay_page = run_server.StandInRequestHandler.get_replay_page
+
+    def get_broken_replay_page(handler, continuation, offset_milliseconds):
+        position = continuation.split('.', 1)[1]
+        if(position.isdigit() and int(position) >= 500):
+            return {'response': {}}
+        return get_replay_page(handler, continuation, offset_milliseconds)
+
+    with stand_in_server(num_of_messages=1000) as server, tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, 'archive.sqlite')
+        with ChatReplayDownloader(youtube_home=server.url) as chat_downloader:
+            batch_downloader = BatchDownloader(chat_downloader)
+
+            run_server.StandInRequestHandler.get_replay_page = get_broken_replay_page
+            try:
+                result = batch_downloader.sync_one(
+                    url, output, message_type='all')
+            finally:
+                run_server.StandInRequestHandler.get_replay_page = get_replay_page
+            assert result['error'] is not None, result
+            with ArchiveCatalog(output) as catalog:
+                ranges = catalog.get_ranges(
+                    'youtube', video_id, 'all')
+            # stored until the time before that of the last message written (more may have its time)
+            times = [message['time_in_seconds']
+                     for message in messages[:500]]
+            assert ranges == [
+                (0, max(time for time in times if time < times[-1]))], ranges
+
+            result = batch_downloader.sync_one(
+                url, output, message_type='all')
+            assert result['error'] is None, result
+            assert result['ranges'] == [(ranges[0][1], None)], result
+            assert load_sqlite(output) == messages
+
+
+offline_tests = [test_isolated_throttling, test_download_messages, test_segments, test_resume, test_time_index, test_response_cache,
+                 test_chat_messages, test_writers, test_throttled_download, test_merge_ranges, test_missing_ranges,
+                 test_partial_sync]
+
+if offline:
+    print('Begin running offline tests.')
+
+    for test in offline_tests:
+        print('Running', test.__name__)
+        test()
+    print()
+
+
 if run:
     counter = 1
 
@@ -195,8 +623,8 @@ if run:
             new_command = '{} -output "{}"'.format(test['command'], name)
             print('Running "{}"'.format(new_command))
             if(test not in error_tests):
-                subprocess.Popen(
-                    '{} --hide_output'.format(new_command)).communicate()
+                subprocess.run(test['arguments'] +
+                               ['-output', name, '--hide_output'])
         counter += 1
         print()
 